@@ -0,0 +1,113 @@
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aisaac.aisaac.core import resampling
+from aisaac.aisaac.core.evaluator import Evaluator
+
+
+class BatchEvaluator(Evaluator):
+    def __init__(self, context_manager):
+        """
+        Initialize an evaluator for many screening runs, such as the runs of a configuration sweep. The gold standard
+        is read once for all runs, the runs are evaluated in EVALUATION_WORKERS parallel threads and nothing is
+        plotted, so that the evaluation never blocks.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        super().__init__(context_manager)
+        self.workers = max(1, int(context_manager.get_config('EVALUATION_WORKERS')))
+        self.full_result_directory = self.system_manager.get_full_path(context_manager.get_config('RESULT_PATH'))
+        self.comparison_file = context_manager.get_config('RUN_COMPARISON_FILE')
+
+    def find_result_files(self, result_files):
+        """
+        Find the result files of the runs.
+
+        :param result_files: A glob pattern or a list of paths and glob patterns. Relative paths are taken from
+        RESULT_PATH.
+        :return: The sorted paths of the result files, without the run configurations and comparison files.
+        """
+        if isinstance(result_files, str):
+            result_files = [result_files]
+        paths = set()
+        for pattern in result_files:
+            if not os.path.isabs(pattern):
+                pattern = os.path.join(self.full_result_directory, pattern)
+            paths.update(glob.glob(pattern) if glob.has_magic(pattern) else [pattern])
+        comparison_paths = {self.__get_comparison_path(extension) for extension in ('csv', 'json')}
+        return sorted(path for path in paths if not path.endswith(('.json', '.jsonl')) and path not in comparison_paths)
+
+    def evaluate_run(self, result_path):
+        """
+        Evaluate one run without plotting.
+
+        :param result_path: The path of the result file.
+        :return: A dictionary with the file, its configuration fingerprint, the metrics and the timings of the run.
+        """
+        start_time = time.perf_counter()
+        snapshot = self.get_snapshot(result_path)
+        tp, tn, fp, fn = snapshot['counts']
+        metrics = {metric: float(value) for metric, value in resampling.calculate_metrics(tp, tn, fp, fn).items()}
+        run_configuration = self.read_run_configuration(result_path)
+        return {
+            'result_file': os.path.basename(result_path),
+            'fingerprint': run_configuration.get('fingerprint'),
+            'rag_model': run_configuration.get('config', {}).get('RAG_MODEL'),
+            'TP': tp,
+            'TN': tn,
+            'FP': fp,
+            'FN': fn,
+            **metrics,
+            'accuracy': self.calculate_accuracy(tp, tn, fp, fn) if tp + tn + fp + fn else None,
+            'fmi': self.calculate_fowlkes_mallows_index(tp, tn, fp, fn),
+            'completion_rate': float(snapshot['completion_rate']),
+            'screening_seconds': run_configuration.get('screening_seconds'),
+            'evaluation_seconds': time.perf_counter() - start_time,
+        }
+
+    def read_run_configuration(self, result_path):
+        try:
+            with open(self.result_saver.get_run_configuration_path(result_path)) as configuration_file:
+                return json.load(configuration_file)
+        except (OSError, ValueError):
+            return {}
+
+    def evaluate_runs(self, result_files, save=True):
+        """
+        Evaluate many runs in parallel and compare them in one table.
+
+        :param result_files: A glob pattern or a list of paths and glob patterns, see find_result_files.
+        :param save: Whether to write the table to RUN_COMPARISON_FILE in RESULT_PATH as CSV and JSON.
+        :return: One dictionary per run, see evaluate_run, in the order of the result files.
+        """
+        result_paths = self.find_result_files(result_files)
+        self.logger.info(f"Evaluating {len(result_paths)} runs with {self.workers} workers.")
+        # the gold standard is read before the workers start, so that they all share it
+        self.get_gold_standard()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.evaluate_run, result_path) for result_path in result_paths]
+        comparison = []
+        for result_path, future in zip(result_paths, futures):
+            try:
+                comparison.append(future.result())
+            except Exception as e:
+                self.logger.error(f"Error evaluating {result_path}: {e}")
+        if save and self.comparison_file:
+            self.save_comparison(comparison)
+        return comparison
+
+    def save_comparison(self, comparison):
+        fieldnames = list(dict.fromkeys(key for row in comparison for key in row))
+        with open(self.__get_comparison_path('csv'), 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(comparison)
+        with open(self.__get_comparison_path('json'), 'w') as json_file:
+            json.dump(comparison, json_file, indent=2, default=str)
+
+    def __get_comparison_path(self, extension):
+        return os.path.join(self.full_result_directory, f"{self.comparison_file}.{extension}")
@@ -1,16 +1,24 @@
+import ast
 import json
 import math
-import unicodedata
+import os
+import threading
 
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-from sklearn.ensemble import RandomForestClassifier
 
-from aisaac.aisaac.utils import Logger
+from aisaac.aisaac.core import resampling
+from aisaac.aisaac.utils import Logger, TitleIndex
+from aisaac.aisaac.utils.title_index import parse_decision
 
 
 class Evaluator:
+    # feature importances of result files, shared by all evaluators so that optimizer rounds on an unchanged file
+    # do not fit the classifier again
+    feature_importance_cache = {}
+    feature_importance_lock = threading.Lock()
+    feature_importance_methods = ('random_forest', 'mutual_information', 'logistic')
+
     def __init__(self, context_manager):
         self.system_manager = context_manager.get_system_manager()
         self.checkpoint_keys = list(context_manager.get_config('CHECKPOINT_DICTIONARY').keys())
@@ -20,29 +28,132 @@ class Evaluator:
             f"{context_manager.get_config('ORIGINAL_RESULT_PATH')}/{context_manager.get_config('ORIGINAL_RESULT_FILE')}")
         self.logger = Logger(__name__).get_logger()
         self.result_saver = context_manager.get_result_saver()
+        self.result_file = context_manager.get_config('RESULT_FILE')
+        self.full_figure_path = self.system_manager.get_full_path(context_manager.get_config('FIGURE_PATH'))
+        self.figure_format = context_manager.get_config('FIGURE_FORMAT')
+        self.show_figures = str(context_manager.get_config('SHOW_FIGURES')) == 'True'
+        self.title_match_cutoff = context_manager.get_config('TITLE_MATCH_CUTOFF')
+        self.feature_importance_method = context_manager.get_config('FEATURE_IMPORTANCE_METHOD')
+        if self.feature_importance_method not in self.feature_importance_methods:
+            self.feature_importance_method = 'random_forest'
+        # parsed result files, kept until one of the files changes
+        self.snapshots = {}
+        self.snapshot_lock = threading.Lock()
+        # one lock per result file, so that different files are parsed in parallel
+        self.snapshot_key_locks = {}
+        self.gold_standard_cache = None
+        self.gold_standard_lock = threading.Lock()
+
+    def get_snapshot(self, result_path=None):
+        """
+        Get the parsed results aligned with the gold standard. Both files are read and parsed once, and all metrics
+        are computed from the snapshot until one of the files changes.
+
+        :param result_path: The result file to evaluate, by default the result file of this context.
+        :return: A dictionary with the results and gold standard dataframes, the aligned y_true and y_pred arrays, the
+        (tp, tn, fp, fn) counts and the completion rate.
+        """
+        result_path = result_path or self.full_result_path
+        key = (result_path, self.full_original_result_path)
+        file_versions = (self.__get_file_version(result_path), self.__get_file_version(self.full_original_result_path))
+        with self.snapshot_lock:
+            key_lock = self.snapshot_key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.snapshot_lock:
+                snapshot = self.snapshots.get(key)
+            if snapshot is None or snapshot['file_versions'] != file_versions:
+                snapshot = self.__create_snapshot(result_path)
+                snapshot['file_versions'] = file_versions
+                with self.snapshot_lock:
+                    self.snapshots[key] = snapshot
+        return snapshot
+
+    def clear_snapshots(self):
+        with self.snapshot_lock:
+            self.snapshots.clear()
+        with self.gold_standard_lock:
+            self.gold_standard_cache = None
+
+    def get_gold_standard(self):
+        """
+        Get the gold standard dataframe. The file is read once and shared by the snapshots of all result files until
+        it changes.
+        """
+        return self.__get_gold_standard_cache()[1]
+
+    def get_gold_standard_index(self):
+        """
+        Get the title index of the gold standard, which maps every title to its gold decision. It is built once
+        together with the gold standard dataframe, see TitleIndex for how titles are matched.
+        """
+        return self.__get_gold_standard_cache()[2]
+
+    def __get_gold_standard_cache(self):
+        version = self.__get_file_version(self.full_original_result_path)
+        with self.gold_standard_lock:
+            if self.gold_standard_cache is None or self.gold_standard_cache[0] != version:
+                gold_standard = pd.read_csv(self.full_original_result_path)
+                title_index = self.create_title_index(gold_standard, self.get_title_match_cutoff())
+                self.gold_standard_cache = (version, gold_standard, title_index)
+            return self.gold_standard_cache
+
+    def get_title_match_cutoff(self):
+        return None if self.title_match_cutoff is None else float(self.title_match_cutoff)
+
+    @staticmethod
+    def create_title_index(gold_standard, fuzzy_cutoff=None):
+        """
+        Create the title index of a gold standard dataframe with the title in the first and the gold decision in the
+        second column.
+        """
+        return TitleIndex.from_decisions(dict(zip(gold_standard.iloc[:, 0], gold_standard.iloc[:, 1])), fuzzy_cutoff)
+
+    def get_title_match_report(self, result_path=None):
+        """
+        Report how the titles of a result file match the gold standard.
+
+        :param result_path: The result file to evaluate, by default the result file of this context.
+        :return: The report of TitleIndex.get_match_report, with the titles that are not in the gold standard and the
+        gold standard titles that are not in the result file.
+        """
+        snapshot = self.get_snapshot(result_path)
+        return snapshot['title_index'].get_match_report(snapshot['results']['title'].dropna())
+
+    @staticmethod
+    def __get_file_version(path):
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    def __create_snapshot(self, result_path):
+        results = self.read_results_dataframe(result_path)
+        _version, gold_standard, title_index = self.__get_gold_standard_cache()
+        y_true, y_pred = self.align_predictions(gold_standard, results.loc[:, ['title', 'relevant']], title_index)
+        counts = (int(np.count_nonzero((y_true == True) & (y_pred == True))),
+                  int(np.count_nonzero((y_true == False) & (y_pred == False))),
+                  int(np.count_nonzero((y_true == False) & (y_pred == True))),
+                  int(np.count_nonzero((y_true == True) & (y_pred == False))))
+        # rows without a result have an empty relevant column
+        screened_rows = results[results['title'] != '.idea']
+        completed = screened_rows['relevant'].notna() & (screened_rows['relevant'].astype(str) != "")
+        completion_rate = completed.sum() / len(screened_rows)
+        return {
+            'results': results,
+            'gold_standard': gold_standard,
+            'title_index': title_index,
+            'y_true': y_true,
+            'y_pred': y_pred,
+            'counts': counts,
+            'completion_rate': completion_rate,
+        }
 
     def get_tp_tn_fp_fn(self):
-        y_true, y_pred = self.get_y_true_y_pred()
-
-        tp = sum((y_true == True) & (y_pred == True))
-        tn = sum((y_true == False) & (y_pred == False))
-        fp = sum((y_true == False) & (y_pred == True))
-        fn = sum((y_true == True) & (y_pred == False))
-
-        return tp, tn, fp, fn
+        return self.get_snapshot()['counts']
 
     def get_completion_rate(self):
-        data = self.result_saver.read_csv_to_dict_relevant_only(self.full_result_path)
-        total = len(data)
-        completed = 0
-        for title in data:
-            # check if there is a result for this entry
-            if title == '.idea':
-                total -= 1
-                continue
-            if data[title] is not None and data[title] != "":
-                completed += 1
-        return completed / total
+        return self.get_snapshot()['completion_rate']
 
     def calculate_mcc(self, tp, tn, fp, fn):
         # to all variables, add one so that we don't get a 0-division error
@@ -81,43 +192,179 @@ class Evaluator:
             'FN': fn
         }
 
-    def draw_confusion_matrix(self, confusion_matrix):
-        plt.figure(figsize=(10, 7))
-        plt.imshow([[confusion_matrix['TP'], confusion_matrix['FN']], [confusion_matrix['FP'], confusion_matrix['TN']]],
-                   cmap='Blues')
-        plt.colorbar()
-        plt.xticks([0, 1], ['Predicted Positive', 'Predicted Negative'])
-        plt.yticks([0, 1], ['Actual Positive', 'Actual Negative'])
-        plt.xlabel('Predicted')
-        plt.ylabel('Actual')
-        plt.title('Confusion Matrix')
-        plt.show()
-
-    # Function to extract values from dictionary and return as Series
-    def extract_values(self, row, key):
-        dict_str = row['checkpoints']
-        if pd.isna(dict_str):  # Handling NaN values
-            return None
-        # Preprocess the string to replace single quotes with double quotes
-        dict_str = dict_str.strip().replace("'", "\"")
-        dict_str = dict_str.replace('True', 'true').replace('False', 'false')
+    def create_figure(self, figsize=None):
+        """
+        Create an empty figure. Matplotlib is only imported here, so that evaluations without plots never load it.
+        Unless SHOW_FIGURES is True, the figure is not attached to pyplot and no GUI backend is used.
+        """
+        if self.show_figures:
+            from matplotlib import pyplot as plt
+            return plt.figure(figsize=figsize)
+        from matplotlib.figure import Figure
+        return Figure(figsize=figsize)
+
+    def save_figure(self, figure, name):
+        """
+        Save a figure as FIGURE_FORMAT to FIGURE_PATH, named after the result file, and show it if SHOW_FIGURES is
+        True.
+
+        :return: The path of the saved figure.
+        """
+        os.makedirs(self.full_figure_path, exist_ok=True)
+        result_name = os.path.splitext(os.path.basename(self.result_file))[0]
+        figure_path = os.path.join(self.full_figure_path, f"{result_name}_{name}.{self.figure_format}")
+        figure.savefig(figure_path, dpi=300)
+        self.logger.info(f"Saved the {name.replace('_', ' ')} to {figure_path}")
+        if self.show_figures:
+            from matplotlib import pyplot as plt
+            plt.show()
+        return figure_path
 
-        dict_obj = json.loads(dict_str)
-        return dict_obj.get(key)
+    def draw_confusion_matrix(self, confusion_matrix):
+        figure = self.create_figure(figsize=(10, 7))
+        axes = figure.add_subplot()
+        image = axes.imshow([[confusion_matrix['TP'], confusion_matrix['FN']],
+                             [confusion_matrix['FP'], confusion_matrix['TN']]], cmap='Blues')
+        figure.colorbar(image)
+        axes.set_xticks([0, 1], ['Predicted Positive', 'Predicted Negative'])
+        axes.set_yticks([0, 1], ['Actual Positive', 'Actual Negative'])
+        axes.set_xlabel('Predicted')
+        axes.set_ylabel('Actual')
+        axes.set_title('Confusion Matrix')
+        return self.save_figure(figure, 'confusion_matrix')
 
     def get_results_dataframe(self):
-        df_results = pd.read_csv(self.full_result_path)
+        return self.get_snapshot()['results'].copy()
 
-        # Add columns to df for each key in the dictionary
-        for key in self.checkpoint_keys:
-            df_results[key] = df_results.apply(lambda row: self.extract_values(row, key), axis=1)
+    def read_results_dataframe(self, result_path):
+        df_results = pd.read_csv(result_path)
+        # one column per checkpoint, parsed in one pass
+        checkpoint_columns = self.parse_checkpoint_column(df_results['checkpoints'])
 
         # Drop the original dictionary column if needed
-        df_results.drop(columns=['checkpoints'], inplace=True)
-        df_results.drop(columns=['converted'], inplace=True)
-        df_results.drop(columns=['embedded'], inplace=True)
-        df_results.drop(columns=['reasoning'], inplace=True)
-        return df_results
+        df_results = df_results.drop(columns=['checkpoints', 'converted', 'embedded', 'reasoning', 'confidence'],
+                                     errors='ignore')
+        return pd.concat([df_results, checkpoint_columns], axis=1)
+
+    def parse_checkpoint_column(self, column):
+        """
+        Parse a column of checkpoint dictionaries into one column per checkpoint. Every distinct dictionary is parsed
+        once, since most rows of a result file share one of a few verdict combinations.
+
+        :param column: The checkpoints column of a result file, with JSON or Python dictionaries as text.
+        :return: A dataframe with a column per checkpoint key holding True, False or None.
+        """
+        codes, unique_values = pd.factorize(column)
+        # the last row stays None for rows without checkpoints
+        table = np.full((len(unique_values) + 1, len(self.checkpoint_keys)), None, dtype=object)
+        for row, value in enumerate(unique_values):
+            checkpoints = self.parse_checkpoints(value)
+            table[row] = [checkpoints.get(key) for key in self.checkpoint_keys]
+        return pd.DataFrame(table[codes], columns=self.checkpoint_keys, index=column.index)
+
+    def read_confidence_dataframe(self, result_path):
+        """
+        Read the self-rated confidences of a result file, in the row order of read_results_dataframe.
+
+        :return: A dataframe with a float column per checkpoint key, NaN where there is no confidence.
+        """
+        df_results = pd.read_csv(result_path)
+        column = df_results['confidence'] if 'confidence' in df_results else [None] * len(df_results)
+        table = np.full((len(column), len(self.checkpoint_keys)), np.nan)
+        for row, value in enumerate(column):
+            try:
+                confidence = json.loads(value) if isinstance(value, str) and value else {}
+            except ValueError:
+                continue
+            for index, key in enumerate(self.checkpoint_keys):
+                if isinstance(confidence.get(key), (int, float)):
+                    table[row, index] = confidence[key]
+        return pd.DataFrame(table, columns=self.checkpoint_keys)
+
+    def sweep_decision_rules(self, result_path=None, thresholds=None):
+        """
+        Score alternative rules that combine the checkpoint verdicts into a relevance decision, without screening
+        again. All rules are applied at once to the stored matrix of verdicts and confidences. The rules are
+        "k_of_n" (relevant if at least k checkpoints are true, k = n is the rule used while screening), "drop_one"
+        (all checkpoints but the given one are true), and "min_probability" and "mean_probability" (the smallest or
+        mean probability of the checkpoints reaches the threshold). Checkpoints without a confidence count with
+        probability 1 if they are true and 0 otherwise.
+
+        :param result_path: The result file to evaluate, by default the result file of this context.
+        :param thresholds: The probability thresholds to try, by default 0.05 to 0.95 in steps of 0.05.
+        :return: A dataframe with the rule, its parameter, the confusion counts and the metrics of every rule, the
+        best MCC first.
+        """
+        thresholds = np.round(np.arange(0.05, 1.0, 0.05), 2) if thresholds is None else np.asarray(thresholds)
+        result_path = result_path or self.full_result_path
+        snapshot = self.get_snapshot(result_path)
+        if 'confidences' not in snapshot:
+            snapshot['confidences'] = self.read_confidence_dataframe(result_path)
+        verdicts, probabilities, y_true = self.__get_decision_matrix(snapshot)
+
+        checkpoint_count = len(self.checkpoint_keys)
+        true_counts = verdicts.sum(axis=1)
+        rules = ([('k_of_n', k) for k in range(1, checkpoint_count + 1)]
+                 + [('drop_one', key) for key in self.checkpoint_keys]
+                 + [('min_probability', float(threshold)) for threshold in thresholds]
+                 + [('mean_probability', float(threshold)) for threshold in thresholds])
+        # one column per rule
+        decisions = np.concatenate([
+            true_counts[:, None] >= np.arange(1, checkpoint_count + 1)[None, :],
+            true_counts[:, None] - verdicts == checkpoint_count - 1,
+            probabilities.min(axis=1, initial=1.0)[:, None] >= thresholds[None, :],
+            probabilities.mean(axis=1)[:, None] >= thresholds[None, :],
+        ], axis=1)
+
+        tp = (decisions & y_true[:, None]).sum(axis=0)
+        fp = (decisions & ~y_true[:, None]).sum(axis=0)
+        fn = (~decisions & y_true[:, None]).sum(axis=0)
+        tn = len(y_true) - tp - fp - fn
+        sweep = pd.DataFrame({
+            'rule': [rule for rule, _parameter in rules],
+            'parameter': [parameter for _rule, parameter in rules],
+            'TP': tp,
+            'TN': tn,
+            'FP': fp,
+            'FN': fn,
+            **resampling.calculate_metrics(tp, tn, fp, fn),
+        })
+        return sweep.sort_values('mcc', ascending=False, kind='stable').reset_index(drop=True)
+
+    def __get_decision_matrix(self, snapshot):
+        results = snapshot['results']
+        title_index = snapshot['title_index']
+        rows = self.match_rows(title_index, results['title'])
+        row_positions = np.fromiter(rows.values(), dtype=int, count=len(rows))
+        verdicts = results[self.checkpoint_keys].iloc[row_positions]
+        decided = verdicts.isin([True, False]).all(axis=1).values
+        y_true = np.fromiter((title_index.values[title] for title in rows), dtype=bool, count=len(rows))[decided]
+        verdicts = verdicts[decided].values.astype(bool)
+        probabilities = snapshot['confidences'].values[row_positions[decided]]
+        probabilities = np.where(np.isnan(probabilities), verdicts, probabilities)
+        return verdicts, probabilities, y_true
+
+    def parse_checkpoints(self, value):
+        """
+        Parse one checkpoints dictionary. Result files store it as JSON, older ones as a Python dictionary.
+
+        :return: A dictionary with the verdict of every checkpoint, as booleans where possible.
+        """
+        if isinstance(value, dict):
+            checkpoints = value
+        else:
+            try:
+                checkpoints = json.loads(value)
+            except ValueError:
+                try:
+                    checkpoints = ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    self.logger.warning(f"Could not parse the checkpoints {value}")
+                    return {}
+        if not isinstance(checkpoints, dict):
+            return {}
+        return {key: {'true': True, 'false': False}.get(verdict.strip().lower(), verdict)
+                if isinstance(verdict, str) else verdict for key, verdict in checkpoints.items()}
 
     def get_results_dataframe_title_relevant_column(self):
         df_results = self.get_results_dataframe()
@@ -125,23 +372,51 @@ class Evaluator:
         return df_results
 
     def get_gold_standard_dataframe(self):
-        df_results = pd.read_csv(self.full_original_result_path)
-        return df_results
-
-    def get_feature_importance(self):
-        clf = self.get_trained_classifier()
-
-        # Get feature importances
-        feature_importances = clf.feature_importances_
+        return self.get_snapshot()['gold_standard'].copy()
+
+    def get_feature_importance(self, method=None):
+        """
+        Get how much every checkpoint explains the relevance decisions. The importances are cached by the version of
+        the result file, so they are only computed again when the file changes.
+
+        :param method: "random_forest" for the impurity importances of a random forest, "mutual_information" for the
+        mutual information of every checkpoint with the decision, or "logistic" for the absolute coefficients of a
+        logistic regression. The last two are fast enough for optimizer loops. By default FEATURE_IMPORTANCE_METHOD.
+        All methods return non-negative importances that sum to 1, or 0 if nothing can be learned.
+        :return: An array with one importance per checkpoint.
+        """
+        method = method or self.feature_importance_method
+        snapshot = self.get_snapshot()
+        key = (self.full_result_path, snapshot['file_versions'], method, tuple(self.checkpoint_keys))
+        with self.feature_importance_lock:
+            feature_importances = self.feature_importance_cache.get(key)
+        if feature_importances is None:
+            if method == 'mutual_information':
+                feature_importances = self.__get_mutual_information()
+            elif method == 'logistic':
+                feature_importances = self.__get_logistic_importance()
+            else:
+                feature_importances = self.get_trained_classifier().feature_importances_
+            with self.feature_importance_lock:
+                self.feature_importance_cache[key] = feature_importances
 
         # Print feature importances
         for i, importance in enumerate(feature_importances):
             self.logger.info(f"Feature {self.checkpoint_keys[i]}: Importance Score = {importance}")
 
-        return feature_importances
+        return feature_importances.copy()
 
-    def get_trained_classifier(self):
-        gold_standard = self.get_gold_standard_dataframe()
+    @classmethod
+    def clear_feature_importance_cache(cls):
+        with cls.feature_importance_lock:
+            cls.feature_importance_cache.clear()
+
+    def get_feature_matrix(self):
+        """
+        Get the checkpoint decisions and the relevance decisions of the screened documents.
+
+        :return: The X matrix with one column per checkpoint and the y array.
+        """
         predictions = self.get_results_dataframe()
         # Drop rows with missing values
         predictions_cleaned = predictions.dropna()
@@ -150,14 +425,59 @@ class Evaluator:
         predictions_preprocessed = predictions_cleaned.replace(
             {'True': True, 'False': False, 'true': True, 'false': False})
 
-        X = predictions_preprocessed.iloc[:, 2:].values  # Assuming features are columns 2 through last
-        y = predictions_preprocessed.iloc[:, 1].values  # Assuming the second column contains the label 'relevant'
+        # keep the rows with decisions only, as booleans, since classifiers cannot fit object arrays
+        decided = predictions_preprocessed.iloc[:, 1:].isin([True, False]).all(axis=1)
+        predictions_preprocessed = predictions_preprocessed[decided]
+
+        X = predictions_preprocessed.iloc[:, 2:].values.astype(bool)  # Assuming features are columns 2 through last
+        y = predictions_preprocessed.iloc[:, 1].values.astype(bool)  # Assuming the second column is 'relevant'
+        return X, y
+
+    def get_trained_classifier(self):
+        X, y = self.get_feature_matrix()
+
+        from sklearn.ensemble import RandomForestClassifier
 
-        # Initialize and train random forest classifier
-        clf = RandomForestClassifier(n_estimators=500, random_state=42)
+        # Initialize and train random forest classifier, with one tree per core at a time
+        clf = RandomForestClassifier(n_estimators=500, random_state=42, n_jobs=-1)
         clf.fit(X, y)
         return clf
 
+    @staticmethod
+    def normalize_importances(importances):
+        total = importances.sum()
+        return importances / total if total > 0 else np.zeros_like(importances)
+
+    def __get_mutual_information(self):
+        X, y = self.get_feature_matrix()
+        n = len(y)
+        if n == 0:
+            return np.zeros(X.shape[1])
+        # the 2x2 contingency table of every checkpoint with the decision
+        n11 = (X & y[:, None]).sum(axis=0).astype(float)
+        n10 = X.sum(axis=0) - n11
+        n01 = y.sum() - n11
+        n00 = n - n11 - n10 - n01
+        mutual_information = np.zeros(X.shape[1])
+        for joint, feature_count, label_count in ((n11, n11 + n10, n11 + n01), (n10, n11 + n10, n00 + n10),
+                                                  (n01, n01 + n00, n11 + n01), (n00, n01 + n00, n00 + n10)):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                terms = joint / n * np.log(joint * n / (feature_count * label_count))
+            mutual_information += np.where(joint > 0, terms, 0.0)
+        return self.normalize_importances(np.maximum(mutual_information, 0.0))
+
+    def __get_logistic_importance(self):
+        X, y = self.get_feature_matrix()
+        if len(np.unique(y)) < 2:
+            return np.zeros(X.shape[1])
+
+        from sklearn.linear_model import LogisticRegression
+
+        # the features are binary, so the absolute coefficients are comparable without scaling
+        classifier = LogisticRegression(max_iter=1000)
+        classifier.fit(X, y)
+        return self.normalize_importances(np.abs(classifier.coef_[0]))
+
     def draw_feature_importance(self, feature_importances):
         # Create a DataFrame to store feature importances with corresponding keys
         importance_df = pd.DataFrame({'Feature': self.checkpoint_keys, 'Importance': feature_importances})
@@ -165,42 +485,125 @@ class Evaluator:
         # Sort feature importances in descending order
         importance_df_sorted = importance_df.sort_values(by='Importance', ascending=False)
 
-        plt.ylabel('Feature Importance')
-        plt.bar(range(len(importance_df_sorted)), importance_df_sorted['Importance'], align='center')
+        figure = self.create_figure()
+        axes = figure.add_subplot()
+        axes.set_ylabel('Feature Importance')
+        axes.bar(range(len(importance_df_sorted)), importance_df_sorted['Importance'], align='center')
 
-        plt.xticks(range(len(importance_df_sorted)), importance_df_sorted['Feature'], rotation=90)
-        plt.xlim([-1, len(importance_df_sorted)])
+        axes.set_xticks(range(len(importance_df_sorted)), importance_df_sorted['Feature'], rotation=90)
+        axes.set_xlim([-1, len(importance_df_sorted)])
 
-        plt.tight_layout()
-        # plt.savefig('feature-importance.pdf', dpi=300)
-        plt.show()
+        figure.tight_layout()
+        return self.save_figure(figure, 'feature_importance')
 
     def get_y_true_y_pred(self):
-        gold_standard = self.get_gold_standard_dataframe()
-        predictions = self.get_results_dataframe_title_relevant_column()
-        # Drop rows with missing values
-        gold_standard_cleaned = gold_standard.dropna()
-        predictions_cleaned = predictions.dropna()
-
-        # Remove leading and trailing quotation marks and normalize umlauts in the gold standard
-        gold_standard_cleaned.iloc[:, 0] = gold_standard_cleaned.iloc[:, 0].str.strip('"').apply(normalize_string)
-
-        # Normalize umlauts in the predictions cleaned
-        predictions_cleaned.iloc[:, 0] = predictions_cleaned.iloc[:, 0].apply(normalize_string)
-        # Ensure alignment by merging on a common identifier (assuming the first column is the identifier)
-        merged = gold_standard_cleaned.merge(predictions_cleaned, on=gold_standard_cleaned.columns[0],
-                                             suffixes=('_gold', '_pred'))
-
-        # Drop rows with any missing values in the merged dataframe
-        merged_cleaned = merged.dropna()
-        merge_preprocessed = merged_cleaned.replace({'True': True, 'False': False, 'true': True, 'false': False})
-        # merge_preprocessed = merged_cleaned
-
-        # Extract y_true and y_pred from the cleaned, merged dataframe
-        y_true = merge_preprocessed.iloc[:, 1].values
-        y_pred = merge_preprocessed.iloc[:, 2].values
+        snapshot = self.get_snapshot()
+        return snapshot['y_true'], snapshot['y_pred']
+
+    @staticmethod
+    def match_rows(title_index, titles):
+        """
+        Match titles, such as the titles of a result file, with the gold standard.
+
+        :param title_index: The title index of the gold standard.
+        :param titles: The titles to match.
+        :return: A dictionary with the position of the matching title for every matched gold standard title, see
+        TitleIndex.match_positions. Titles that lose their gold standard title to a better match are logged.
+        """
+        rows, conflicts = title_index.match_positions(titles)
+        if conflicts:
+            logger = Logger(__name__).get_logger()
+            for title, gold_title, claiming_title in conflicts:
+                logger.warning(f"{title} matches the gold standard title {gold_title}, which {claiming_title} "
+                               f"already matches. Leaving {title} out of the evaluation.")
+        return rows
+
+    @staticmethod
+    def get_decisions(title_index, predictions):
+        """
+        Get the predicted decision of every gold standard title.
+
+        :param predictions: A dataframe with the title in the first and the predicted decision in the second column.
+        :return: A dictionary with the decision of every matched gold standard title that has a decision.
+        """
+        decisions = {}
+        for gold_title, position in Evaluator.match_rows(title_index, predictions.iloc[:, 0]).items():
+            decision = parse_decision(predictions.iloc[position, 1])
+            if decision is not None:
+                decisions[gold_title] = decision
+        return decisions
+
+    @staticmethod
+    def align_predictions(gold_standard, predictions, title_index=None):
+        """
+        Align the predictions with the gold standard by title. The titles are matched through the title index of the
+        gold standard, so that titles that only differ in quotation marks, case, punctuation or whitespace still
+        match.
+
+        :param gold_standard: A dataframe with the title in the first and the gold decision in the second column.
+        :param predictions: A dataframe with the title in the first and the predicted decision in the second column.
+        :param title_index: The title index of the gold standard, built from gold_standard if not given.
+        :return: The y_true and y_pred arrays of the titles with a decision in both dataframes.
+        """
+        title_index = title_index or Evaluator.create_title_index(gold_standard)
+        decisions = Evaluator.get_decisions(title_index, predictions)
+        y_true = np.fromiter((title_index.values[title] for title in decisions), dtype=bool, count=len(decisions))
+        y_pred = np.fromiter(decisions.values(), dtype=bool, count=len(decisions))
         return y_true, y_pred
 
+    @staticmethod
+    def align_paired_predictions(gold_standard, predictions_a, predictions_b, title_index=None):
+        """
+        Align two sets of predictions with the gold standard by title, keeping the titles with a decision in all three.
+
+        :param gold_standard: A dataframe with the title in the first and the gold decision in the second column.
+        :param predictions_a: A dataframe with the title in the first and the predicted decision in the second column.
+        :param predictions_b: A dataframe like predictions_a.
+        :param title_index: The title index of the gold standard, built from gold_standard if not given.
+        :return: The y_true, y_pred_a and y_pred_b arrays.
+        """
+        title_index = title_index or Evaluator.create_title_index(gold_standard)
+        decisions_a = Evaluator.get_decisions(title_index, predictions_a)
+        decisions_b = Evaluator.get_decisions(title_index, predictions_b)
+        titles = [title for title in decisions_a if title in decisions_b]
+        return (np.array([title_index.values[title] for title in titles], dtype=bool),
+                np.array([decisions_a[title] for title in titles], dtype=bool),
+                np.array([decisions_b[title] for title in titles], dtype=bool))
+
+    def get_bootstrap_intervals(self, result_path=None, n_resamples=2000, confidence=0.95, seed=None):
+        """
+        Get bootstrap confidence intervals of the MCC, Cohen's kappa, F1-score, PABAK, sensitivity and specificity.
+
+        :param result_path: The result file to evaluate, by default the result file of this context.
+        :param n_resamples: The number of bootstrap resamples.
+        :param confidence: The confidence level of the intervals.
+        :param seed: The seed of the random generator, for reproducible intervals.
+        :return: A dictionary with the estimate and the lower and upper bound of every metric.
+        """
+        snapshot = self.get_snapshot(result_path)
+        return resampling.bootstrap_intervals(snapshot['y_true'], snapshot['y_pred'], n_resamples=n_resamples,
+                                              confidence=confidence, seed=seed)
+
+    def compare_result_files(self, other_result_path, result_path=None, n_resamples=2000, confidence=0.95,
+                             seed=None):
+        """
+        Compare the metrics of two result files on the papers both of them decided, with a paired bootstrap for the
+        confidence interval of every difference and a paired permutation test for its p-value.
+
+        :param other_result_path: The result file to compare with.
+        :param result_path: The result file to evaluate, by default the result file of this context.
+        :return: A dictionary with the difference (result_path - other_result_path), its lower and upper bound and the
+        p-value of every metric.
+        """
+        snapshot = self.get_snapshot(result_path)
+        other_snapshot = self.get_snapshot(other_result_path)
+        y_true, y_pred_a, y_pred_b = self.align_paired_predictions(
+            snapshot['gold_standard'], snapshot['results'].loc[:, ['title', 'relevant']],
+            other_snapshot['results'].loc[:, ['title', 'relevant']], snapshot['title_index'])
+        self.logger.info(f"Comparing the result files on {len(y_true)} papers.")
+        return resampling.paired_comparison(y_true, y_pred_a, y_pred_b, n_resamples=n_resamples,
+                                            confidence=confidence, seed=seed)
+
     def get_cohen_kappa(self):
         from sklearn.metrics import cohen_kappa_score
         y_true, y_pred = self.get_y_true_y_pred()
@@ -248,35 +651,31 @@ class Evaluator:
         return mcc, f_score, feature_importance, confusion_matrix, specificity, sensitivity, cohens_kappa, fmi, completion_rate
 
     def get_evaluation_dict(self):
-        y_true, y_pred = self.get_y_true_y_pred()
-        record2answer = self.result_saver.read_csv_to_dict_relevant_only(self.full_result_path)
-        # drop all the records that are not in the original result file
-        missing_records = self.result_saver.read_csv_to_dict_relevant_only(self.full_original_result_path)
-
+        tp, tn, fp, fn = self.get_tp_tn_fp_fn()
         return {
-            "TP": self.get_tp_tn_fp_fn()[0],
-            "TN": self.get_tp_tn_fp_fn()[1],
-            "FP": self.get_tp_tn_fp_fn()[2],
-            "FN": self.get_tp_tn_fp_fn()[3],
-            "Confusion Matri x": self.generate_confusion_matrix(*self.get_tp_tn_fp_fn()),
+            "TP": tp,
+            "TN": tn,
+            "FP": fp,
+            "FN": fn,
+            "Confusion Matri x": self.generate_confusion_matrix(tp, tn, fp, fn),
             "ratio_of_completion": self.get_completion_rate(),
             "Precision": self.calculate_precision(),
             "Recall": self.calculate_recall(),
             "F1-score": self.calculate_f1_score(),
-            "Matthews correlation coefficient": self.calculate_mcc(*self.get_tp_tn_fp_fn()),
+            "Matthews correlation coefficient": self.calculate_mcc(tp, tn, fp, fn),
             "Cohen's kappa": self.get_cohen_kappa(),
             "PABAK": self.calculate_pabak(),
             'ratio_of_completion': self.get_completion_rate(),
-            'succesfully_analyzed_articles': sum(self.get_tp_tn_fp_fn()),
-            'articles_that_did_not_have_predictions': 159 - sum(self.get_tp_tn_fp_fn()),
+            'succesfully_analyzed_articles': tp + tn + fp + fn,
+            'articles_that_did_not_have_predictions': 159 - (tp + tn + fp + fn),
         }
 
     def calculate_precision(self):
-        tp, fp = self.get_tp_tn_fp_fn()[0], self.get_tp_tn_fp_fn()[2]
+        tp, _tn, fp, _fn = self.get_tp_tn_fp_fn()
         return tp / (tp + fp)
 
     def calculate_recall(self):
-        tp, fn = self.get_tp_tn_fp_fn()[0], self.get_tp_tn_fp_fn()[3]
+        tp, _tn, _fp, fn = self.get_tp_tn_fp_fn()
         return tp / (tp + fn)
 
     def calculate_f1_score(self):
@@ -284,9 +683,4 @@ class Evaluator:
         recall = self.calculate_recall()
         return 2 * precision * recall / (precision + recall)
 
-
-def normalize_string(s):
-    # Normalize the string to NFC form
-    return unicodedata.normalize('NFC', s)
-
 # %%
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+
+from aisaac.aisaac.core.evaluator import Evaluator
+
+
+class LiveEvaluator(Evaluator):
+    def __init__(self, context_manager):
+        """
+        Initialize an evaluator that follows a running screening. It listens to the responses saved by the
+        ResultSaver, updates the confusion counts with every response and writes a snapshot of the metrics every
+        LIVE_METRICS_INTERVAL responses to the log and, if LIVE_METRICS_FILE is set, as a JSON line to that file in
+        RESULT_PATH.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        super().__init__(context_manager)
+        self.interval = max(1, int(context_manager.get_config('LIVE_METRICS_INTERVAL')))
+        metrics_file = context_manager.get_config('LIVE_METRICS_FILE')
+        self.full_metrics_path = self.system_manager.get_full_path(
+            f"{context_manager.get_config('RESULT_PATH')}/{metrics_file}") if metrics_file else None
+        self.gold_standard_index = self.get_gold_standard_index()
+        self.lock = threading.Lock()
+        self.total = len(self.gold_standard_index.titles)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {'TP': 0, 'TN': 0, 'FP': 0, 'FN': 0}
+            # the confusion cell of every screened title, so that a title screened again replaces its old result
+            self.cells = {}
+            self.updates = 0
+
+    def start(self, total=None):
+        """
+        Start following the saved responses.
+
+        :param total: The number of documents of the run, by default the size of the gold standard.
+        """
+        if total is not None:
+            self.total = total
+        self.reset()
+        self.result_saver.add_listener(self.update)
+
+    def stop(self):
+        """
+        Stop following the saved responses and emit a last snapshot.
+        """
+        self.result_saver.remove_listener(self.update)
+        return self.emit_snapshot()
+
+    def update(self, title, relevant, checkpoints=None):
+        """
+        Count one saved response.
+
+        :param title: The title of the document.
+        :param relevant: The relevance decision, or None if the document has no decision.
+        :param checkpoints: The checkpoints of the response.
+        """
+        # a title without a gold decision is still counted as screened, under its own name
+        title = self.gold_standard_index.match(title) or title
+        gold_decision = self.gold_standard_index.get(title)
+        cell = None
+        if relevant is not None and gold_decision is not None:
+            cell = ('T' if bool(relevant) == gold_decision else 'F') + ('P' if relevant else 'N')
+        with self.lock:
+            previous_cell = self.cells.get(title)
+            if previous_cell is not None:
+                self.counts[previous_cell] -= 1
+            if cell is not None:
+                self.counts[cell] += 1
+            self.cells[title] = cell
+            self.updates += 1
+            emit = self.updates % self.interval == 0
+        if emit:
+            self.emit_snapshot()
+
+    def get_live_metrics(self):
+        """
+        Get the metrics of the responses so far.
+
+        :return: A dictionary with the confusion counts, MCC, sensitivity, specificity and completion rate.
+        """
+        with self.lock:
+            tp, tn, fp, fn = (self.counts[cell] for cell in ('TP', 'TN', 'FP', 'FN'))
+            screened = len(self.cells)
+            decided = sum(1 for cell in self.cells.values() if cell is not None)
+        return {
+            'screened': screened,
+            'total': self.total,
+            'completion_rate': screened / self.total if self.total else 0.0,
+            'evaluated': decided,
+            'TP': tp,
+            'TN': tn,
+            'FP': fp,
+            'FN': fn,
+            'mcc': self.calculate_mcc(tp, tn, fp, fn),
+            'sensitivity': self.calculate_sensitivity(tp, fn) if tp + fn else None,
+            'specificity': self.calculate_specificity(tn, fp) if tn + fp else None,
+        }
+
+    def emit_snapshot(self):
+        metrics = self.get_live_metrics()
+        self.logger.info(f"Live metrics after {metrics['screened']} of {metrics['total']} documents: "
+                         f"MCC {metrics['mcc']:.3f}, sensitivity {metrics['sensitivity']}, "
+                         f"specificity {metrics['specificity']}")
+        if self.full_metrics_path is not None:
+            with open(self.full_metrics_path, 'a') as metrics_file:
+                metrics_file.write(json.dumps({'time': time.time(), **metrics}) + "\n")
+        return metrics
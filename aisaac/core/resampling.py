@@ -0,0 +1,138 @@
+import numpy as np
+
+METRICS = ('mcc', 'kappa', 'f1', 'pabak', 'sensitivity', 'specificity')
+
+# the number of sampled indices held in memory at once
+max_chunk_elements = 2 ** 22
+
+
+def encode_cells(y_true, y_pred):
+    """
+    Encode every pair of decisions as its cell of the confusion matrix: 0 = TN, 1 = FP, 2 = FN, 3 = TP.
+    """
+    return 2 * np.asarray(y_true, dtype=np.int64) + np.asarray(y_pred, dtype=np.int64)
+
+
+def count_cells(cells, indices):
+    """
+    Count the confusion cells of many resamples at once.
+
+    :param cells: The encoded cells of the papers, see encode_cells.
+    :param indices: A matrix with one resample of paper indices per row, or a matrix of cells if cells is None.
+    :return: The tp, tn, fp and fn arrays with one count per resample.
+    """
+    sampled = indices if cells is None else cells[indices]
+    offsets = 4 * np.arange(sampled.shape[0])[:, None]
+    counts = np.bincount((sampled + offsets).ravel(), minlength=4 * sampled.shape[0]).reshape(-1, 4)
+    return counts[:, 3], counts[:, 0], counts[:, 1], counts[:, 2]
+
+
+def calculate_metrics(tp, tn, fp, fn):
+    """
+    Calculate the metrics of the Evaluator for arrays of confusion counts. The MCC is smoothed the same way as
+    Evaluator.calculate_mcc. Undefined values, such as the sensitivity without positive papers, are NaN.
+
+    :return: A dictionary with one array per metric in METRICS.
+    """
+    tp, tn, fp, fn = (np.asarray(count, dtype=float) for count in (tp, tn, fp, fn))
+    total = tp + tn + fp + fn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed_agreement = (tp + tn) / total
+        expected_agreement = ((tp + fp) * (tp + fn) + (tn + fn) * (tn + fp)) / total ** 2
+        mcc = ((tp + 1) * (tn + 1) - (fp + 1) * (fn + 1)) / np.sqrt(
+            (tp + fp + 2) * (tp + fn + 2) * (tn + fp + 2) * (tn + fn + 2))
+        return {
+            'mcc': mcc,
+            'kappa': (observed_agreement - expected_agreement) / (1 - expected_agreement),
+            'f1': tp / (tp + 0.5 * (fp + fn)),
+            'pabak': 2 * observed_agreement - 1,
+            'sensitivity': tp / (tp + fn),
+            'specificity': tn / (tn + fp),
+        }
+
+
+def iterate_index_chunks(rng, n_papers, n_resamples):
+    chunk_size = max(1, max_chunk_elements // max(1, n_papers))
+    for start in range(0, n_resamples, chunk_size):
+        yield rng.integers(0, n_papers, size=(min(chunk_size, n_resamples - start), n_papers))
+
+
+def get_interval(values, confidence):
+    alpha = (1 - confidence) / 2
+    if np.all(np.isnan(values)):
+        return np.nan, np.nan
+    lower, upper = np.nanpercentile(values, [100 * alpha, 100 * (1 - alpha)])
+    return float(lower), float(upper)
+
+
+def bootstrap_intervals(y_true, y_pred, n_resamples=2000, confidence=0.95, seed=None):
+    """
+    Estimate percentile bootstrap confidence intervals of the metrics. The papers are resampled with replacement as
+    whole matrices of indices, so that all resamples are counted without a Python loop over them.
+
+    :param y_true: The gold standard decisions.
+    :param y_pred: The predicted decisions, aligned with y_true.
+    :param n_resamples: The number of bootstrap resamples.
+    :param confidence: The confidence level of the intervals.
+    :param seed: The seed of the random generator, for reproducible intervals.
+    :return: A dictionary with the estimate and the lower and upper bound of every metric.
+    """
+    cells = encode_cells(y_true, y_pred)
+    estimates = calculate_metrics(*count_cells(cells, np.arange(len(cells))[None, :]))
+    if len(cells) == 0:
+        return {metric: {'estimate': np.nan, 'lower': np.nan, 'upper': np.nan} for metric in METRICS}
+    rng = np.random.default_rng(seed)
+    samples = {metric: [] for metric in METRICS}
+    for indices in iterate_index_chunks(rng, len(cells), n_resamples):
+        for metric, values in calculate_metrics(*count_cells(cells, indices)).items():
+            samples[metric].append(values)
+
+    intervals = {}
+    for metric in METRICS:
+        lower, upper = get_interval(np.concatenate(samples[metric]), confidence)
+        intervals[metric] = {'estimate': float(estimates[metric][0]), 'lower': lower, 'upper': upper}
+    return intervals
+
+
+def paired_comparison(y_true, y_pred_a, y_pred_b, n_resamples=2000, confidence=0.95, seed=None):
+    """
+    Compare two sets of predictions on the same papers. The confidence interval of every metric difference (a - b)
+    comes from a paired bootstrap, which resamples the same papers for both sets. The p-value comes from a paired
+    permutation test, which swaps the two predictions of randomly chosen papers.
+
+    :param y_true: The gold standard decisions.
+    :param y_pred_a: The first predictions, aligned with y_true.
+    :param y_pred_b: The second predictions, aligned with y_true.
+    :return: A dictionary with the difference, its lower and upper bound and the two-sided p-value of every metric.
+    """
+    cells_a = encode_cells(y_true, y_pred_a)
+    cells_b = encode_cells(y_true, y_pred_b)
+    all_papers = np.arange(len(cells_a))[None, :]
+    observed = calculate_metrics(*count_cells(cells_a, all_papers))
+    observed_b = calculate_metrics(*count_cells(cells_b, all_papers))
+    differences = {metric: float(observed[metric][0] - observed_b[metric][0]) for metric in METRICS}
+    if len(cells_a) == 0:
+        return {metric: {'difference': np.nan, 'lower': np.nan, 'upper': np.nan, 'p_value': np.nan}
+                for metric in METRICS}
+
+    rng = np.random.default_rng(seed)
+    bootstrap_samples = {metric: [] for metric in METRICS}
+    exceedances = {metric: 0 for metric in METRICS}
+    for indices in iterate_index_chunks(rng, len(cells_a), n_resamples):
+        metrics_a = calculate_metrics(*count_cells(cells_a, indices))
+        metrics_b = calculate_metrics(*count_cells(cells_b, indices))
+
+        swapped = rng.random(indices.shape) < 0.5
+        permuted_a = calculate_metrics(*count_cells(None, np.where(swapped, cells_b, cells_a)))
+        permuted_b = calculate_metrics(*count_cells(None, np.where(swapped, cells_a, cells_b)))
+        for metric in METRICS:
+            bootstrap_samples[metric].append(metrics_a[metric] - metrics_b[metric])
+            permuted_differences = np.abs(permuted_a[metric] - permuted_b[metric])
+            exceedances[metric] += int(np.count_nonzero(permuted_differences >= abs(differences[metric]) - 1e-12))
+
+    comparison = {}
+    for metric in METRICS:
+        lower, upper = get_interval(np.concatenate(bootstrap_samples[metric]), confidence)
+        p_value = (exceedances[metric] + 1) / (n_resamples + 1) if not np.isnan(differences[metric]) else np.nan
+        comparison[metric] = {'difference': differences[metric], 'lower': lower, 'upper': upper, 'p_value': p_value}
+    return comparison
@@ -1,13 +1,20 @@
+import math
 import os
+import statistics
 import time
+from collections import deque
 
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.utils.json import parse_json_markdown
 
-from aisaac.aisaac.utils import Logger
+from aisaac.aisaac.core.live_evaluator import LiveEvaluator
+from aisaac.aisaac.utils import EarlyStopping, JsonCompletionDetector, Logger
+from aisaac.aisaac.utils.context_assembler import ContextBudgetExceededError
+from aisaac.aisaac.utils.pooled_models import ModelServerError
 
 import requests
-from requests.exceptions import ConnectionError, HTTPError
+from requests.exceptions import RequestException
 from urllib3.exceptions import NewConnectionError, MaxRetryError
 from http.client import RemoteDisconnected
 
@@ -18,8 +25,28 @@ class Screener:
         self.mm = context_manager.get_model_manager()
         self.dm = context_manager.get_document_data_manager()
         self.checkpoints = context_manager.get_config('CHECKPOINT_DICTIONARY')
+        self.context_manager = context_manager
         self.similarity_searcher = context_manager.get_similarity_searcher()
-        self.prompt_template = """
+        self.context_assembler = context_manager.get_context_assembler()
+        self.warm_up_models = str(context_manager.get_config('WARM_UP_MODELS')) == 'True'
+        self.max_retries = int(context_manager.get_config('MAX_SCREENING_RETRIES'))
+        self.health_wait_timeout = float(context_manager.get_config('HEALTH_WAIT_TIMEOUT'))
+        self.health_monitor = self.mm.health_monitor
+        self.failed_titles = []
+        self.screening_order = context_manager.get_config('SCREENING_ORDER')
+        self.early_stopping = EarlyStopping(context_manager)
+        self.skipped_titles = []
+        self.batch_prompt_size = max(1, int(context_manager.get_config('BATCH_PROMPT_SIZE')))
+        self.batch_statistics = {'batch_prompts': 0, 'batched_documents': 0, 'fallback_documents': 0}
+        self.live_evaluator = LiveEvaluator(context_manager) \
+            if str(context_manager.get_config('LIVE_METRICS')) == 'True' else None
+        self.streaming_generation = str(context_manager.get_config('STREAMING_GENERATION')) == 'True'
+        self.checkpoint_confidence = str(context_manager.get_config('CHECKPOINT_CONFIDENCE')) == 'True'
+        self.reasoning_mode = context_manager.get_config('REASONING_MODE')
+        if self.reasoning_mode not in ('full', 'short', 'none'):
+            self.reasoning_mode = 'full'
+        self.prompt_templates = {
+            'default': """
         [INST]
         Answer the question based only on the following context:
         
@@ -32,6 +59,37 @@ class Screener:
         Answer the question based on the above context: {question}
         {format_instructions}
         [/INST]
+        """,
+            # everything that is the same for all documents comes first, so that the server can reuse the cached
+            # prefix of the previous prompt and only has to process the context
+            'prefix_cache': """
+        [INST]
+        With the following checkpoints: {checkpoints}
+        
+        Answer the question based only on the context below: {question}
+        {format_instructions}
+        
+        ---
+        
+        Context:
+        
+        {context}
+        [/INST]
+        """,
+        }
+        self.prompt_layout = context_manager.get_config('PROMPT_LAYOUT')
+        if self.prompt_layout not in self.prompt_templates:
+            self.prompt_layout = 'default'
+        self.prompt_template = self.prompt_templates[self.prompt_layout]
+        self.batch_prompt_template = """
+        [INST]
+        With the following checkpoints: {checkpoints}
+        
+        Answer the question separately for each document below, based only on the context of that document: {question}
+        {format_instructions}
+        
+        {documents}
+        [/INST]
         """
         self.question = "Which of the checkpoints are true for this document and why?"
         self.logger = Logger(__name__).get_logger()
@@ -40,31 +98,246 @@ class Screener:
         if checkpoints is None:
             checkpoints = self.checkpoints
         titles = self.dm.get_runnable_titles()
+        if self.screening_order == 'priority' or self.early_stopping.is_enabled():
+            titles = self.prioritize_titles(titles, checkpoints)
+        self.context_assembler.configure_model(self.mm.get_rag_model())
+        if self.warm_up_models:
+            self.__warm_up_models()
+        if self.live_evaluator is not None:
+            self.live_evaluator.start(total=len(titles))
+        self.early_stopping.reset(total=len(titles))
+        if self.early_stopping.is_enabled():
+            self.result_saver.add_listener(self.early_stopping.update)
+        start_time = time.time()
+        try:
+            self.__screen_titles(titles, checkpoints)
+        finally:
+            if self.early_stopping.is_enabled():
+                self.result_saver.remove_listener(self.early_stopping.update)
+                self.logger.info(f"Early stopping: {self.early_stopping.get_statistics()}")
+            self.health_monitor.stop()
+            self.__save_run_configuration(checkpoints, time.time() - start_time)
+            if self.live_evaluator is not None:
+                self.live_evaluator.stop()
+            if self.warm_up_models:
+                self.__release_models()
+            if self.batch_prompt_size > 1:
+                self.logger.info(f"Batch prompting: {self.batch_statistics}")
+
+    def prioritize_titles(self, titles, checkpoints):
+        """
+        Order the titles so that the documents most likely to be relevant are screened first. A document is scored by
+        the maximum similarity of its chunks to each checkpoint in the corpus index, and since a relevant document
+        has to meet every checkpoint, by its lowest score. Documents missing from the index are screened last.
+
+        :param titles: The titles to order.
+        :param checkpoints: The checkpoints to score the documents with.
+        :return: The ordered titles, or the titles in their given order if there is no corpus index.
+        """
+        corpus_index = self.context_manager.get_corpus_index()
+        if not corpus_index.exists():
+            self.logger.warning("There is no corpus index to prioritize the documents with. Screening them in their "
+                                "directory order.")
+            return list(titles)
+        score_matrix = corpus_index.get_title_max_score_matrix(list(checkpoints.values()))
+        scores = dict(zip(corpus_index.titles, score_matrix.min(axis=1).tolist()))
+        return sorted(titles, key=lambda title: -scores.get(os.path.splitext(title)[0], -math.inf))
+
+    def __save_run_configuration(self, checkpoints, screening_seconds):
+        try:
+            run_configuration = self.context_manager.get_run_configuration(CHECKPOINT_DICTIONARY=checkpoints)
+            self.result_saver.save_run_configuration(run_configuration, screening_seconds)
+        except (OSError, TypeError) as e:
+            self.logger.error(f"Error saving the run configuration: {e}")
+
+    def __screen_titles(self, titles, checkpoints):
         # progress variables
         iterations = len(titles)
         counter = 0
-        for title in titles:
-            counter += 1
-            self.logger.info(f"Processing {title} \n({counter} out of {iterations})")
+        # titles that failed because of the model server are queued again instead of being skipped
+        pending_titles = deque((title, 0) for title in titles)
+        while pending_titles:
+            if self.early_stopping.should_stop():
+                self.skipped_titles = [title for title, _attempts in pending_titles]
+                self.logger.info(f"The stopping rule is met. Skipping the {len(self.skipped_titles)} documents left, "
+                                 f"the estimated recall is {self.early_stopping.get_estimated_recall():.3f}.")
+                return
+            if not self.health_monitor.wait_until_available(self.health_wait_timeout):
+                self.logger.critical(f"The model server is unavailable. Stopping with {len(pending_titles)} "
+                                     f"documents left to screen.")
+                self.failed_titles.extend(title for title, _attempts in pending_titles)
+                self.health_monitor.stop()
+                return
+            batch = [pending_titles.popleft() for _ in range(min(self.batch_prompt_size, len(pending_titles)))]
+            for title, attempts in batch:
+                if attempts == 0:
+                    counter += 1
+                self.logger.info(f"Processing {title} \n({counter} out of {iterations})")
+            failures = {}
             try:
-                response = self.craft_screening_response_for(title, checkpoints)
-                self.logger.debug(f"Response for {title}:\n{response}")
-                # remove the file extension from title. Keep in mind that the file name could have multiple dots
-                title_without_extension = os.path.splitext(title)[0]
-                self.result_saver.save_response(response, title_without_extension)
-                if(len(response['checkpoints']) > 0):
-                    self.logger.debug(f"Processed {title} successfully")
-                    self.logger.critical(f"Processed {title} successfully")
+                if len(batch) == 1:
+                    responses = {batch[0][0]: self.craft_screening_response_for(batch[0][0], checkpoints)}
                 else:
-                    self.logger.critical(f"Processed {title} unsuccessfully")
-            except (ConnectionError, HTTPError, NewConnectionError, MaxRetryError, RemoteDisconnected, ValueError) as e:
-                self.logger.error(f"Error connecting to the model: {e}. Giving it a second to recover")
-                time.sleep(10)
+                    responses = self.craft_screening_responses_for([title for title, _attempts in batch], checkpoints,
+                                                                   failures)
             except Exception as e:
-                self.logger.error(f"Error processing {title}: {e}")
+                responses = {}
+                failures = {title: e for title, _attempts in batch}
+            if responses:
+                self.health_monitor.record_success()
+            if any(self.__is_retryable(error) for error in failures.values()):
+                self.health_monitor.record_failure()
+            for title, response in responses.items():
+                self.__save_response(title, response)
+            for title, attempts in batch:
+                if title in failures:
+                    self.__handle_failure(title, attempts, failures[title], pending_titles)
+
+    @staticmethod
+    def __is_retryable(error):
+        # server and transport errors, such as a read timeout, are worth another attempt. A client error, such as a bad
+        # request or a model that was not pulled, fails the same way every time
+        return isinstance(error, (ModelServerError, RequestException, NewConnectionError, MaxRetryError,
+                                  RemoteDisconnected))
+
+    def __handle_failure(self, title, attempts, error, pending_titles):
+        if not self.__is_retryable(error):
+            self.logger.error(f"Error processing {title}: {error}")
+            self.failed_titles.append(title)
+            return
+        if attempts < self.max_retries:
+            self.logger.error(f"Error connecting to the model: {error}. Trying {title} again later.")
+            pending_titles.append((title, attempts + 1))
+        else:
+            self.logger.error(f"Error connecting to the model: {error}. Giving up on {title} after "
+                              f"{attempts + 1} attempts.")
+            self.failed_titles.append(title)
+
+    def __save_response(self, title, response):
+        try:
+            self.logger.debug(f"Response for {title}:\n{response}")
+            # remove the file extension from title. Keep in mind that the file name could have multiple dots
+            title_without_extension = os.path.splitext(title)[0]
+            self.result_saver.save_response(response, title_without_extension)
+            if(len(response['checkpoints']) > 0):
+                self.logger.debug(f"Processed {title} successfully")
+                self.logger.critical(f"Processed {title} successfully")
+            else:
+                self.logger.critical(f"Processed {title} unsuccessfully")
+        except Exception as e:
+            self.logger.error(f"Error processing {title}: {e}")
+
+    def __warm_up_models(self):
+        # a failed warm-up is not fatal, the models are then loaded by the first request
+        try:
+            self.mm.warm_up(pin=True)
+        except (RequestException, NewConnectionError, MaxRetryError, RemoteDisconnected, ValueError) as e:
+            self.logger.warning(f"Could not warm up the models: {e}")
+
+    def __release_models(self):
+        try:
+            self.mm.unpin_models()
+        except (RequestException, NewConnectionError, MaxRetryError, RemoteDisconnected, ValueError) as e:
+            self.logger.warning(f"Could not unpin the models: {e}")
+        self.logger.info(f"Model latencies: {self.mm.get_latency_report()}")
 
     def craft_screening_response_for(self, title, checkpoints):
-        context_text = self.create_context_text(title, checkpoints)
+        return self.__craft_single_response(title, checkpoints, self.create_context_text(title, checkpoints))
+
+    def craft_screening_responses_for(self, titles, checkpoints, failures=None):
+        """
+        Screen several documents with one generation. The answer is one JSON object keyed by the document titles.
+        Every verdict is checked on its own, and documents without context or without a complete verdict are
+        screened with a prompt of their own.
+
+        :param titles: The titles of the documents.
+        :param checkpoints: The checkpoints to screen for.
+        :param failures: A dictionary to collect the error of every document whose context or own prompt fails, so
+        that the responses of the other documents are kept. Without it, the first such error is raised.
+        :return: A dictionary with the response of every title that did not fail.
+        """
+        contexts = {}
+        for title in titles:
+            contexts[title] = self.__screen_document(title, failures, self.create_context_text, title, checkpoints)
+        titles = [title for title in titles if title not in (failures or {})]
+        batch_titles = [title for title in titles if contexts[title] is not None]
+        responses = {}
+        if len(batch_titles) > 1:
+            output_parser = self.get_output_parser()
+            documents = {os.path.splitext(title)[0]: contexts[title] for title in batch_titles}
+            prompt = self.create_batch_prompt(documents, checkpoints, self.get_batch_format_instructions(output_parser))
+            self.logger.debug(f"Prompt for {', '.join(batch_titles)}:\n{prompt}")
+            response_text = self.generate(self.mm.get_rag_model(), prompt)
+            verdicts = self.__parse_batch_response(response_text)
+            self.batch_statistics['batch_prompts'] += 1
+            for title in batch_titles:
+                verdict = self.__find_verdict(verdicts, os.path.splitext(title)[0])
+                if self.__verdict_complete(verdict, checkpoints):
+                    responses[title] = {"title": os.path.splitext(title)[0], "checkpoints": verdict["checkpoints"],
+                                        "reasoning": verdict.get("reasoning", {})}
+                    if self.checkpoint_confidence:
+                        responses[title]["confidence"] = verdict.get("confidence", {})
+            self.batch_statistics['batched_documents'] += len(responses)
+        fallback_titles = [title for title in titles if title not in responses]
+        if batch_titles and fallback_titles:
+            self.logger.info(f"Screening {len(fallback_titles)} documents of the batch on their own.")
+            self.batch_statistics['fallback_documents'] += len(fallback_titles)
+        for title in fallback_titles:
+            responses[title] = self.__screen_document(title, failures, self.__craft_single_response, title,
+                                                      checkpoints, contexts[title])
+        return {title: responses[title] for title in titles if title not in (failures or {})}
+
+    @staticmethod
+    def __screen_document(title, failures, function, *args):
+        if failures is None:
+            return function(*args)
+        try:
+            return function(*args)
+        except Exception as e:
+            failures[title] = e
+            return None
+
+    def get_batch_format_instructions(self, output_parser):
+        return ("The output should be a markdown code snippet formatted as a JSON object with one key per document, "
+                "including the leading and trailing \"```json\" and \"```\". The keys are the document titles and "
+                "each value follows this schema:\n\n" + output_parser.get_format_instructions(only_json=True))
+
+    def create_batch_prompt(self, documents, checkpoints, format_instructions):
+        """
+        Create the prompt to screen several documents at once.
+
+        :param documents: A dictionary with the context of every document title.
+        """
+        documents_text = "\n\n".join(f"---\n\nDocument: {title}\n\nContext:\n\n{context_text}"
+                                       for title, context_text in documents.items())
+        prompt_template = ChatPromptTemplate.from_template(self.batch_prompt_template)
+        return prompt_template.format(documents=documents_text, question=self.question, checkpoints=checkpoints,
+                                      format_instructions=format_instructions)
+
+    @staticmethod
+    def __parse_batch_response(response_text):
+        try:
+            verdicts = parse_json_markdown(response_text)
+        except Exception:
+            return {}
+        return verdicts if isinstance(verdicts, dict) else {}
+
+    @staticmethod
+    def __find_verdict(verdicts, title):
+        if title in verdicts:
+            return verdicts[title]
+        normalized_keys = {str(key).strip().casefold(): key for key in verdicts}
+        key = normalized_keys.get(title.strip().casefold())
+        return verdicts[key] if key is not None else None
+
+    @staticmethod
+    def __verdict_complete(verdict, checkpoints):
+        if not isinstance(verdict, dict) or not isinstance(verdict.get("checkpoints"), dict):
+            return False
+        values = [verdict["checkpoints"].get(name) for name in checkpoints]
+        return all(isinstance(value, bool) or str(value).strip().lower() in ('true', 'false') for value in values)
+
+    def __craft_single_response(self, title, checkpoints, context_text):
         output_parser = self.get_output_parser()
         format_instructions = output_parser.get_format_instructions()
         prompt = self.create_prompt(context_text, checkpoints, format_instructions)
@@ -72,11 +345,11 @@ class Screener:
         if context_text is None:
             return self.__get_irrelevant_response(output_parser, title, checkpoints)
         self.logger.debug(f"Prompt for {title}:\n{prompt}")
-        response_text = model.predict(prompt)
+        response_text = self.generate(model, prompt)
         counter = 0
         while not self.__response_correctly_formatted(response_text, output_parser) and counter < 5:
             self.logger.info("The response was not correctly formatted. Asking again.")
-            response_text = model.predict(prompt)
+            response_text = self.generate(model, prompt)
             counter += 1
         if counter >= 5:
             self.logger.error("The response was not correctly formatted after 5 attempts.")
@@ -87,24 +360,44 @@ class Screener:
             }
             return empty_data
         data = output_parser.parse(response_text)
+        if self.reasoning_mode == 'none':
+            data.setdefault("reasoning", {})
         return data
 
+    def generate(self, model, prompt):
+        """
+        Get the answer of the model to a prompt. With STREAMING_GENERATION, the answer is streamed and the generation
+        stops as soon as the JSON object of the answer is complete, instead of waiting for the model to stop by itself.
+        """
+        if not self.streaming_generation:
+            return model.predict(prompt)
+        detector = JsonCompletionDetector()
+        pieces = []
+        for piece in model.stream(prompt):
+            pieces.append(piece)
+            if detector.feed(piece):
+                # leaving the stream closes the connection, which makes the server stop generating
+                self.logger.debug("Stopped the generation after the answer was complete.")
+                break
+        return "".join(pieces)
+
     def create_context_text(self, title, checkpoints):
         similarity_search_results = []
-        for checkpoint in checkpoints.values():
-            result = self.similarity_searcher.similarity_search(title, checkpoint)
+        # all checkpoints are searched in one batch, so that reranking happens in a single call
+        for result in self.similarity_searcher.similarity_search_batch(title, list(checkpoints.values())):
             if len(result) > 0:
-                similarity_search_results.append(result)
+                similarity_search_results.append(self.__remove_duplicates(result))
         # check if the results are empty
         if not similarity_search_results:
             self.logger.info(f"No results found for {title}")
             return None
-        checkpoint_context_text = []
-        for result in similarity_search_results:
-            result = self.__remove_duplicates(result)
-            checkpoint_context_text.append("\n\n---\n\n".join([doc.page_content for doc, _score in result]))
-        # join the context texts of the checkpoints
-        context_text = "\n\n---\n\n".join(checkpoint_context_text)
+        # the context gets the part of the context window the rest of the prompt leaves free
+        format_instructions = self.get_output_parser().get_format_instructions()
+        reserved_tokens = self.context_assembler.count_tokens(self.create_prompt("", checkpoints, format_instructions))
+        context_text = self.context_assembler.assemble(similarity_search_results, reserved_tokens)
+        # a document without room for its context cannot be screened, unlike a document without results
+        if context_text is None:
+            raise ContextBudgetExceededError(f"No tokens are left for the context of {title}.")
         return context_text
 
     def get_output_parser(self):
@@ -112,8 +405,20 @@ class Screener:
                             ResponseSchema(name="checkpoints",
                                            description="For each Checkpoint, whether it is true or false",
                                            type="dictionary"),
-                            ResponseSchema(name="reasoning", description="Reasoning for each checkpoint",
-                                           type="dictionary"), ]
+                            ]
+        if self.reasoning_mode == 'full':
+            response_schemas.append(ResponseSchema(name="reasoning", description="Reasoning for each checkpoint",
+                                                   type="dictionary"))
+        elif self.reasoning_mode == 'short':
+            response_schemas.append(ResponseSchema(name="reasoning",
+                                                   description="Reasoning for each checkpoint in at most one short "
+                                                               "sentence",
+                                                   type="dictionary"))
+        if self.checkpoint_confidence:
+            response_schemas.append(ResponseSchema(name="confidence",
+                                                   description="For each checkpoint, the probability between 0 and 1 "
+                                                               "that it is true",
+                                                   type="dictionary"))
         output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
         return output_parser
 
@@ -130,6 +435,63 @@ class Screener:
                                         checkpoints=checkpoints, format_instructions=format_instructions)
         return prompt
 
+    def compare_prompt_layouts(self, titles, checkpoints=None, max_new_tokens=16):
+        """
+        Send the prompts of the given documents once in each prompt layout and compare the time the model spends on
+        the prompt before it generates. Nothing is saved. The prefill time is only reported by Ollama, the wall time
+        of every call is measured for all models.
+
+        Before the timed prompts of a layout, the prompt of its last document is sent once untimed, so that no layout
+        alone pays for loading the model and every layout starts with a cache filled by a prompt of its own. The
+        layouts are not alternated per document, because that would empty the prefix cache the comparison measures.
+
+        :param titles: The titles of the documents to send.
+        :param checkpoints: The checkpoints to use, by default CHECKPOINT_DICTIONARY.
+        :param max_new_tokens: The maximum number of tokens to generate per prompt, so that the length of the answers
+        does not dominate the wall time.
+        :return: A dictionary with the number of generations, the mean and median prefill seconds, the mean number of
+        prompt tokens that were not found in the cache and the mean wall seconds per layout.
+        """
+        if checkpoints is None:
+            checkpoints = self.checkpoints
+        format_instructions = self.get_output_parser().get_format_instructions()
+        model = self.mm.get_rag_model()
+        generation_kwargs = self.context_assembler.get_generation_limit(model, max_new_tokens)
+        prompt_template = self.prompt_template
+        report = {}
+        try:
+            for layout, template in self.prompt_templates.items():
+                self.prompt_template = template
+                prompts = []
+                for title in titles:
+                    context_text = self.create_context_text(title, checkpoints)
+                    if context_text is not None:
+                        prompts.append(self.create_prompt(context_text, checkpoints, format_instructions))
+                if prompts:
+                    model.predict(prompts[-1], **generation_kwargs)
+                first_generation = len(self.mm.generation_statistics)
+                wall_seconds = []
+                for prompt in prompts:
+                    start = time.perf_counter()
+                    model.predict(prompt, **generation_kwargs)
+                    wall_seconds.append(time.perf_counter() - start)
+                generations = [generation for generation in self.mm.generation_statistics[first_generation:]
+                               if generation['prefill_seconds'] is not None]
+                prefill_seconds = [generation['prefill_seconds'] for generation in generations]
+                report[layout] = {
+                    'generations': len(wall_seconds),
+                    'mean_prefill_seconds': statistics.mean(prefill_seconds) if prefill_seconds else None,
+                    'median_prefill_seconds': statistics.median(prefill_seconds) if prefill_seconds else None,
+                    'mean_prompt_tokens_evaluated': (statistics.mean(generation['prompt_tokens']
+                                                                     for generation in generations)
+                                                     if generations else None),
+                    'mean_wall_seconds': statistics.mean(wall_seconds) if wall_seconds else None,
+                }
+                self.logger.info(f"Prompt layout {layout}: {report[layout]}")
+        finally:
+            self.prompt_template = prompt_template
+        return report
+
     def __get_irrelevant_response(self, output_parser, title, checkpoints):
         pass
 
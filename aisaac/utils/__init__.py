@@ -1,15 +1,28 @@
 # Initialization code (if any)
 print("Initializing the 'utils' package")
 
+from .context_assembler import ContextAssembler
+from .corpus_index import CorpusIndex
+from .early_stopping import EarlyStopping
 from .data_manager import DocumentManager, VectorDataManager
+from .embedding_batcher import EmbeddingBatcher
+from .health_monitor import HealthMonitor
+from .http_transport import HttpTransport
 # Defining the public API
+from .json_stream import JsonCompletionDetector
+from .lexical_index import LexicalIndex
 from .logger import Logger
 from .model_manager import ModelManager
+from .reranker import CohereReranker, LocalReranker, Reranker
 from .result_saver import ResultSaver
 from .similarity_searcher import SimilaritySearcher
 from .system_manager import SystemManager
+from .title_index import TitleIndex
 #from .context_manager import ContextManager
 
 # Declaring what is public
 __all__ = ["Logger", "SystemManager", "ModelManager", "DocumentManager", "VectorDataManager", "SimilaritySearcher",
-            "ResultSaver"]
+            "ResultSaver", "CorpusIndex", "LexicalIndex",
+           "Reranker", "LocalReranker", "CohereReranker", "HttpTransport", "EmbeddingBatcher",
+           "HealthMonitor", "ContextAssembler", "JsonCompletionDetector", "TitleIndex",
+           "EarlyStopping"]
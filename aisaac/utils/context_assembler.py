@@ -0,0 +1,138 @@
+import re
+from functools import lru_cache
+
+from langchain_community.llms.ollama import Ollama
+
+from aisaac.aisaac.utils.logger import Logger
+from aisaac.aisaac.utils.pooled_models import PooledXinference
+
+token_pattern = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=65536)
+def approximate_token_count(text):
+    """
+    Approximate the number of tokens of a text without a tokenizer. Every punctuation mark counts as one token and
+    every word as one token per four characters, which slightly overestimates common subword tokenizers.
+    """
+    return sum((len(piece) + 3) // 4 for piece in token_pattern.findall(text))
+
+
+class ContextBudgetExceededError(Exception):
+    """
+    Raised when the prompt without its context already fills the context window, so that no context is left.
+    """
+
+
+class ContextAssembler:
+    separator = "\n\n---\n\n"
+
+    def __init__(self, context_manager):
+        """
+        Initialize the assembler of the retrieved context. The context of a prompt gets what is left of the model's
+        context window after the rest of the prompt and MAX_NEW_TOKENS, shared equally by the checkpoints. Each
+        checkpoint keeps its best scoring chunks that fit into its share, and a share a checkpoint does not use is
+        passed on to the others. With BATCH_PROMPT_SIZE documents per prompt, every document gets an equal part of
+        the window and MAX_NEW_TOKENS are reserved for each of them.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        self.model_manager = context_manager.get_model_manager()
+        self.max_new_tokens = int(context_manager.get_config('MAX_NEW_TOKENS'))
+        self.documents_per_prompt = max(1, int(context_manager.get_config('BATCH_PROMPT_SIZE')))
+        self.logger = Logger(__name__).get_logger()
+        token_counter = context_manager.get_config('TOKEN_COUNTER')
+        if token_counter == 'model':
+            self.logger.warning("TOKEN_COUNTER \"model\" is now called \"gpt2\". It counts with the GPT-2 tokenizer, "
+                                "not with the tokenizer of the served model.")
+            token_counter = 'gpt2'
+        self.use_gpt2_tokenizer = token_counter == 'gpt2'
+
+    def count_tokens(self, text):
+        """
+        Count the tokens of a text. Neither count is exact for the served model: the model servers do not expose
+        their tokenizers, so the approximation is used by default and the GPT-2 tokenizer of langchain, which needs
+        transformers, with TOKEN_COUNTER "gpt2".
+        """
+        if self.use_gpt2_tokenizer:
+            return self.model_manager.get_rag_model().get_num_tokens(text)
+        return approximate_token_count(text)
+
+    def get_context_window(self):
+        return self.model_manager.get_context_window()
+
+    def get_context_budget(self, reserved_tokens):
+        """
+        Get the number of tokens left for the retrieved context of one document.
+
+        :param reserved_tokens: The tokens of the prompt without the context.
+        """
+        return (self.get_context_window() - self.get_max_new_tokens() - reserved_tokens) // self.documents_per_prompt
+
+    def get_max_new_tokens(self):
+        return self.max_new_tokens * self.documents_per_prompt
+
+    def configure_model(self, model):
+        """
+        Set the context window and the maximum number of new tokens of the RAG model. The values stay the same for the
+        whole run, because Ollama reloads a model whenever its context window changes.
+        """
+        if isinstance(model, Ollama):
+            model.num_ctx = self.get_context_window()
+            model.num_predict = self.get_max_new_tokens()
+        elif isinstance(model, PooledXinference):
+            model.model_kwargs = {**(model.model_kwargs or {}), 'max_tokens': self.get_max_new_tokens()}
+
+    @staticmethod
+    def get_generation_limit(model, max_new_tokens):
+        """
+        Get the keyword arguments that limit a single call of the model to max_new_tokens, without changing the
+        settings of the model for the run.
+        """
+        if isinstance(model, Ollama):
+            return {'num_predict': max_new_tokens}
+        if isinstance(model, PooledXinference):
+            return {'generate_config': {'max_tokens': max_new_tokens}}
+        return {}
+
+    def assemble(self, checkpoint_results, reserved_tokens=0):
+        """
+        Join the retrieved chunks of all checkpoints into one context that fits the token budget. The lowest scoring
+        chunks are dropped first.
+
+        :param checkpoint_results: One list of (Document, score) tuples per checkpoint.
+        :param reserved_tokens: The tokens of the prompt without the context.
+        :return: The context text, or None if the prompt without the context leaves no tokens for it.
+        """
+        budget = self.get_context_budget(reserved_tokens)
+        if budget <= 0:
+            self.logger.error(f"The prompt takes {reserved_tokens} tokens and leaves no tokens of the context window "
+                              f"of {self.get_context_window()} for the context.")
+            return None
+        separator_tokens = self.count_tokens(self.separator)
+        chunks = [sorted(results, key=lambda result: result[1], reverse=True) for results in checkpoint_results]
+        chunk_tokens = [[self.count_tokens(doc.page_content) + separator_tokens for doc, _score in results]
+                        for results in chunks]
+
+        # the checkpoints that need the fewest tokens are served first, so that their unused share goes to the rest
+        kept_counts = [0] * len(chunks)
+        remaining_budget = budget
+        order = sorted(range(len(chunks)), key=lambda index: sum(chunk_tokens[index]))
+        for position, index in enumerate(order):
+            share = remaining_budget // (len(order) - position)
+            used_tokens = 0
+            for tokens in chunk_tokens[index]:
+                if used_tokens + tokens > share:
+                    break
+                used_tokens += tokens
+                kept_counts[index] += 1
+            remaining_budget -= used_tokens
+
+        dropped = sum(len(results) for results in chunks) - sum(kept_counts)
+        if dropped:
+            self.logger.debug(f"Dropped {dropped} chunks to fit the context budget of {budget} tokens.")
+        if chunks and not any(kept_counts):
+            self.logger.warning(f"No chunk fits the context budget of {budget} tokens, the context is empty.")
+        checkpoint_texts = [self.separator.join(doc.page_content for doc, _score in results[:kept_count])
+                            for results, kept_count in zip(chunks, kept_counts) if kept_count > 0]
+        return self.separator.join(checkpoint_texts)
@@ -1,6 +1,14 @@
+import hashlib
+import json
+import threading
+
+from aisaac.aisaac.utils import ContextAssembler
+from aisaac.aisaac.utils import CorpusIndex
 from aisaac.aisaac.utils import DocumentManager
 from aisaac.aisaac.utils import Logger
 from aisaac.aisaac.utils import ModelManager
+from aisaac.aisaac.utils import CohereReranker
+from aisaac.aisaac.utils import LocalReranker
 from aisaac.aisaac.utils import ResultSaver
 from aisaac.aisaac.utils import SimilaritySearcher
 from aisaac.aisaac.utils import SystemManager
@@ -10,23 +18,78 @@ from aisaac.aisaac.utils import VectorDataManager
 class ContextManager:
     _default_config = {
         'CHROMA_PATH': "chroma",
+        'CORPUS_INDEX_PATH': "corpus_index",
+        'CORPUS_INDEX_DTYPE': "float32",
+        'CORPUS_INDEX_RESCORE': 'True',
+        'CORPUS_INDEX_RESCORE_FACTOR': 4,
         'DATA_PATHS': ["Data/Excluded", "Data/Included"],
         'BIN_PATH': 'bin',
         'RESULT_PATH': "results",
         'RESULT_FILE': "results.csv",
         'ORIGINAL_RESULT_FILE': "original_results.csv",
         'ORIGINAL_RESULT_PATH': "gold_standard_data",
+        'TITLE_MATCH_CUTOFF': None,
         'MODEL_CLIENT_URL': "http://localhost:11434",
         'EMBEDDING_MODEL': "nomic-embed-text:latest",
         'RAG_MODEL': "mixtral:latest",
         'LOCAL_MODELS': True,
+        'HTTP_POOL_SIZE': 10,
+        'HTTP_CONNECT_TIMEOUT': 5,
+        'HTTP_READ_TIMEOUT': 600,
+        'HTTP_KEEP_ALIVE': 'True',
+        'HTTP_MAX_RETRIES': 2,
+        'MODEL_KEEP_ALIVE': "5m",
+        'WARM_UP_MODELS': 'False',
+        'MODEL_PIN_KEEP_ALIVE': "30m",
+        'EMBEDDING_MICRO_BATCHING': 'False',
+        'EMBEDDING_BATCH_ENDPOINT': 'False',
+        'EMBEDDING_BATCH_SIZE': 64,
+        'EMBEDDING_BATCH_WAIT_MS': 5,
+        'CIRCUIT_FAILURE_THRESHOLD': 3,
+        'HEALTH_BACKOFF_INITIAL': 5,
+        'HEALTH_BACKOFF_MAX': 300,
+        'HEALTH_WAIT_TIMEOUT': 3600,
+        'MAX_SCREENING_RETRIES': 3,
+        'MODEL_DISCOVERY_TTL': 300,
+        'MODEL_DISCOVERY_CACHE': 'True',
+        'MODEL_CONTEXT_WINDOW': 8192,
+        'MAX_NEW_TOKENS': 1024,
+        'TOKEN_COUNTER': "approximate",
+        'PROMPT_LAYOUT': "default",
+        'BATCH_PROMPT_SIZE': 1,
+        'STREAMING_GENERATION': 'False',
+        'REASONING_MODE': "full",
+        'CHECKPOINT_CONFIDENCE': 'False',
+        'SCREENING_ORDER': "directory",
+        'EARLY_STOPPING': "none",
+        'TARGET_RECALL': 0.95,
+        'EARLY_STOPPING_MIN_SCREENED': 100,
+        'EARLY_STOPPING_WINDOW': 50,
+        'EARLY_STOPPING_PSEUDO_COUNT': 1,
+        'EARLY_STOPPING_PATIENCE': 100,
+        'LIVE_METRICS': 'False',
+        'LIVE_METRICS_INTERVAL': 25,
+        'LIVE_METRICS_FILE': "live_metrics.jsonl",
+        'EVALUATION_WORKERS': 4,
+        'RUN_COMPARISON_FILE': "run_comparison",
+        'FIGURE_PATH': "figures",
+        'FIGURE_FORMAT': "png",
+        'SHOW_FIGURES': 'False',
         'DATA_FORMAT': "*.pdf",
         'RANDOM_SUBSET': False,
         'SUBSET_SIZE': 5,
         'RELEVANCE_THRESHOLD_CUTOFF': 0.7,
         'APPLY_RELEVANCE_THRESHOLD': True,
         'APPLY_RERANKING': False,
+        'RERANKER': "local",
+        'RERANK_TOP_N': 3,
+        'RERANK_EMBEDDING_WEIGHT': 0.5,
+        'RERANK_CACHE_SIZE': 100000,
+        'COHERE_API_KEY': None,
+        'COHERE_RERANK_MODEL': "rerank-multilingual-v2.0",
         'SIMILARITY_SEARCH_K': 4,
+        'RETRIEVAL_MODE': "vector",
+        'RRF_K': 60,
         'CHUNK_SIZE': 1000,
         'CHUNK_OVERLAP': 100,
         'VERBOSE_CODE': True,
@@ -36,7 +99,7 @@ class ContextManager:
         'BASE_DIR': 'aisaac',
         'PROMPT_TEMPLATE': None,
         'QUESTION': None,
-        'CSV_HEADER': ["title", "converted", "embedded", "relevant", "checkpoints", "reasoning"],
+        'CSV_HEADER': ["title", "converted", "embedded", "relevant", "checkpoints", "reasoning", "confidence"],
         'CHECKPOINT_DICTIONARY': {"Thyroid Cancer Types": "If the study involves any type of thyroid cancer such as "
                                                           "Papillary TC, Follicular TC, Medullary TC, "
                                                           "Poorly Differentiated TC, Anaplastic TC, Hurtle cell "
@@ -50,10 +113,56 @@ class ContextManager:
                                                       "Otherwise, if the study is conducted on an organism different "
                                                       "than human,  animals or uses cell lines,  return False."},
         'FEATURE_IMPORTANCE_THRESHOLD': 0.1,
+        'FEATURE_IMPORTANCE_METHOD': "random_forest",
         'MAX_FEATURE_IMPROVEMENT_DOCUMENTS': 20,
         'NUMBER_EXPERT_CHOICES': 3,
         'IMPORTANCE_GREATER_THAN_THRESHOLD': True,
     }
+    # The config keys every service reads and the services it is built from. Changing one of these keys through
+    # set_config drops the cached service and every service built from it, so they are rebuilt on the next get.
+    _service_config_keys = {
+        'system_manager': {'BASE_DIR'},
+        'document_data_manager': {'DATA_PATHS', 'DATA_FORMAT', 'RANDOM_SUBSET', 'SUBSET_SIZE', 'CHROMA_PATH',
+                                  'BIN_PATH', 'ORIGINAL_RESULT_PATH', 'ORIGINAL_RESULT_FILE',
+                                  'TITLE_MATCH_CUTOFF'},
+        'result_saver': {'RESULT_PATH', 'RESULT_FILE', 'CHROMA_PATH', 'RESET_RESULTS'},
+        'model_manager': {'LOCAL_MODELS', 'MODEL_CLIENT_URL', 'EMBEDDING_MODEL', 'RAG_MODEL', 'HTTP_POOL_SIZE',
+                          'HTTP_CONNECT_TIMEOUT', 'HTTP_READ_TIMEOUT', 'HTTP_KEEP_ALIVE', 'HTTP_MAX_RETRIES',
+                          'MODEL_KEEP_ALIVE', 'MODEL_PIN_KEEP_ALIVE', 'EMBEDDING_MICRO_BATCHING',
+                          'EMBEDDING_BATCH_ENDPOINT', 'EMBEDDING_BATCH_SIZE', 'EMBEDDING_BATCH_WAIT_MS',
+                          'CIRCUIT_FAILURE_THRESHOLD', 'HEALTH_BACKOFF_INITIAL', 'HEALTH_BACKOFF_MAX',
+                          'MODEL_DISCOVERY_TTL', 'MODEL_DISCOVERY_CACHE', 'BIN_HIGH_LEVEL_FOLDER',
+                          'MODEL_CONTEXT_WINDOW'},
+        'corpus_index': {'CORPUS_INDEX_PATH', 'SIMILARITY_SEARCH_K', 'CORPUS_INDEX_DTYPE', 'CORPUS_INDEX_RESCORE',
+                         'CORPUS_INDEX_RESCORE_FACTOR'},
+        'vector_data_manager': {'APPLY_SENTENCE_SPLITTING_CHUNKING', 'CHUNK_SIZE', 'CHUNK_OVERLAP', 'CHROMA_PATH'},
+        'reranker': {'RERANKER', 'RERANK_TOP_N', 'RERANK_EMBEDDING_WEIGHT', 'RERANK_CACHE_SIZE', 'COHERE_API_KEY',
+                     'COHERE_RERANK_MODEL'},
+        'context_assembler': {'MAX_NEW_TOKENS', 'TOKEN_COUNTER', 'BATCH_PROMPT_SIZE'},
+        'similarity_searcher': {'SIMILARITY_SEARCH_K', 'RELEVANCE_THRESHOLD_CUTOFF', 'APPLY_RERANKING',
+                                'APPLY_RELEVANCE_THRESHOLD', 'RETRIEVAL_MODE', 'RRF_K'},
+    }
+    _service_dependencies = {
+        'system_manager': set(),
+        'document_data_manager': {'system_manager'},
+        'result_saver': {'system_manager', 'document_data_manager'},
+        'model_manager': {'system_manager'},
+        'corpus_index': {'system_manager', 'model_manager'},
+        'vector_data_manager': {'model_manager', 'document_data_manager', 'system_manager', 'result_saver',
+                                'corpus_index'},
+        'reranker': {'model_manager'},
+        'context_assembler': {'model_manager'},
+        'similarity_searcher': {'system_manager', 'vector_data_manager', 'reranker'},
+    }
+
+    # The config keys that say where a run is stored or how it is logged, and secrets. They are left out of the
+    # configuration saved next to the results, or at least out of its fingerprint.
+    _unsaved_config_keys = {'COHERE_API_KEY'}
+    _unfingerprinted_config_keys = {'BIN_PATH', 'BIN_HIGH_LEVEL_FOLDER', 'BASE_DIR', 'RESULT_PATH', 'RESULT_FILE',
+                                    'RESET_RESULTS', 'LOGGING_LEVEL', 'VERBOSE_CODE', 'PROGRESS_BAR', 'LIVE_METRICS',
+                                    'LIVE_METRICS_INTERVAL', 'LIVE_METRICS_FILE', 'EVALUATION_WORKERS',
+                                    'RUN_COMPARISON_FILE', 'FIGURE_PATH', 'FIGURE_FORMAT', 'SHOW_FIGURES',
+                                    'RERANK_CACHE_SIZE'}
 
     def __init__(self, config=None):
         """
@@ -63,6 +172,8 @@ class ContextManager:
         """
         # Merge user-provided config with defaults. User config overrides defaults.
         self._config = {**self._default_config, **(config or {})}
+        self._services = {}
+        self._services_lock = threading.RLock()
         self.set_config('BIN_HIGH_LEVEL_FOLDER', self.get_config('BIN_PATH'))
         self.set_config('BIN_PATH', f"{self.get_config('BIN_PATH')}/{self.__hash__()}")
 
@@ -76,6 +187,22 @@ class ContextManager:
         """
         return self._config.get(key)
 
+    def get_run_configuration(self, **overrides):
+        """
+        Get the configuration of a screening run and its fingerprint. Runs with the same fingerprint only differ in
+        where they are stored and how they are logged.
+
+        :param overrides: Config values the run used instead of the ones of this context.
+        :return: A dictionary with the JSON serializable configuration and its fingerprint.
+        """
+        config = {key: value for key, value in {**self._config, **overrides}.items()
+                  if key not in self._unsaved_config_keys}
+        config = json.loads(json.dumps(config, default=str))
+        fingerprinted_config = {key: value for key, value in config.items()
+                                if key not in self._unfingerprinted_config_keys}
+        fingerprint = hashlib.sha256(json.dumps(fingerprinted_config, sort_keys=True).encode('utf-8')).hexdigest()
+        return {'config': config, 'fingerprint': fingerprint[:16]}
+
     # this might have to be deleted in order to avoid logic issues
     def set_config(self, key, value):
         """
@@ -84,43 +211,90 @@ class ContextManager:
         :param key: The configuration key to set.
         :param value: The new value for the key.
         """
+        if key in self._config and self._config[key] == value:
+            return
         self._config[key] = value
+        self.__invalidate_services(key)
+
+    def reset_services(self):
+        """
+        Drop all cached services, so that they are rebuilt on the next get.
+        """
+        with self._services_lock:
+            self._services = {}
+
+    def __get_service(self, name, factory):
+        # services are built lazily on the first get and shared afterwards
+        with self._services_lock:
+            if name not in self._services:
+                self._services[name] = factory(self)
+            return self._services[name]
+
+    def __invalidate_services(self, key):
+        invalid_services = {name for name, keys in self._service_config_keys.items() if key in keys}
+        dependent_services = invalid_services
+        while dependent_services:
+            dependent_services = {name for name, dependencies in self._service_dependencies.items()
+                                  if dependencies & invalid_services} - invalid_services
+            invalid_services |= dependent_services
+        with self._services_lock:
+            for name in invalid_services:
+                self._services.pop(name, None)
 
     def get_vector_data_manager(self):
         """
-        Get an instance of VectorDataManager for this context.
+        Get the shared instance of VectorDataManager for this context.
         """
-        return VectorDataManager(self)
+        return self.__get_service('vector_data_manager', VectorDataManager)
 
     def get_document_data_manager(self):
         """
-        Get an instance of DocumentManager for this context.
+        Get the shared instance of DocumentManager for this context.
         """
-        return DocumentManager(self)
+        return self.__get_service('document_data_manager', DocumentManager)
 
     def get_result_saver(self):
         """
-        Get an instance of ResultSaver for this context.
+        Get the shared instance of ResultSaver for this context.
         """
-        return ResultSaver(self)
+        return self.__get_service('result_saver', ResultSaver)
 
     def get_model_manager(self):
         """
-        Get an instance of ModelManager for this context.
+        Get the shared instance of ModelManager for this context.
         """
-        return ModelManager(self)
+        return self.__get_service('model_manager', ModelManager)
 
     def get_system_manager(self):
         """
-        Get an instance of SystemManager for this context.
+        Get the shared instance of SystemManager for this context.
         """
-        return SystemManager(self)
+        return self.__get_service('system_manager', SystemManager)
 
     def get_similarity_searcher(self):
         """
-        Get an instance of SimilaritySearcher for this context.
+        Get the shared instance of SimilaritySearcher for this context.
+        """
+        return self.__get_service('similarity_searcher', SimilaritySearcher)
+
+    def get_reranker(self):
+        """
+        Get the reranker configured by RERANKER for this context.
+        """
+        reranker_class = CohereReranker if self.get_config('RERANKER') == 'cohere' else LocalReranker
+        return self.__get_service('reranker', reranker_class)
+
+    def get_corpus_index(self):
+        """
+        Get the shared instance of CorpusIndex for this context.
+        """
+        return self.__get_service('corpus_index', CorpusIndex)
+
+    def get_context_assembler(self):
+        """
+        Get the shared instance of ContextAssembler for this context.
         """
-        return SimilaritySearcher(self)
+        return self.__get_service('context_assembler', ContextAssembler)
 
     def get_logger(self):
         """
@@ -0,0 +1,313 @@
+import json
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+from aisaac.aisaac.utils.logger import Logger
+
+
+class CorpusIndex:
+    storage_dtypes = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+    matrix_files = ('embeddings.npy', 'scales.npy', 'embeddings_float32.npy')
+    block_size = 65536
+
+    def __init__(self, context_manager):
+        """
+        Initialize the corpus index. The index is a single contiguous embedding matrix of all chunks of all documents,
+        stored as a memory-mapped .npy file, together with a title to row-range index.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        self.system_manager = context_manager.get_system_manager()
+        self.model_manager = context_manager.get_model_manager()
+        self.index_path = context_manager.get_config('CORPUS_INDEX_PATH')
+        self.full_index_path = self.system_manager.get_full_path(self.index_path)
+        self.similarity_search_k = int(context_manager.get_config('SIMILARITY_SEARCH_K'))
+        self.storage_dtype = str(context_manager.get_config('CORPUS_INDEX_DTYPE'))
+        self.keep_exact_embeddings = str(context_manager.get_config('CORPUS_INDEX_RESCORE')) == 'True'
+        self.rescore_factor = int(context_manager.get_config('CORPUS_INDEX_RESCORE_FACTOR'))
+        if self.storage_dtype not in self.storage_dtypes:
+            raise ValueError(f"Corpus index dtype {self.storage_dtype} not supported. "
+                             f"Use one of {list(self.storage_dtypes.keys())}.")
+        self.logger = Logger(__name__).get_logger()
+
+        self.embeddings, self.scales, self.exact_embeddings = None, None, None
+        self.titles = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.title_rows = {}
+        self.documents, self.metadatas = None, None
+
+    def build(self, vectorstores):
+        """
+        Build the corpus index from the per-document vector stores and persist it.
+
+        :param vectorstores: A dictionary of title to Chroma vector store, as returned by get_vectorstores().
+        :return: The number of chunks in the index.
+        """
+        # first pass: collect the sizes so that the matrix can be written in place
+        stores = {}
+        for title, vectorstore in vectorstores.items():
+            if vectorstore is None:
+                continue
+            count = vectorstore._collection.count()
+            if count == 0:
+                self.logger.debug(f"Document store for {title} is empty and is left out of the corpus index.")
+                continue
+            stores[self.system_manager.get_title_without_extension(title)] = (vectorstore, count)
+        if not stores:
+            self.logger.error("No document stores found. The corpus index was not built.")
+            return 0
+
+        total_rows = sum(count for _vectorstore, count in stores.values())
+        self.system_manager.make_directory(self.index_path)
+        self.__remove_matrix_files()
+        embedding_matrix, scales, exact_matrix = None, None, None
+        titles, offsets, documents, metadatas = [], [0], [], []
+        for title, (vectorstore, count) in stores.items():
+            data = vectorstore._collection.get(include=['documents', 'metadatas', 'embeddings'])
+            block = self.__normalize(np.asarray(data['embeddings'], dtype=np.float32))
+            if embedding_matrix is None:
+                shape = (total_rows, block.shape[1])
+                embedding_matrix = self.__open_matrix('embeddings.npy', self.storage_dtypes[self.storage_dtype], shape)
+                if self.storage_dtype == 'int8':
+                    scales = self.__open_matrix('scales.npy', np.float32, (total_rows,))
+                if self.keep_exact_embeddings and self.storage_dtype != 'float32':
+                    exact_matrix = self.__open_matrix('embeddings_float32.npy', np.float32, shape)
+            start = offsets[-1]
+            end = start + len(block)
+            if self.storage_dtype == 'int8':
+                embedding_matrix[start:end], scales[start:end] = self.quantize_int8(block)
+            else:
+                embedding_matrix[start:end] = block
+            if exact_matrix is not None:
+                exact_matrix[start:end] = block
+            titles.append(title)
+            offsets.append(end)
+            documents.extend(data['documents'])
+            metadatas.extend(data['metadatas'])
+        for matrix in (embedding_matrix, scales, exact_matrix):
+            if matrix is not None:
+                matrix.flush()
+        del embedding_matrix, scales, exact_matrix
+
+        with open(self.__get_file('index.json'), 'w') as file:
+            json.dump({"titles": titles, "offsets": offsets, "dtype": self.storage_dtype}, file)
+        with open(self.__get_file('chunks.json'), 'w') as file:
+            json.dump({"documents": documents, "metadatas": metadatas}, file)
+        self.logger.info(f"Built {self.storage_dtype} corpus index with {total_rows} chunks "
+                         f"from {len(titles)} documents.")
+        self.load()
+        return total_rows
+
+    def load(self):
+        """
+        Load the title index and memory-map the embedding matrix. The chunk texts are only loaded when needed.
+        """
+        if not self.exists():
+            self.logger.error(f"Corpus index at {self.full_index_path} does not exist.")
+            return False
+        with open(self.__get_file('index.json'), 'r') as file:
+            index = json.load(file)
+        self.titles = index['titles']
+        self.offsets = np.asarray(index['offsets'], dtype=np.int64)
+        self.title_rows = {title: (self.offsets[i], self.offsets[i + 1]) for i, title in enumerate(self.titles)}
+        # the stored dtype wins over the configured one, a rebuild is needed to change it
+        self.storage_dtype = index.get('dtype', 'float32')
+        self.embeddings = np.load(self.__get_file('embeddings.npy'), mmap_mode='r')
+        self.scales = self.__load_optional_matrix('scales.npy')
+        self.exact_embeddings = self.embeddings if self.storage_dtype == 'float32' \
+            else self.__load_optional_matrix('embeddings_float32.npy')
+        self.documents, self.metadatas = None, None
+        self.logger.debug(f"Loaded {self.storage_dtype} corpus index with {len(self.embeddings)} chunks.")
+        return True
+
+    def exists(self):
+        return self.system_manager.path_exists(f"{self.index_path}/index.json")
+
+    def search(self, query_text, k=None, titles=None, rescore=True):
+        """
+        Get the top k chunks for a query across all documents in one pass over the matrix. For compact storage,
+        the top k * CORPUS_INDEX_RESCORE_FACTOR candidates are rescored with the exact float32 embeddings if kept.
+
+        :param query_text: The query, e.g. a checkpoint.
+        :param k: The number of chunks to return. Defaults to SIMILARITY_SEARCH_K.
+        :param titles: Optionally restrict the search to these titles.
+        :param rescore: Whether to rescore the candidates with the exact embeddings.
+        :return: A list of (Document, score) tuples, sorted by descending cosine similarity.
+        """
+        self.__ensure_loaded()
+        k = k or self.similarity_search_k
+        query_vector = self.__embed_queries([query_text])[0]
+        top_rows, scores = self.__search_rows(query_vector, k, titles, rescore)
+        return [(self.get_chunk(row), float(score)) for row, score in zip(top_rows, scores)]
+
+    def get_title_max_scores(self, query_text):
+        """
+        Get the maximum similarity of every document to a query at once.
+
+        :param query_text: The query, e.g. a checkpoint.
+        :return: A dictionary of title to maximum cosine similarity.
+        """
+        max_scores = self.get_title_max_score_matrix([query_text])[:, 0]
+        return dict(zip(self.titles, max_scores.tolist()))
+
+    def get_title_max_score_matrix(self, query_texts):
+        """
+        Get the maximum similarity of every document to every query in one vectorized pass.
+
+        :param query_texts: A list of queries, e.g. all checkpoints.
+        :return: An array of shape (number of titles, number of queries). Rows follow self.titles.
+        """
+        self.__ensure_loaded()
+        chunk_scores = self.__score_rows(self.__embed_queries(query_texts))
+        return np.maximum.reduceat(chunk_scores, self.offsets[:-1], axis=0)
+
+    def score_chunks(self, query_text):
+        """
+        Get the cosine similarity of every chunk in the corpus to a query.
+        """
+        self.__ensure_loaded()
+        return self.__score_rows(self.__embed_queries([query_text]))[:, 0]
+
+    def get_quantization_report(self, query_texts, k=None):
+        """
+        Compare the compact storage with the exact float32 embeddings. The scan bytes are what a search reads, the
+        disk bytes are the size of all matrix files of the corpus index, including the scales and the exact copy kept
+        for rescoring. The per-document Chroma stores are not part of the corpus index and keep float32 embeddings.
+
+        :param query_texts: Queries to measure the recall with, e.g. all checkpoints.
+        :param k: The number of chunks per query. Defaults to SIMILARITY_SEARCH_K.
+        :return: A dictionary with the storage sizes and the recall@k of the compact search with and without
+        rescoring, relative to the exact search.
+        """
+        self.__ensure_loaded()
+        k = min(k or self.similarity_search_k, len(self.embeddings))
+        scan_bytes = self.embeddings.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        float32_bytes = self.embeddings.size * np.dtype(np.float32).itemsize
+        disk_bytes = sum(os.path.getsize(self.__get_file(file_name)) for file_name in self.matrix_files
+                         if os.path.exists(self.__get_file(file_name)))
+        report = {
+            'dtype': self.storage_dtype,
+            'scan_bytes': scan_bytes,
+            'disk_bytes': disk_bytes,
+            'float32_bytes': float32_bytes,
+            'scan_compression_ratio': float32_bytes / scan_bytes,
+            'disk_compression_ratio': float32_bytes / disk_bytes,
+            'recall_at_k': None,
+            'recall_at_k_rescored': None,
+        }
+        self.logger.info(f"Corpus index {self.storage_dtype}: searches scan {scan_bytes} bytes "
+                         f"({report['scan_compression_ratio']:.1f}x smaller than float32), the matrix files take "
+                         f"{disk_bytes} bytes on disk ({report['disk_compression_ratio']:.1f}x).")
+        if self.exact_embeddings is None:
+            self.logger.warning("The exact embeddings were not kept. Set CORPUS_INDEX_RESCORE to 'True' and rebuild "
+                                "the index to measure the recall.")
+            return report
+        recalls, rescored_recalls = [], []
+        for query_vector in self.__embed_queries(query_texts):
+            exact_rows = set(self.__top_rows(self.__score_exact(query_vector), k).tolist())
+            compact_rows, _scores = self.__search_rows(query_vector, k, None, rescore=False)
+            rescored_rows, _scores = self.__search_rows(query_vector, k, None, rescore=True)
+            recalls.append(len(exact_rows.intersection(compact_rows.tolist())) / k)
+            rescored_recalls.append(len(exact_rows.intersection(rescored_rows.tolist())) / k)
+        report['recall_at_k'] = float(np.mean(recalls))
+        report['recall_at_k_rescored'] = float(np.mean(rescored_recalls))
+        self.logger.info(f"Corpus index {self.storage_dtype}: recall@{k} {report['recall_at_k']:.3f}, "
+                         f"rescored {report['recall_at_k_rescored']:.3f}.")
+        return report
+
+    def get_chunk(self, row):
+        if self.documents is None:
+            with open(self.__get_file('chunks.json'), 'r') as file:
+                chunks = json.load(file)
+            self.documents, self.metadatas = chunks['documents'], chunks['metadatas']
+        return Document(page_content=self.documents[row], metadata=self.metadatas[row] or {})
+
+    def get_title_of_row(self, row):
+        return self.titles[int(np.searchsorted(self.offsets, row, side='right')) - 1]
+
+    @staticmethod
+    def quantize_int8(matrix):
+        """
+        Quantize a float matrix to int8 with one scale per row.
+
+        :return: A tuple of the int8 matrix and the float32 scales, so that matrix ~ int8_matrix * scales[:, None].
+        """
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def __search_rows(self, query_vector, k, titles, rescore):
+        scores = self.__score_rows(query_vector[None, :])[:, 0]
+        if titles is not None:
+            scores = scores + self.__get_title_mask(titles)
+        rescore = rescore and self.exact_embeddings is not None and self.exact_embeddings is not self.embeddings
+        candidates = self.__top_rows(scores, k * self.rescore_factor if rescore else k)
+        candidates = candidates[np.isfinite(scores[candidates])]
+        if rescore:
+            # sorted row access keeps the reads from the memory-mapped file sequential
+            candidates = np.sort(candidates)
+            exact_scores = self.exact_embeddings[candidates].astype(np.float32) @ query_vector
+            order = np.argsort(-exact_scores)[:k]
+            return candidates[order], exact_scores[order]
+        return candidates, scores[candidates]
+
+    def __score_rows(self, query_matrix):
+        # the compact matrix is converted block by block, so that it is never fully materialized as float32
+        scores = np.empty((len(self.embeddings), len(query_matrix)), dtype=np.float32)
+        for start in range(0, len(self.embeddings), self.block_size):
+            end = min(start + self.block_size, len(self.embeddings))
+            scores[start:end] = self.embeddings[start:end].astype(np.float32) @ query_matrix.T
+            if self.scales is not None:
+                scores[start:end] *= self.scales[start:end, None]
+        return scores
+
+    def __score_exact(self, query_vector):
+        return np.asarray(self.exact_embeddings @ query_vector, dtype=np.float32)
+
+    def __get_title_mask(self, titles):
+        mask = np.full(len(self.embeddings), -np.inf, dtype=np.float32)
+        for title in titles:
+            start, end = self.title_rows.get(self.system_manager.get_title_without_extension(title), (0, 0))
+            mask[start:end] = 0
+        return mask
+
+    @staticmethod
+    def __top_rows(scores, k):
+        k = min(k, len(scores))
+        top_rows = np.argpartition(-scores, k - 1)[:k]
+        return top_rows[np.argsort(-scores[top_rows])]
+
+    def __embed_queries(self, query_texts):
+        embedding = self.model_manager.get_embedding()
+        query_matrix = np.asarray([embedding.embed_query(text) for text in query_texts], dtype=np.float32)
+        return self.__normalize(query_matrix)
+
+    def __ensure_loaded(self):
+        if self.embeddings is None and not self.load():
+            raise FileNotFoundError(f"Corpus index at {self.full_index_path} does not exist. "
+                                    f"Create the document stores first.")
+
+    def __open_matrix(self, file_name, dtype, shape):
+        return np.lib.format.open_memmap(self.__get_file(file_name), mode='w+', dtype=dtype, shape=shape)
+
+    def __load_optional_matrix(self, file_name):
+        if not os.path.exists(self.__get_file(file_name)):
+            return None
+        return np.load(self.__get_file(file_name), mmap_mode='r')
+
+    def __remove_matrix_files(self):
+        self.embeddings, self.scales, self.exact_embeddings = None, None, None
+        for file_name in self.matrix_files:
+            self.system_manager.delete_file(f"{self.index_path}/{file_name}")
+
+    def __get_file(self, file_name):
+        return os.path.join(self.full_index_path, file_name)
+
+    @staticmethod
+    def __normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
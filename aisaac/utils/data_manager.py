@@ -1,9 +1,11 @@
+import json
 import math
 import os
 import pickle
 import random
 from collections import Counter
 
+import numpy as np
 from langchain.schema import Document
 from langchain.text_splitter import NLTKTextSplitter
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,7 +13,9 @@ from langchain.vectorstores.chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.document_loaders import UnstructuredMarkdownLoader
 
+from aisaac.aisaac.utils.lexical_index import LexicalIndex
 from aisaac.aisaac.utils.logger import Logger
+from aisaac.aisaac.utils.title_index import TitleIndex
 
 
 class DocumentManager:
@@ -28,6 +32,8 @@ class DocumentManager:
         self.system_manager.make_directory(context_manager.get_config('BIN_PATH'))
         self.full_original_result_path = self.system_manager.get_full_path(
             f"{context_manager.get_config('ORIGINAL_RESULT_PATH')}/{context_manager.get_config('ORIGINAL_RESULT_FILE')}")
+        title_match_cutoff = context_manager.get_config('TITLE_MATCH_CUTOFF')
+        self.title_match_cutoff = None if title_match_cutoff is None else float(title_match_cutoff)
 
         self.global_data = []
         self.logger = Logger(__name__).get_logger()
@@ -119,22 +125,20 @@ class DocumentManager:
                 self.logger.debug(f"Document store for {dir_title} exists.")
         return global_titles
 
+    def get_gold_standard_index(self, result_saver):
+        """
+        Get the title index of the gold standard, which maps every title to its gold decision.
+        """
+        return TitleIndex.from_decisions(result_saver.read_csv_to_dict_relevant_only(self.full_original_result_path),
+                                         self.title_match_cutoff)
+
     def get_relevant_runnable_titles(self, result_saver):
-        all_runnable_titles = self.get_runnable_titles()
-        gold_standard_relevant = result_saver.read_csv_to_dict_relevant_only(self.full_original_result_path)
-        for title in all_runnable_titles[:]:
-            title_without_ext = self.system_manager.get_title_without_extension(title)
-            if title_without_ext not in gold_standard_relevant:
-                all_runnable_titles.remove(title)
-        return all_runnable_titles
+        gold_standard_index = self.get_gold_standard_index(result_saver)
+        return [title for title in self.get_runnable_titles() if gold_standard_index.get(title) is True]
 
     def get_irrelevant_runnable_titles(self, result_saver):
-        all_runnable_titles = self.get_runnable_titles()
-        gold_standard_relevant = result_saver.read_csv_to_dict_relevant_only(self.full_original_result_path)
-        for title in all_runnable_titles[:]:
-            if title in gold_standard_relevant:
-                all_runnable_titles.remove(title)
-        return all_runnable_titles
+        gold_standard_index = self.get_gold_standard_index(result_saver)
+        return [title for title in self.get_runnable_titles() if gold_standard_index.get(title) is False]
 
     def __get_all_data(self):
         return_data = []
@@ -213,6 +217,9 @@ class VectorDataManager:
         self.result_manager = context_manager.get_result_saver()
         self.chroma_path = context_manager.get_config('CHROMA_PATH')
         self.full_chroma_path = self.system_manager.get_full_path(self.chroma_path)
+        self.corpus_index = context_manager.get_corpus_index()
+        self.relevance_calibrations = {}
+        self.lexical_indexes = {}
         self.logger = Logger(__name__).get_logger()
 
     def chunk_documents(self, documents):
@@ -248,6 +255,9 @@ class VectorDataManager:
             )
             db.persist()
             self.logger.debug(f"Saved {len(chunks)} chunks to {path}.")
+            self.__save_relevance_calibration(db, title)
+            self.__save_lexical_index([chunk.page_content for chunk in chunks], [chunk.metadata for chunk in chunks],
+                                      title)
         except Exception as e:
             self.logger.error(f"Error saving chunks to {path}: {e}")
 
@@ -278,6 +288,7 @@ class VectorDataManager:
                 self.logger.error(f"Embedding failed for {title}.")
 
         self.logger.info("All document stores created.")
+        self.get_unified_vectorstore()
 
     def get_vectorstore(self, title: str):
         title = os.path.splitext(title)[0]
@@ -285,22 +296,117 @@ class VectorDataManager:
         if not self.system_manager.path_exists(path):
             self.logger.error(f"Document store for {title} does not exist.")
             return None
+        calibration = self.get_relevance_calibration(title)
         return Chroma(persist_directory=self.system_manager.get_full_path(path),
-                      embedding_function=self.model_manager.get_embedding()
+                      embedding_function=self.model_manager.get_embedding(),
+                      relevance_score_fn=self.get_relevance_score_fn(calibration)
                       )
 
-    def get_vectorstore_with_sigmoid_relevance_score_fn(self, title: str):
+    def get_relevance_calibration(self, title: str):
+        """
+        Get the relevance score normalization of a document store. It is chosen once when the store is built and
+        saved with it. Stores built before that are calibrated on first use.
+
+        :param title: The title of the document.
+        :return: A dictionary describing the normalization, see get_relevance_score_fn.
+        """
         title = os.path.splitext(title)[0]
-        path = f"{self.chroma_path}/{title}"
-        if not self.system_manager.path_exists(path):
+        if title in self.relevance_calibrations:
+            return self.relevance_calibrations[title]
+        relative_path = f"{self.chroma_path}/{title}/relevance_calibration.json"
+        if self.system_manager.path_exists(relative_path):
+            with open(self.system_manager.get_full_path(relative_path), 'r') as file:
+                calibration = json.load(file)
+        else:
+            self.logger.info(f"No relevance calibration found for {title}. Calibrating the existing store.")
+            db = Chroma(persist_directory=self.system_manager.get_full_path(f"{self.chroma_path}/{title}"),
+                        embedding_function=self.model_manager.get_embedding())
+            calibration = self.__save_relevance_calibration(db, title)
+        self.relevance_calibrations[title] = calibration
+        return calibration
+
+    def get_lexical_index(self, title: str):
+        """
+        Get the BM25 index over the chunks of a document store. It is built when the store is built and saved with
+        it. Stores built before that are indexed on first use.
+
+        :param title: The title of the document.
+        :return: The LexicalIndex of the document, or None if the document store does not exist.
+        """
+        title = os.path.splitext(title)[0]
+        if title in self.lexical_indexes:
+            return self.lexical_indexes[title]
+        relative_path = f"{self.chroma_path}/{title}/lexical_index.pkl"
+        if self.system_manager.path_exists(relative_path):
+            lexical_index = LexicalIndex.load(self.system_manager.get_full_path(relative_path))
+        elif self.system_manager.path_exists(f"{self.chroma_path}/{title}"):
+            self.logger.info(f"No lexical index found for {title}. Indexing the existing store.")
+            db = Chroma(persist_directory=self.system_manager.get_full_path(f"{self.chroma_path}/{title}"),
+                        embedding_function=self.model_manager.get_embedding())
+            data = db._collection.get(include=['documents', 'metadatas'])
+            lexical_index = self.__save_lexical_index(data['documents'], data['metadatas'], title)
+        else:
             self.logger.error(f"Document store for {title} does not exist.")
             return None
-        return Chroma(
-            persist_directory=self.system_manager.get_full_path(path),
-            embedding_function=self.model_manager.get_embedding(),
-            collection_metadata={"hnsw:space": "l2"},
-            relevance_score_fn=lambda distance: 1 / (1 + math.exp(-distance))
-        )
+        self.lexical_indexes[title] = lexical_index
+        return lexical_index
+
+    @staticmethod
+    def get_relevance_score_fn(calibration):
+        """
+        Create a relevance score function that maps a distance of the store to a score in [0, 1].
+
+        "cosine": the embeddings are unit vectors (or the space is cosine), so the distance is converted to the
+        cosine similarity, clipped at 0.
+        "logistic": a logistic function of the distance, centered on the median distance between chunks of the
+        store and scaled so that the first and third quartile map to 0.75 and 0.25.
+        """
+        if calibration['method'] == 'cosine':
+            divisor = calibration['divisor']
+            return lambda distance: min(1.0, max(0.0, 1 - distance / divisor))
+        center, scale = calibration['center'], calibration['scale']
+        return lambda distance: 1 / (1 + math.exp(min(700.0, (distance - center) / scale)))
+
+    def __save_relevance_calibration(self, db, title):
+        calibration = self.__calibrate_relevance_scores(db)
+        relative_path = f"{self.chroma_path}/{title}/relevance_calibration.json"
+        with open(self.system_manager.get_full_path(relative_path), 'w') as file:
+            json.dump(calibration, file)
+        self.relevance_calibrations[title] = calibration
+        self.logger.debug(f"Saved relevance calibration for {title}: {calibration}.")
+        return calibration
+
+    def __save_lexical_index(self, documents, metadatas, title):
+        lexical_index = LexicalIndex().build(documents, metadatas)
+        lexical_index.save(self.system_manager.get_full_path(f"{self.chroma_path}/{title}/lexical_index.pkl"))
+        self.lexical_indexes[title] = lexical_index
+        self.logger.debug(f"Saved lexical index with {len(lexical_index.postings)} terms for {title}.")
+        return lexical_index
+
+    @staticmethod
+    def __calibrate_relevance_scores(db, sample_size=256):
+        space = (db._collection.metadata or {}).get('hnsw:space', 'l2')
+        embeddings = np.asarray(db._collection.get(include=['embeddings'])['embeddings'], dtype=np.float64)
+        norms = np.linalg.norm(embeddings, axis=1) if len(embeddings) > 0 else np.ones(1)
+        if space == 'cosine' or (space == 'l2' and np.allclose(norms, 1, atol=1e-2)):
+            # chroma's l2 is the squared euclidean distance, which is 2 - 2 * cosine for unit vectors
+            return {'space': space, 'method': 'cosine', 'divisor': 1.0 if space == 'cosine' else 2.0}
+
+        if len(embeddings) < 2:
+            # without pairs, assume that a cosine of 0.5 between vectors of typical length is the middle
+            center = float(np.mean(norms ** 2)) if space == 'l2' else 1 - float(np.mean(norms ** 2)) / 2
+            return {'space': space, 'method': 'logistic', 'center': center, 'scale': max(abs(center) / 4, 1e-6)}
+        sample = embeddings[np.random.default_rng(42).permutation(len(embeddings))[:sample_size]]
+        dot_products = sample @ embeddings.T
+        if space == 'ip':
+            distances = 1 - dot_products
+        else:
+            distances = (sample ** 2).sum(axis=1)[:, None] + (embeddings ** 2).sum(axis=1)[None, :] - 2 * dot_products
+        # leave out the distance of every sampled chunk to itself
+        distances = np.sort(distances, axis=1)[:, 1:] if space == 'l2' else distances
+        first_quartile, center, third_quartile = np.percentile(distances, [25, 50, 75])
+        scale = max((third_quartile - first_quartile) / (2 * math.log(3)), 1e-6)
+        return {'space': space, 'method': 'logistic', 'center': float(center), 'scale': float(scale)}
 
     def get_vectorstores(self):
         vectorstores = {}
@@ -309,15 +415,11 @@ class VectorDataManager:
         return vectorstores
 
     def get_unified_vectorstore(self):
-        vectorstores = self.get_vectorstores()
-        vectorstore_baseline = Chroma(embedding_function=self.model_manager.get_embedding())
-        for title in vectorstores:
-            db2_data = vectorstores[title]._collection.get(include=['documents', 'metadata', 'embeddings'])
-            vectorstore_baseline._collection.add(
-                embeddings=db2_data['embeddings'],
-                metadatas=db2_data['metadata'],
-                documents=db2_data['documents'],
-                ids=db2_data['ids']
-            )
-        return vectorstores
-# %%
+        """
+        Build the corpus index over all document stores, replacing any previous one.
+
+        :return: The CorpusIndex holding one embedding matrix for the whole corpus.
+        """
+        self.corpus_index.build(self.get_vectorstores())
+        return self.corpus_index
+# %%
\ No newline at end of file
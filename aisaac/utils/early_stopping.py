@@ -0,0 +1,95 @@
+import threading
+from collections import deque
+
+from aisaac.aisaac.utils.logger import Logger
+
+
+class EarlyStopping:
+    NONE = 'none'
+    RECALL = 'recall'
+    CONSECUTIVE_IRRELEVANT = 'consecutive_irrelevant'
+
+    def __init__(self, context_manager):
+        """
+        Initialize the stopping rule of a prioritized screening run, in which the documents most likely to be relevant
+        are screened first. With EARLY_STOPPING "recall", the share of relevant documents among the last
+        EARLY_STOPPING_WINDOW screened documents estimates how many relevant documents are left, on top of
+        EARLY_STOPPING_PSEUDO_COUNT relevant documents that are always assumed to be left, and the run stops once the
+        estimated recall reaches TARGET_RECALL. With "consecutive_irrelevant", the run stops after
+        EARLY_STOPPING_PATIENCE irrelevant documents in a row. No rule stops before EARLY_STOPPING_MIN_SCREENED
+        documents are screened.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        self.rule = context_manager.get_config('EARLY_STOPPING')
+        if self.rule not in (self.RECALL, self.CONSECUTIVE_IRRELEVANT):
+            self.rule = self.NONE
+        self.target_recall = float(context_manager.get_config('TARGET_RECALL'))
+        self.min_screened = int(context_manager.get_config('EARLY_STOPPING_MIN_SCREENED'))
+        self.window = max(1, int(context_manager.get_config('EARLY_STOPPING_WINDOW')))
+        self.pseudo_count = max(0.0, float(context_manager.get_config('EARLY_STOPPING_PSEUDO_COUNT')))
+        self.patience = max(1, int(context_manager.get_config('EARLY_STOPPING_PATIENCE')))
+        self.logger = Logger(__name__).get_logger()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def is_enabled(self):
+        return self.rule != self.NONE
+
+    def reset(self, total=0):
+        """
+        Start a new run.
+
+        :param total: The number of documents of the run.
+        """
+        with self.lock:
+            self.total = total
+            self.screened = 0
+            self.found = 0
+            self.consecutive_irrelevant = 0
+            self.recent_decisions = deque(maxlen=self.window)
+
+    def update(self, title, relevant, checkpoints=None):
+        """
+        Count one screened document. The signature matches the listeners of the ResultSaver.
+
+        :param title: The title of the document.
+        :param relevant: The relevance decision, or None if the document has no decision.
+        :param checkpoints: The checkpoints of the response.
+        """
+        relevant = relevant is True
+        with self.lock:
+            self.screened += 1
+            self.found += relevant
+            self.consecutive_irrelevant = 0 if relevant else self.consecutive_irrelevant + 1
+            self.recent_decisions.append(relevant)
+
+    def get_estimated_recall(self):
+        """
+        Estimate the share of the relevant documents found so far. The relevant documents left are the documents left
+        times the share of relevant documents among the recent ones, plus a fixed pseudo-count, so that a window
+        without relevant documents does not claim that none are left. The pseudo-count does not grow with the
+        documents left: in priority order, the documents left are less likely to be relevant than the recent ones.
+        """
+        with self.lock:
+            remaining = max(0, self.total - self.screened)
+            recent_prevalence = sum(self.recent_decisions) / len(self.recent_decisions) if self.recent_decisions else 1
+            expected_remaining = self.pseudo_count * (remaining > 0) + recent_prevalence * remaining
+            if self.found + expected_remaining == 0:
+                return 1.0
+            return self.found / (self.found + expected_remaining)
+
+    def should_stop(self):
+        with self.lock:
+            if self.rule == self.NONE or self.screened < self.min_screened or self.screened >= self.total:
+                return False
+            if self.rule == self.CONSECUTIVE_IRRELEVANT:
+                return self.consecutive_irrelevant >= self.patience
+        return self.get_estimated_recall() >= self.target_recall
+
+    def get_statistics(self):
+        with self.lock:
+            statistics = {'rule': self.rule, 'screened': self.screened, 'total': self.total, 'found': self.found,
+                          'consecutive_irrelevant': self.consecutive_irrelevant}
+        statistics['estimated_recall'] = self.get_estimated_recall()
+        return statistics
@@ -0,0 +1,143 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from aisaac.aisaac.utils.logger import Logger
+
+
+class EmbeddingBatcher(Embeddings):
+    def __init__(self, embedding, max_batch_size=64, max_wait_ms=5):
+        """
+        Initialize a micro-batcher in front of an embedding model. Calls from concurrent threads are collected for up
+        to max_wait_ms milliseconds or max_batch_size texts and sent to the model as one batch. Every caller gets
+        back its own embeddings, in the same order as its texts.
+
+        :param embedding: The embedding model to send the batches to.
+        :param max_batch_size: The maximum number of texts in one batch.
+        :param max_wait_ms: How long the first call of a batch waits for further calls.
+        """
+        self.embedding = embedding
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = float(max_wait_ms) / 1000
+        self.requests = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.statistics_lock = threading.Lock()
+        self.call_count = 0
+        self.batch_count = 0
+        self.text_count = 0
+        self.logger = Logger(__name__).get_logger()
+
+    def embed_documents(self, texts):
+        return self.__submit('documents', texts)
+
+    def embed_query(self, text):
+        return self.__submit('query', [text])[0]
+
+    def get_statistics(self):
+        """
+        Get how many calls were combined into how many batches.
+
+        :return: A dictionary with the number of calls, batches and texts and the mean number of texts per batch.
+        """
+        with self.statistics_lock:
+            call_count, batch_count, text_count = self.call_count, self.batch_count, self.text_count
+        return {
+            'calls': call_count,
+            'batches': batch_count,
+            'texts': text_count,
+            'mean_batch_size': text_count / batch_count if batch_count else 0.0,
+        }
+
+    def close(self):
+        """
+        Stop the worker thread after the pending calls are done.
+        """
+        with self.worker_lock:
+            if self.worker is not None:
+                self.requests.put(None)
+                self.worker.join()
+                self.worker = None
+
+    def __submit(self, kind, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        future = Future()
+        self.__ensure_worker()
+        self.requests.put((kind, texts, future))
+        return future.result()
+
+    def __ensure_worker(self):
+        with self.worker_lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.__run, name='EmbeddingBatcher', daemon=True)
+                self.worker.start()
+
+    def __run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            batch_size = len(request[1])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while batch_size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                batch_size += len(request[1])
+            self.__process(batch)
+            if stop:
+                return
+
+    def __process(self, batch):
+        for kind in ('documents', 'query'):
+            requests = [(texts, future) for request_kind, texts, future in batch if request_kind == kind]
+            if not requests:
+                continue
+            # every error has to reach the callers, who wait for their futures without a timeout
+            try:
+                # a text asked for by several callers is embedded once
+                unique_texts = list(dict.fromkeys(text for texts, _future in requests for text in texts))
+                embeddings = {}
+                for start in range(0, len(unique_texts), self.max_batch_size):
+                    texts = unique_texts[start:start + self.max_batch_size]
+                    vectors = list(self.__embed(kind, texts))
+                    if len(vectors) != len(texts):
+                        raise ValueError(f"The embedding model returned {len(vectors)} embeddings for "
+                                         f"{len(texts)} texts.")
+                    embeddings.update(zip(texts, vectors))
+                results = [[embeddings[text] for text in texts] for texts, _future in requests]
+                for (_texts, future), result in zip(requests, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _texts, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            with self.statistics_lock:
+                self.call_count += len(requests)
+                self.text_count += len(unique_texts)
+
+    def __embed(self, kind, texts):
+        with self.statistics_lock:
+            self.batch_count += 1
+        self.logger.debug(f"Embedding a batch of {len(texts)} texts.")
+        if kind == 'documents':
+            return self.embedding.embed_documents(texts)
+        if hasattr(self.embedding, 'embed_queries'):
+            return self.embedding.embed_queries(texts)
+        return [self.embedding.embed_query(text) for text in texts]
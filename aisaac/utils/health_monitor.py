@@ -0,0 +1,117 @@
+import random
+import threading
+
+import requests
+
+from aisaac.aisaac.utils.logger import Logger
+
+
+class HealthMonitor:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, context_manager, http_transport, probe_url):
+        """
+        Initialize a circuit breaker for the model server. While the circuit is closed, the model calls themselves
+        report their outcome. After CIRCUIT_FAILURE_THRESHOLD consecutive failures the circuit opens, and a
+        background thread probes the server with exponential backoff and jitter until it answers again.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        :param http_transport: The HttpTransport to send the probes with.
+        :param probe_url: A cheap endpoint of the model server, such as the model list.
+        """
+        self.http_transport = http_transport
+        self.probe_url = probe_url
+        self.failure_threshold = int(context_manager.get_config('CIRCUIT_FAILURE_THRESHOLD'))
+        self.initial_backoff = float(context_manager.get_config('HEALTH_BACKOFF_INITIAL'))
+        self.max_backoff = float(context_manager.get_config('HEALTH_BACKOFF_MAX'))
+        self.logger = Logger(__name__).get_logger()
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.lock = threading.Lock()
+        self.available = threading.Event()
+        self.available.set()
+        self.stopped = threading.Event()
+        self.probe_thread = None
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self.logger.info("The model server is available again.")
+            self.state = self.CLOSED
+            self.available.set()
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == self.OPEN or self.consecutive_failures < self.failure_threshold:
+                return
+            self.logger.critical(f"The model server failed {self.consecutive_failures} times in a row. "
+                                 f"Pausing until it is available again.")
+            self.state = self.OPEN
+            self.available.clear()
+            self.__start_probing()
+
+    def is_available(self):
+        return self.available.is_set()
+
+    def wait_until_available(self, timeout=None):
+        """
+        Block while the circuit is open.
+
+        :param timeout: The maximum number of seconds to wait, or None to wait until the server is back.
+        :return: Whether the server is available.
+        """
+        with self.lock:
+            # the probes stop with stop(), so that an open circuit is probed again once someone waits for it
+            if self.state != self.CLOSED:
+                self.__start_probing()
+        return self.available.wait(timeout)
+
+    def get_backoff(self, attempt):
+        """
+        Get the seconds to wait before the given retry attempt, starting at 0. The delay doubles with every attempt up
+        to HEALTH_BACKOFF_MAX, and half of it is random so that clients do not retry in lockstep.
+        """
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def probe(self):
+        try:
+            return self.http_transport.get(self.probe_url).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def stop(self, timeout=1.0):
+        """
+        Stop probing the server.
+
+        :param timeout: The maximum number of seconds to wait for the probe thread to end.
+        """
+        self.stopped.set()
+        probe_thread = self.probe_thread
+        if probe_thread is not None and probe_thread is not threading.current_thread():
+            probe_thread.join(timeout)
+
+    def __start_probing(self):
+        if self.probe_thread is None or not self.probe_thread.is_alive():
+            self.stopped.clear()
+            self.probe_thread = threading.Thread(target=self.__probe_until_available, name='HealthMonitor',
+                                                 daemon=True)
+            self.probe_thread.start()
+
+    def __probe_until_available(self):
+        attempt = 0
+        while not self.stopped.wait(self.get_backoff(attempt)):
+            with self.lock:
+                self.state = self.HALF_OPEN
+            if self.probe():
+                self.record_success()
+                return
+            with self.lock:
+                self.state = self.OPEN
+            attempt += 1
+            self.logger.info(f"The model server is still unavailable after {attempt} probes.")
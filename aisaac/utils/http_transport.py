@@ -0,0 +1,84 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from aisaac.aisaac.utils.logger import Logger
+
+
+class HttpTransport:
+    def __init__(self, context_manager):
+        """
+        Initialize a pooled HTTP transport that is shared by all model and embedding calls of a ModelManager.
+        Connections are kept alive and reused, and at most HTTP_POOL_SIZE connections are open per host. Callers
+        beyond that wait for a free connection instead of opening short-lived ones.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        self.pool_size = int(context_manager.get_config('HTTP_POOL_SIZE'))
+        self.connect_timeout = float(context_manager.get_config('HTTP_CONNECT_TIMEOUT'))
+        self.read_timeout = float(context_manager.get_config('HTTP_READ_TIMEOUT'))
+        self.keep_alive = str(context_manager.get_config('HTTP_KEEP_ALIVE')) == 'True'
+        self.max_retries = int(context_manager.get_config('HTTP_MAX_RETRIES'))
+        self.logger = Logger(__name__).get_logger()
+
+        # only failed connection attempts are retried, a request that reached the server is never sent twice
+        retries = Retry(total=self.max_retries, connect=self.max_retries, read=0, status=0, redirect=0,
+                        backoff_factor=0.5)
+        self.adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                   max_retries=retries, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if not self.keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self.statistics_lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the pool. Accepts the same arguments as requests.request. The timeout defaults to
+        (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT).
+        """
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        with self.statistics_lock:
+            self.request_count += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self.statistics_lock:
+                self.error_count += 1
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get_statistics(self):
+        """
+        Get the reuse statistics of the pool.
+
+        :return: A dictionary with the number of requests, the number of connections that were opened, how many
+        requests reused an open connection and the number of failed requests.
+        """
+        pools = self.adapter.poolmanager.pools
+        connection_pools = [pools[key] for key in pools.keys()]
+        connections_opened = sum(pool.num_connections for pool in connection_pools)
+        with self.statistics_lock:
+            request_count, error_count = self.request_count, self.error_count
+        reused = max(0, request_count - error_count - connections_opened)
+        return {
+            'requests': request_count,
+            'connections_opened': connections_opened,
+            'reused_connections': reused,
+            'reuse_ratio': reused / request_count if request_count else 0.0,
+            'errors': error_count,
+        }
+
+    def close(self):
+        self.session.close()
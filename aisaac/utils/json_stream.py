@@ -0,0 +1,38 @@
+class JsonCompletionDetector:
+    def __init__(self):
+        """
+        Initialize a detector that reads a streamed answer piece by piece and tells when the first JSON object in it
+        is complete. Braces inside strings are ignored, so reasoning texts with braces do not end the object early.
+        """
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, text):
+        """
+        Read the next piece of the answer.
+
+        :param text: The next piece of the answer.
+        :return: Whether the first JSON object of the answer is complete.
+        """
+        for character in text:
+            if self.complete:
+                break
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif character == '\\':
+                    self.escaped = True
+                elif character == '"':
+                    self.in_string = False
+            elif character == '"' and self.started:
+                self.in_string = True
+            elif character == '{':
+                self.started = True
+                self.depth += 1
+            elif character == '}' and self.started:
+                self.depth -= 1
+                self.complete = self.depth == 0
+        return self.complete
@@ -0,0 +1,130 @@
+import math
+import pickle
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+class LexicalIndex:
+    token_pattern = re.compile(r"\w+")
+    stop_words = frozenset(
+        "a an and are as at be by for from has have if in into is it its of on or other otherwise such than that the "
+        "then this to was were which with any".split())
+
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Initialize an in-process BM25 inverted index over the chunks of one document.
+
+        :param k1: The BM25 term frequency saturation.
+        :param b: The BM25 length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.chunk_lengths = np.zeros(0, dtype=np.float32)
+        self.average_chunk_length = 0.0
+        self.documents, self.metadatas = [], []
+        # the tokens of every chunk in their order, to check that the words of a term are adjacent
+        self.chunk_tokens = []
+
+    @classmethod
+    def tokenize(cls, text):
+        return [token for token in cls.token_pattern.findall(text.casefold()) if token not in cls.stop_words]
+
+    def build(self, documents, metadatas=None):
+        """
+        Build the index.
+
+        :param documents: The chunk texts.
+        :param metadatas: The chunk metadata, in the same order.
+        """
+        self.documents = list(documents)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.documents]
+        term_frequencies = {}
+        chunk_lengths = []
+        self.chunk_tokens = []
+        for row, document in enumerate(self.documents):
+            tokens = self.tokenize(document)
+            self.chunk_tokens.append(tokens)
+            chunk_lengths.append(len(tokens))
+            for token in tokens:
+                counts = term_frequencies.setdefault(token, {})
+                counts[row] = counts.get(row, 0) + 1
+        # every posting list is a pair of arrays, so that a query term is scored in one vectorized step
+        self.postings = {term: (np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)),
+                                np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+                         for term, counts in term_frequencies.items()}
+        self.chunk_lengths = np.asarray(chunk_lengths, dtype=np.float32)
+        self.average_chunk_length = float(self.chunk_lengths.mean()) if chunk_lengths else 0.0
+        return self
+
+    def score(self, query_text):
+        """
+        Get the BM25 score of every chunk for a query.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        if not self.documents or self.average_chunk_length == 0:
+            return scores
+        number_of_chunks = len(self.documents)
+        for term in set(self.tokenize(query_text)):
+            if term not in self.postings:
+                continue
+            rows, frequencies = self.postings[term]
+            idf = math.log(1 + (number_of_chunks - len(rows) + 0.5) / (len(rows) + 0.5))
+            length_norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[rows] / self.average_chunk_length)
+            scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + length_norm)
+        return scores
+
+    def search(self, query_text, k):
+        """
+        Get the best matching chunks for a query. Chunks without any query term are left out.
+
+        :return: A list of (Document, score) tuples with the scores divided by the best score.
+        """
+        scores = self.score(query_text)
+        matching_rows = np.flatnonzero(scores)
+        if len(matching_rows) == 0:
+            return []
+        top_rows = matching_rows[np.argsort(-scores[matching_rows], kind='stable')[:k]]
+        best_score = scores[top_rows[0]]
+        return [(Document(page_content=self.documents[row], metadata=self.metadatas[row] or {}),
+                 float(scores[row] / best_score)) for row in top_rows]
+
+    def contains_terms(self, terms):
+        """
+        Check whether all the given terms occur in the document, e.g. "NIFTP" or "cell lines". The words of a term
+        have to follow each other in one chunk, ignoring case, punctuation and stop words. A term made only of stop
+        words is never found. The posting lists narrow the chunks down first, so this is cheap enough to filter
+        documents before any retrieval.
+        """
+        return all(self.__contains_term(term) for term in terms)
+
+    def __contains_term(self, term):
+        tokens = self.tokenize(term)
+        if not tokens or any(token not in self.postings for token in tokens):
+            return False
+        if len(tokens) == 1:
+            return True
+        rows = set(self.postings[tokens[0]][0].tolist())
+        for token in tokens[1:]:
+            rows.intersection_update(self.postings[token][0].tolist())
+        for row in rows:
+            chunk_tokens = self.chunk_tokens[row]
+            if any(chunk_tokens[start:start + len(tokens)] == tokens
+                   for start in range(len(chunk_tokens) - len(tokens) + 1) if chunk_tokens[start] == tokens[0]):
+                return True
+        return False
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as file:
+            lexical_index = pickle.load(file)
+        # indexes saved before the chunk tokens were kept are built again from their chunks
+        if getattr(lexical_index, 'chunk_tokens', None) is None:
+            lexical_index.build(lexical_index.documents, lexical_index.metadatas)
+        return lexical_index
@@ -1,50 +1,93 @@
+import json
+import os
+import threading
+import time
 from time import sleep
 
 import ollama
-from langchain.embeddings import XinferenceEmbeddings
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.llms.ollama import Ollama
-from langchain_community.llms.xinference import Xinference
+import requests
 from xinference.client import Client
 
+from aisaac.aisaac.utils.embedding_batcher import EmbeddingBatcher
+from aisaac.aisaac.utils.health_monitor import HealthMonitor
+from aisaac.aisaac.utils.http_transport import HttpTransport
 from aisaac.aisaac.utils.logger import Logger
+from aisaac.aisaac.utils.pooled_models import PooledOllama, PooledOllamaEmbeddings, PooledXinference, \
+    PooledXinferenceEmbeddings, raise_for_status
 
 
 class ModelManager:
+    # a generation whose load took longer than this had to load the model instead of finding it in memory
+    cold_load_seconds = 1.0
+    # the models found on each server, shared by all managers of the process
+    discovery_cache = {}
+    discovery_lock = threading.Lock()
+    refreshing_servers = set()
+
     def __init__(self, context_manager):
         self.use_local_models = str(context_manager.get_config('LOCAL_MODELS')).lower() == 'true'
         self.model_client_url = context_manager.get_config('MODEL_CLIENT_URL')
         self.embedding_model_id = context_manager.get_config('EMBEDDING_MODEL')
         self.rag_model_id = context_manager.get_config('RAG_MODEL')
+        self.keep_alive = context_manager.get_config('MODEL_KEEP_ALIVE')
+        self.pin_keep_alive = context_manager.get_config('MODEL_PIN_KEEP_ALIVE')
+        self.micro_batching = str(context_manager.get_config('EMBEDDING_MICRO_BATCHING')) == 'True'
+        self.embedding_batch_endpoint = str(context_manager.get_config('EMBEDDING_BATCH_ENDPOINT')) == 'True'
+        self.embedding_batch_size = context_manager.get_config('EMBEDDING_BATCH_SIZE')
+        self.embedding_batch_wait_ms = context_manager.get_config('EMBEDDING_BATCH_WAIT_MS')
+        self.max_context_window = int(context_manager.get_config('MODEL_CONTEXT_WINDOW'))
+        self.context_window = None
+        self.discovery_ttl = float(context_manager.get_config('MODEL_DISCOVERY_TTL'))
+        self.discovery_file = None
+        if str(context_manager.get_config('MODEL_DISCOVERY_CACHE')) == 'True':
+            discovery_folder = context_manager.get_system_manager().make_directory(
+                context_manager.get_config('BIN_HIGH_LEVEL_FOLDER'))
+            self.discovery_file = os.path.join(discovery_folder, 'model_discovery.json')
         self.my_chat_model, self.embedding, self.model_uids = None, None, None
+        self.load_latencies = {}
+        self.generation_statistics = []
         self.logger = Logger(__name__).get_logger()
+        # one connection pool for all model and embedding calls
+        self.http_transport = HttpTransport(context_manager)
+        probe_path = '/api/tags' if self.use_local_models else '/v1/models'
+        self.health_monitor = HealthMonitor(context_manager, self.http_transport,
+                                            f"{self.model_client_url}{probe_path}")
 
         self.__set_up_models()
 
     def __set_up_embedding(self):
         if self.use_local_models:
-            embedding_setup = OllamaEmbeddings(base_url=self.model_client_url, model=self.embedding_model_id)
+            embedding_setup = PooledOllamaEmbeddings(base_url=self.model_client_url, model=self.embedding_model_id,
+                                                     http_transport=self.http_transport, keep_alive=self.keep_alive,
+                                                     batch_endpoint=self.embedding_batch_endpoint)
         else:
-            embedding_setup = XinferenceEmbeddings(
+            embedding_setup = PooledXinferenceEmbeddings(
                 server_url=self.model_client_url,
-                model_uid=self.model_uids[self.embedding_model_id])
+                model_uid=self.model_uids[self.embedding_model_id],
+                http_transport=self.http_transport)
+        if self.micro_batching:
+            # concurrent calls are combined into one request
+            embedding_setup = EmbeddingBatcher(embedding_setup, max_batch_size=self.embedding_batch_size,
+                                               max_wait_ms=self.embedding_batch_wait_ms)
         return embedding_setup
 
     def __set_up_rag_model(self):
         if self.use_local_models:
-            rag_model_setup = Ollama(base_url=self.model_client_url, model=self.rag_model_id)
+            rag_model_setup = PooledOllama(base_url=self.model_client_url, model=self.rag_model_id,
+                                           http_transport=self.http_transport, keep_alive=self.keep_alive,
+                                           response_callback=self.__record_generation)
         else:
-            rag_model_setup = Xinference(
+            rag_model_setup = PooledXinference(
                 server_url=self.model_client_url,
-                model_uid=self.model_uids[self.rag_model_id]
+                model_uid=self.model_uids[self.rag_model_id],
+                http_transport=self.http_transport
             )
         return rag_model_setup
 
     def __set_up_models(self):
         if self.use_local_models:
             self.logger.info("Using local models.")
-            models = ollama.list()
-            self.model_uids = {model['name']: model['digest'] for model in models["models"]}
+            self.model_uids = self.__discover_models()
             self.logger.info(f"Available models: {list(self.model_uids.keys())}")
 
             if self.rag_model_id not in self.model_uids:
@@ -59,10 +102,7 @@ class ModelManager:
 
         else:
             self.logger.info("Using cosy models.")
-            cosy_client = Client(self.model_client_url)
-            # cosyClient.login("student", "students_key")
-            models = cosy_client.list_models()
-            self.model_uids = {model['model_name']: uid for uid, model in models.items()}
+            self.model_uids = self.__discover_models()
             self.logger.info(f"Available models: {list(self.model_uids.keys())}")
 
             if self.embedding_model_id not in self.model_uids:
@@ -75,28 +115,266 @@ class ModelManager:
             else:
                 self.my_chat_model = self.__set_up_rag_model()
 
+    def __list_models(self):
+        if self.use_local_models:
+            models = ollama.list()
+            return {model['name']: model['digest'] for model in models["models"]}
+        cosy_client = Client(self.model_client_url)
+        # cosyClient.login("student", "students_key")
+        models = cosy_client.list_models()
+        return {model['model_name']: uid for uid, model in models.items()}
+
+    def __discover_models(self):
+        """
+        Get the models of the server from the cache of the process or, with MODEL_DISCOVERY_CACHE, from the cache file.
+        Entries older than MODEL_DISCOVERY_TTL are used and refreshed in the background. The server is only asked
+        directly if nothing is cached or one of the configured models is missing.
+        """
+        server = f"{'ollama' if self.use_local_models else 'xinference'}|{self.model_client_url}"
+        with self.discovery_lock:
+            entry = self.discovery_cache.get(server) or self.__read_discovery_file(server)
+            if entry is not None:
+                self.discovery_cache[server] = entry
+        if entry is not None and {self.rag_model_id, self.embedding_model_id}.issubset(entry['models']):
+            if time.time() - entry['time'] > self.discovery_ttl:
+                self.__refresh_in_background(server)
+            return dict(entry['models'])
+        try:
+            return dict(self.__refresh_discovery(server)['models'])
+        except Exception as e:
+            if entry is None:
+                raise
+            self.logger.warning(f"Could not list the models of {self.model_client_url}: {e}. Using the cached list.")
+            return dict(entry['models'])
+
+    def __refresh_discovery(self, server):
+        entry = {'time': time.time(), 'models': self.__list_models()}
+        with self.discovery_lock:
+            self.discovery_cache[server] = entry
+            self.__write_discovery_file(server, entry)
+        return entry
+
+    def __refresh_in_background(self, server):
+        with self.discovery_lock:
+            if server in self.refreshing_servers:
+                return
+            self.refreshing_servers.add(server)
+
+        def refresh():
+            try:
+                self.__refresh_discovery(server)
+            except Exception as e:
+                self.logger.warning(f"Could not refresh the models of {self.model_client_url}: {e}")
+            finally:
+                with self.discovery_lock:
+                    self.refreshing_servers.discard(server)
+
+        threading.Thread(target=refresh, name='ModelDiscovery', daemon=True).start()
+
+    def __read_discovery_file(self, server):
+        if self.discovery_file is None or not os.path.exists(self.discovery_file):
+            return None
+        try:
+            with open(self.discovery_file) as file:
+                return json.load(file).get(server)
+        except (OSError, ValueError):
+            return None
+
+    def __write_discovery_file(self, server, entry):
+        if self.discovery_file is None:
+            return
+        entries = {}
+        if os.path.exists(self.discovery_file):
+            try:
+                with open(self.discovery_file) as file:
+                    entries = json.load(file)
+            except (OSError, ValueError):
+                entries = {}
+        entries[server] = entry
+        # write to a temporary file first, so that a concurrent reader never sees half a file
+        temporary_file = f"{self.discovery_file}.{os.getpid()}.tmp"
+        with open(temporary_file, 'w') as file:
+            json.dump(entries, file)
+        os.replace(temporary_file, self.discovery_file)
+
+    @classmethod
+    def clear_discovery_cache(cls):
+        """
+        Forget the models found so far in this process, so that the next ModelManager asks the server again.
+        """
+        with cls.discovery_lock:
+            cls.discovery_cache.clear()
+
     def get_embedding(self):
+        attempt = 0
         while not self.embedding:
-            sleeping_time = 5
+            sleeping_time = self.health_monitor.get_backoff(attempt)
             self.logger.critical(
                 f"{self.embedding_model_id} does not exist. Please check the connection and the model name. "
-                f"Trying again in {sleeping_time} seconds.")
+                f"Trying again in {sleeping_time:.1f} seconds.")
             sleep(sleeping_time)
             self.logger.info(f"Trying to get {self.embedding_model_id}.")
             self.embedding = self.__set_up_embedding()
-            sleeping_time *= 2
+            attempt += 1
         return self.embedding
 
     def get_rag_model(self):
+        attempt = 0
         while not self.my_chat_model:
-            sleeping_time = 5
+            sleeping_time = self.health_monitor.get_backoff(attempt)
             self.logger.critical(
                 f"{self.rag_model_id} does not exist. Please check the connection and the model name. "
-                f"Trying again in {sleeping_time} seconds.")
+                f"Trying again in {sleeping_time:.1f} seconds.")
             sleep(sleeping_time)
             self.logger.info(f"Trying to get {self.rag_model_id}.")
             self.my_chat_model = self.__set_up_rag_model()
-            sleeping_time *= 2
+            attempt += 1
         return self.my_chat_model
 
+    def warm_up(self, pin=True):
+        """
+        Load the RAG and the embedding model before the first document is screened, so that no document pays the load
+        time. Ollama unloads idle models after MODEL_KEEP_ALIVE and may evict one model to load the other. Pinned
+        models get the longer MODEL_PIN_KEEP_ALIVE instead, which every request of the run renews, until
+        unpin_models is called. It is finite, so that the models are unloaded even if the run is killed before it
+        unpins them. Xinference keeps launched models in memory by itself, so there the warm-up only sends a first
+        small request.
+
+        :param pin: Whether to keep both models loaded for MODEL_PIN_KEEP_ALIVE after every request until
+        unpin_models is called.
+        :return: A dictionary with the load latency in seconds of each model.
+        """
+        if self.use_local_models:
+            keep_alive = self.pin_keep_alive if pin and self.pin_keep_alive is not None else self.keep_alive
+            self.__set_keep_alive(keep_alive)
+            self.load_latencies[self.rag_model_id] = self.__load_ollama_model(
+                'generate', {'model': self.rag_model_id, 'keep_alive': keep_alive, 'stream': False,
+                             **self.__get_load_options()})
+            self.load_latencies[self.embedding_model_id] = self.__load_ollama_model(
+                'embeddings', {'model': self.embedding_model_id, 'prompt': 'warm-up', 'keep_alive': keep_alive})
+        else:
+            self.logger.info("Model residency is managed by the xinference server.")
+            start = time.perf_counter()
+            self.get_rag_model().invoke('warm-up', generate_config={'max_tokens': 1})
+            self.load_latencies[self.rag_model_id] = time.perf_counter() - start
+            start = time.perf_counter()
+            self.get_embedding().embed_query('warm-up')
+            self.load_latencies[self.embedding_model_id] = time.perf_counter() - start
+        self.logger.info(f"Warmed up models in {self.load_latencies} seconds.")
+        return dict(self.load_latencies)
+
+    def unpin_models(self):
+        """
+        Hand the models back to the keep-alive of MODEL_KEEP_ALIVE, counted from now.
+        """
+        if not self.use_local_models:
+            return
+        self.__set_keep_alive(self.keep_alive)
+        if self.keep_alive is None:
+            return
+        self.__load_ollama_model('generate', {'model': self.rag_model_id, 'keep_alive': self.keep_alive,
+                                              'stream': False, **self.__get_load_options()})
+        self.__load_ollama_model('embeddings', {'model': self.embedding_model_id, 'prompt': 'warm-up',
+                                                'keep_alive': self.keep_alive})
+
+    def get_latency_report(self):
+        """
+        Get the load latencies of the warm-up separately from the latencies of the generations since then. The
+        generation latencies are only available for local models. The load, prefill, decode and total seconds are the
+        durations Ollama reports, which it does not for generations stopped early. The wall seconds, the seconds to the
+        first token and the generated tokens are measured by the client for every generation.
+
+        :return: A dictionary with the load latency of each model, the number of generations, how many of them had
+        to load the model first, how many were stopped early and the mean seconds and generated tokens per generation.
+        The means of the durations reported by Ollama leave out the generations stopped early.
+        """
+        generations = list(self.generation_statistics)
+        report = {
+            'load_latencies': dict(self.load_latencies),
+            'generations': len(generations),
+            'cold_generations': sum(1 for generation in generations
+                                    if (generation['load_seconds'] or 0) > self.cold_load_seconds),
+            'stopped_early_generations': sum(1 for generation in generations if generation['stopped_early']),
+        }
+        for key in ('load_seconds', 'prefill_seconds', 'decode_seconds', 'total_seconds', 'wall_seconds',
+                    'first_token_seconds', 'generated_tokens'):
+            values = [generation[key] for generation in generations if generation[key] is not None]
+            report[f'mean_{key}'] = sum(values) / len(values) if values else 0.0
+        return report
+
+    def __record_generation(self, final_line):
+        # a generation stopped early has no final line, so only the values measured by the client are known
+        stopped_early = final_line.get('stopped_early', False)
+        self.generation_statistics.append({
+            'load_seconds': None if stopped_early else final_line.get('load_duration', 0) / 1e9,
+            'prefill_seconds': None if stopped_early else final_line.get('prompt_eval_duration', 0) / 1e9,
+            'decode_seconds': None if stopped_early else final_line.get('eval_duration', 0) / 1e9,
+            'total_seconds': None if stopped_early else final_line.get('total_duration', 0) / 1e9,
+            'prompt_tokens': None if stopped_early else final_line.get('prompt_eval_count', 0),
+            'generated_tokens': final_line.get('client_tokens') if stopped_early else final_line.get('eval_count', 0),
+            'wall_seconds': final_line.get('client_seconds'),
+            'first_token_seconds': final_line.get('client_first_token_seconds'),
+            'stopped_early': stopped_early,
+        })
+
+    def __set_keep_alive(self, keep_alive):
+        # every request resets the keep-alive of its model, so the wrappers have to send the same value
+        embedding = self.get_embedding()
+        if isinstance(embedding, EmbeddingBatcher):
+            embedding = embedding.embedding
+        for model in (self.get_rag_model(), embedding):
+            model.keep_alive = keep_alive
+
+    def __get_load_options(self):
+        # a model loaded with another context window is loaded again by the first generation
+        num_ctx = self.get_rag_model().num_ctx
+        return {'options': {'num_ctx': num_ctx}} if num_ctx is not None else {}
+
+    def __load_ollama_model(self, endpoint, payload):
+        # a request without input only loads the model and sets its keep-alive
+        start = time.perf_counter()
+        response = self.http_transport.post(f"{self.model_client_url}/api/{endpoint}", json=payload)
+        if response.status_code != 200:
+            raise_for_status(response, f"Loading {payload['model']} failed with status code {response.status_code}. "
+                                       f"Details: {response.text}")
+        return time.perf_counter() - start
+
+    def get_context_window(self):
+        """
+        Get the context window to run the RAG model with. This is MODEL_CONTEXT_WINDOW, or less if the model was
+        trained on a shorter context. Only Ollama reports the trained context length.
+        """
+        if self.context_window is None:
+            self.context_window = self.max_context_window
+            trained_context_length = self.__get_trained_context_length() if self.use_local_models else None
+            if trained_context_length:
+                self.context_window = min(self.context_window, trained_context_length)
+        return self.context_window
+
+    def __get_trained_context_length(self):
+        try:
+            response = self.http_transport.post(f"{self.model_client_url}/api/show", json={'name': self.rag_model_id})
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"Could not get the context length of {self.rag_model_id}: {e}")
+            return None
+        if response.status_code != 200:
+            return None
+        model_info = response.json().get('model_info') or {}
+        context_lengths = [value for key, value in model_info.items() if key.endswith('.context_length')]
+        return int(context_lengths[0]) if context_lengths else None
+
+    def get_http_statistics(self):
+        """
+        Get the connection reuse statistics of the HTTP pool shared by all model and embedding calls.
+        """
+        return self.http_transport.get_statistics()
+
+    def get_embedding_batch_statistics(self):
+        """
+        Get how many embedding calls were combined into how many requests. Empty without EMBEDDING_MICRO_BATCHING.
+        """
+        if isinstance(self.embedding, EmbeddingBatcher):
+            return self.embedding.get_statistics()
+        return {}
+
 # %%
@@ -0,0 +1,208 @@
+import json
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.llms.ollama import Ollama, OllamaEndpointNotFoundError
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+
+# The langchain wrappers below send their requests through the HttpTransport of the ModelManager instead of opening a
+# new connection per call.
+
+final_line_pattern = re.compile(r'"done"\s*:\s*true')
+
+
+class ModelServerError(ValueError):
+    """
+    Raised when the model server answers with a server error (5xx). Unlike a client error, such as a bad request,
+    the same request may succeed once the server recovers.
+    """
+
+
+def raise_for_status(response: Any, message: str) -> None:
+    if response.status_code >= 500:
+        raise ModelServerError(message)
+    raise ValueError(message)
+
+
+class PooledOllama(Ollama):
+    http_transport: Any = None
+    # called once per generation with the final line, which holds the load, prefill and decode durations, and the
+    # durations measured by the client. A generation the caller stops early has no final line, only the latter
+    response_callback: Any = None
+
+    def _create_stream(
+            self,
+            api_url: str,
+            payload: Any,
+            stop: Optional[List[str]] = None,
+            **kwargs: Any,
+    ) -> Iterator[str]:
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{key: value for key, value in kwargs.items() if key not in self._default_params},
+            }
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+        start_time = time.perf_counter()
+        response = self.http_transport.post(
+            api_url,
+            headers={"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})},
+            json=request_payload,
+            stream=True,
+            **({'timeout': self.timeout} if self.timeout is not None else {}),
+        )
+        response.encoding = "utf-8"
+        if response.status_code != 200:
+            # a streamed response holds its pooled connection until it is closed
+            try:
+                if response.status_code == 404:
+                    raise OllamaEndpointNotFoundError(
+                        f"Ollama call failed with status code 404. Maybe your model is not found "
+                        f"and you should pull the model with `ollama pull {self.model}`.")
+                raise_for_status(response, f"Ollama call failed with status code {response.status_code}. "
+                                           f"Details: {response.text}")
+            finally:
+                response.close()
+        return self._read_lines(response, start_time)
+
+    def _read_lines(self, response: Any, start_time: Optional[float] = None) -> Iterator[str]:
+        # the response is closed when the caller stops reading early, so that the server stops generating
+        start_time = time.perf_counter() if start_time is None else start_time
+        first_line_time = None
+        streamed_lines = 0
+        final_line = None
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                streamed_lines += 1
+                if first_line_time is None:
+                    first_line_time = time.perf_counter()
+                if self.response_callback is not None and final_line_pattern.search(line):
+                    final_line = json.loads(line)
+                    self.__report(final_line, start_time, first_line_time, streamed_lines)
+                yield line
+        finally:
+            response.close()
+            if final_line is None and self.response_callback is not None and streamed_lines:
+                self.__report({}, start_time, first_line_time, streamed_lines)
+
+    def __report(self, final_line: Dict[str, Any], start_time: float, first_line_time: float,
+                 streamed_lines: int) -> None:
+        # Ollama streams one token per line
+        self.response_callback({
+            **final_line,
+            'client_seconds': time.perf_counter() - start_time,
+            'client_first_token_seconds': first_line_time - start_time,
+            'client_tokens': streamed_lines,
+            'stopped_early': not final_line,
+        })
+
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    http_transport: Any = None
+    keep_alive: Optional[Union[int, str]] = None
+    # send every batch with one request to /api/embed. That endpoint returns normalized embeddings, so stores built
+    # with the per-text /api/embeddings endpoint have to be rebuilt when this is switched on
+    batch_endpoint: bool = False
+
+    def _embed(self, input: List[str]) -> List[List[float]]:
+        if self.batch_endpoint:
+            keep_alive = {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+            response = self.http_transport.post(
+                f"{self.base_url}/api/embed",
+                headers={"Content-Type": "application/json", **(self.headers or {})},
+                json={"model": self.model, "input": input, **keep_alive, **self._default_params},
+            )
+            if response.status_code == 200:
+                return response.json()["embeddings"]
+            if response.status_code != 404:
+                raise_for_status(response, f"Error raised by inference API HTTP code: {response.status_code}, "
+                                           f"{response.text}")
+            # servers before Ollama 0.3 only know the per-text endpoint
+            self.batch_endpoint = False
+        return [self._process_emb_response(text) for text in input]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed([f"{self.query_instruction}{text}" for text in texts])
+
+    def _process_emb_response(self, input: str) -> List[float]:
+        keep_alive = {"keep_alive": self.keep_alive} if self.keep_alive is not None else {}
+        response = self.http_transport.post(
+            f"{self.base_url}/api/embeddings",
+            headers={"Content-Type": "application/json", **(self.headers or {})},
+            json={"model": self.model, "prompt": input, **keep_alive, **self._default_params},
+        )
+        if response.status_code != 200:
+            raise_for_status(response, f"Error raised by inference API HTTP code: {response.status_code}, "
+                                       f"{response.text}")
+        return response.json()["embedding"]
+
+
+class PooledXinference(LLM):
+    server_url: str
+    model_uid: str
+    http_transport: Any = None
+    model_kwargs: Optional[Dict[str, Any]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "xinference"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"server_url": self.server_url, "model_uid": self.model_uid, "model_kwargs": self.model_kwargs or {}}
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        generate_config = {**(self.model_kwargs or {}), **kwargs.get("generate_config", {})}
+        if stop:
+            generate_config["stop"] = stop
+        response = self.http_transport.post(f"{self.server_url}/v1/completions",
+                                            json={"model": self.model_uid, "prompt": prompt, **generate_config})
+        if response.status_code != 200:
+            raise_for_status(response, f"Xinference call failed with status code {response.status_code}. "
+                                       f"Details: {response.text}")
+        return response.json()["choices"][0]["text"]
+
+
+class PooledXinferenceEmbeddings(Embeddings):
+    def __init__(self, server_url, model_uid, http_transport):
+        self.server_url = server_url
+        self.model_uid = model_uid
+        self.http_transport = http_transport
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # the endpoint takes a list, so all texts are embedded with one request
+        response = self.http_transport.post(f"{self.server_url}/v1/embeddings",
+                                            json={"model": self.model_uid, "input": texts})
+        if response.status_code != 200:
+            raise_for_status(response, f"Error raised by inference API HTTP code: {response.status_code}, "
+                                       f"{response.text}")
+        data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in data]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
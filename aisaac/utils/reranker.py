@@ -0,0 +1,157 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+
+from aisaac.aisaac.utils.lexical_index import LexicalIndex
+from aisaac.aisaac.utils.logger import Logger
+
+
+class Reranker(ABC):
+    def __init__(self, context_manager):
+        """
+        Initialize a reranker. Subclasses implement score_pairs. The scores are cached by query and chunk hash, so a
+        chunk is not scored twice for the same query. The cache keeps the RERANK_CACHE_SIZE most recently used scores.
+
+        :param context_manager: The ContextManager instance to use for configuration.
+        """
+        self.top_n = int(context_manager.get_config('RERANK_TOP_N'))
+        self.cache_size = int(context_manager.get_config('RERANK_CACHE_SIZE'))
+        self.cache = OrderedDict()
+        self.logger = Logger(__name__).get_logger()
+
+    def rerank(self, query_text, results):
+        """
+        Rerank the results of one query.
+
+        :param query_text: The query the results were retrieved for.
+        :param results: A list of (Document, score) tuples.
+        :return: The top RERANK_TOP_N (Document, score) tuples by reranking score.
+        """
+        return self.rerank_batch([(query_text, results)])[0]
+
+    def rerank_batch(self, requests):
+        """
+        Rerank the results of several queries, e.g. of all checkpoints of a document, with one scoring call.
+
+        :param requests: A list of (query, results) tuples, where results is a list of (Document, score) tuples.
+        :return: A list with the reranked results of every request.
+        """
+        scores, pending = {}, {}
+        for query_text, results in requests:
+            for doc, _score in results:
+                key = (query_text, self.get_chunk_hash(doc.page_content))
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    scores[key] = self.cache[key]
+                elif key not in pending:
+                    pending[key] = (query_text, doc.page_content)
+        if pending:
+            scores.update(zip(pending.keys(), self.score_pairs(list(pending.values()))))
+            for key in pending:
+                self.cache[key] = scores[key]
+            # the least recently used scores are dropped first
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.logger.debug(f"Scored {len(pending)} query-chunk pairs, {len(self.cache)} pairs are cached.")
+
+        reranked_results = []
+        for query_text, results in requests:
+            scored = [(doc, scores[(query_text, self.get_chunk_hash(doc.page_content))]) for doc, _score in results]
+            scored.sort(key=lambda result: result[1], reverse=True)
+            reranked_results.append(scored[:self.top_n])
+        return reranked_results
+
+    @abstractmethod
+    def score_pairs(self, pairs):
+        """
+        Score query-chunk pairs.
+
+        :param pairs: A list of (query, chunk text) tuples.
+        :return: A list of scores in [0, 1], one per pair.
+        """
+
+    @staticmethod
+    def get_chunk_hash(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class LocalReranker(Reranker):
+    def __init__(self, context_manager):
+        """
+        Initialize an offline reranker that combines the cosine similarity of the embeddings with the share of the
+        query terms found in the chunk. With RERANK_EMBEDDING_WEIGHT at 0, it needs no model at all.
+        """
+        super().__init__(context_manager)
+        self.embedding_weight = float(context_manager.get_config('RERANK_EMBEDDING_WEIGHT'))
+        self.model_manager = context_manager.get_model_manager() if self.embedding_weight > 0 else None
+
+    def score_pairs(self, pairs):
+        lexical_scores = np.asarray([self.__get_term_coverage(query_text, text) for query_text, text in pairs])
+        if self.embedding_weight == 0:
+            return lexical_scores.tolist()
+
+        # every unique query and chunk is embedded once, the chunks in a single batched request
+        embedding = self.model_manager.get_embedding()
+        queries = list(dict.fromkeys(query_text for query_text, _text in pairs))
+        texts = list(dict.fromkeys(text for _query_text, text in pairs))
+        query_matrix = self.__normalize(np.asarray([embedding.embed_query(query) for query in queries]))
+        text_matrix = self.__normalize(np.asarray(embedding.embed_documents(texts)))
+        query_rows = {query_text: row for row, query_text in enumerate(queries)}
+        text_rows = {text: row for row, text in enumerate(texts)}
+        cosine_scores = np.asarray([query_matrix[query_rows[query_text]] @ text_matrix[text_rows[text]]
+                                    for query_text, text in pairs])
+        scores = self.embedding_weight * np.clip(cosine_scores, 0, 1) + (1 - self.embedding_weight) * lexical_scores
+        return scores.tolist()
+
+    @staticmethod
+    def __get_term_coverage(query_text, text):
+        query_terms = set(LexicalIndex.tokenize(query_text))
+        if not query_terms:
+            return 0.0
+        return len(query_terms.intersection(LexicalIndex.tokenize(text))) / len(query_terms)
+
+    @staticmethod
+    def __normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+
+class CohereReranker(Reranker):
+    # one client per API key, shared by all rerankers of the process
+    clients = {}
+
+    def __init__(self, context_manager):
+        """
+        Initialize a reranker that uses the Cohere rerank API. This needs the optional cohere package and an API key
+        in COHERE_API_KEY, either in the config or in the environment.
+        """
+        super().__init__(context_manager)
+        self.api_key = context_manager.get_config('COHERE_API_KEY') or os.environ.get('COHERE_API_KEY')
+        self.model = context_manager.get_config('COHERE_RERANK_MODEL')
+        if not self.api_key:
+            raise ValueError("Reranking with cohere needs an API key. Set COHERE_API_KEY.")
+
+    def get_client(self):
+        if self.api_key not in self.clients:
+            import cohere
+            self.clients[self.api_key] = cohere.Client(self.api_key)
+        return self.clients[self.api_key]
+
+    def score_pairs(self, pairs):
+        # the API takes one query at a time, so the chunks are grouped by query
+        texts_by_query = {}
+        for index, (query_text, text) in enumerate(pairs):
+            texts_by_query.setdefault(query_text, []).append((index, text))
+        scores = [0.0] * len(pairs)
+        client = self.get_client()
+        for query_text, indexed_texts in texts_by_query.items():
+            # handle return format. Can be found here: https://docs.cohere.com/reference/rerank-1
+            response = client.rerank(query=query_text, documents=[text for _index, text in indexed_texts],
+                                     top_n=len(indexed_texts), model=self.model)
+            for result in response.results:
+                scores[indexed_texts[result.index][0]] = result.relevance_score
+        return scores
@@ -1,6 +1,10 @@
 import csv
+import json
+import math
 import os
 
+from aisaac.aisaac.utils.logger import Logger
+
 
 class ResultSaver:
     def __init__(self, context_manager):
@@ -10,9 +14,11 @@ class ResultSaver:
         self.full_result_file_path = self.system_manager.get_full_path(
             f"{self.result_path}/{self.result_file}")
         self.system_manager.make_directory(self.result_path)
-        self.csv_headers = ['title', 'converted', 'embedded', 'relevant', 'checkpoints', 'reasoning']
+        self.csv_headers = ['title', 'converted', 'embedded', 'relevant', 'checkpoints', 'reasoning', 'confidence']
         self.full_chroma_path = self.system_manager.get_full_path(context_manager.get_config('CHROMA_PATH'))
         self.reset_results_bool = context_manager.get_config('RESET_RESULTS') == 'True'
+        self.listeners = []
+        self.logger = Logger(__name__).get_logger()
         if self.reset_results_bool:
             self.reset_results()
         self.document_data_manager = context_manager.get_document_data_manager()
@@ -111,6 +117,69 @@ class ResultSaver:
                 result_list[0].update({"embedded": True})
             self.add_data_csv(result_list)
 
+    def get_run_configuration_path(self, result_file_path=None):
+        return f"{result_file_path or self.full_result_file_path}.config.json"
+
+    def save_run_configuration(self, run_configuration, screening_seconds=None):
+        """
+        Save the configuration of the run next to its result file, so that the run can be told apart from others
+        when it is evaluated later.
+
+        :param run_configuration: The configuration and fingerprint, see ContextManager.get_run_configuration.
+        :param screening_seconds: How long the screening took.
+        """
+        with open(self.get_run_configuration_path(), 'w') as configuration_file:
+            json.dump({**run_configuration, 'screening_seconds': screening_seconds}, configuration_file, indent=2,
+                      default=str)
+
+    def add_listener(self, listener):
+        """
+        Call a function with every saved response.
+
+        :param listener: A function that takes the title, the relevance decision (None without checkpoints) and the
+        checkpoints of the response.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def __notify_listeners(self, title, relevant, checkpoints):
+        for listener in list(self.listeners):
+            try:
+                listener(title, relevant, checkpoints)
+            except Exception as e:
+                self.logger.error(f"Error notifying a result listener about {title}: {e}")
+
+    @staticmethod
+    def convert_confidence(confidence, checkpoints):
+        """
+        Convert the self-rated confidences of a response into probabilities that the checkpoints are true.
+
+        :param confidence: The confidence of every checkpoint as returned by the model, as a number between 0 and 1,
+        a percentage or a string of either.
+        :param checkpoints: The checkpoints of the response.
+        :return: A dictionary with a probability between 0 and 1, or None, for every checkpoint.
+        """
+        confidence = confidence if isinstance(confidence, dict) else {}
+        converted_confidence = {}
+        for key in checkpoints:
+            value = confidence.get(key)
+            try:
+                if isinstance(value, str):
+                    value = value.strip()
+                    probability = float(value.rstrip('%')) / 100 if value.endswith('%') else float(value)
+                else:
+                    probability = float(value)
+            except (TypeError, ValueError):
+                converted_confidence[key] = None
+                continue
+            if 1 < probability <= 100:
+                probability /= 100
+            converted_confidence[key] = None if math.isnan(probability) else min(1.0, max(0.0, probability))
+        return converted_confidence
+
     def save_response(self, response, title):
         checkpoints = response['checkpoints']
         reasoning = response['reasoning']
@@ -119,9 +188,11 @@ class ResultSaver:
             self.update_csv([{
                 "title": title,
                 "relevant": None,
-                "checkpoints": checkpoints,
-                "reasoning": reasoning
+                "checkpoints": json.dumps(checkpoints),
+                "reasoning": json.dumps(reasoning, default=str),
+                "confidence": json.dumps({})
             }])
+            self.__notify_listeners(title, None, checkpoints)
             return
 
         converted_checkpoints = {key: value.lower() == 'true' if isinstance(value, str) else bool(value) for key, value
@@ -132,9 +203,12 @@ class ResultSaver:
         self.update_csv([{
             "title": title,
             "relevant": relevant,
-            "checkpoints": converted_checkpoints,
-            "reasoning": reasoning
+            # stored as JSON, so that the evaluator can parse the dictionaries without guessing their format
+            "checkpoints": json.dumps(converted_checkpoints),
+            "reasoning": json.dumps(reasoning, default=str),
+            "confidence": json.dumps(self.convert_confidence(response.get('confidence'), converted_checkpoints))
         }])
+        self.__notify_listeners(title, relevant, converted_checkpoints)
 
 
 # %%
@@ -1,8 +1,3 @@
-import warnings
-
-import cohere
-from langchain_core.documents import Document
-
 from aisaac.aisaac.utils.logger import Logger
 
 
@@ -14,52 +9,86 @@ class SimilaritySearcher:
         self.logger = Logger(__name__).get_logger()
         self.similarity_search_k = int(context_manager.get_config('SIMILARITY_SEARCH_K'))
         self.relevance_threshold = float(context_manager.get_config('RELEVANCE_THRESHOLD_CUTOFF'))
-        self.apply_reranking = context_manager.get_config('RERANKING') == 'True'
-        self.apply_relevance_threshold = context_manager.get_config('RELEVANCE_THRESHOLD') == 'True'
-
-    def __apply_reranking_method(self, results, query_text):
-        # TODO replace with actual API key
-        co = cohere.Client("Dz03PKYzHRwgvTgPWucDClzr2RylARxhmex7cGJ9")
-        # the content of results is docs
-        docs = [doc.page_content for doc, _score in results]
-        # TODO replace with actual model
-        rerank_hits = co.rerank(query=query_text, documents=docs, top_n=3, model='rerank-multilingual-v2.0')
-        # handle return format. Can be found here: https://docs.cohere.com/reference/rerank-1
-        formatted_hits = [(Document(page_content=result.document['text']), result.relevance_score) for result in
-                          rerank_hits]
-        return formatted_hits
+        self.apply_reranking = str(context_manager.get_config('APPLY_RERANKING')) == 'True'
+        self.reranker = context_manager.get_reranker() if self.apply_reranking else None
+        self.apply_relevance_threshold = str(context_manager.get_config('APPLY_RELEVANCE_THRESHOLD')) == 'True'
+        self.retrieval_mode = context_manager.get_config('RETRIEVAL_MODE')
+        self.rrf_k = int(context_manager.get_config('RRF_K'))
+        if self.retrieval_mode not in ('vector', 'hybrid', 'lexical'):
+            raise ValueError(f"Retrieval mode {self.retrieval_mode} not supported. Use 'vector', 'hybrid' or 'lexical'.")
 
     def __apply_relevance_threshold_method(self, results):
         return [result for result in results if result[1] > self.relevance_threshold]
 
-    def similarity_search(self, document_title, query_text):
+    def __fuse_rankings(self, vector_results, lexical_results):
+        # reciprocal rank fusion, the scores are divided by the best possible score (first in both rankings)
+        fused = {}
+        for results in (vector_results, lexical_results):
+            for rank, (doc, _score) in enumerate(results):
+                fused_doc, fused_score = fused.get(doc.page_content, (doc, 0.0))
+                fused[doc.page_content] = (fused_doc, fused_score + 1 / (self.rrf_k + rank + 1))
+        best_possible_score = 2 / (self.rrf_k + 1)
+        ranking = sorted(fused.values(), key=lambda result: result[1], reverse=True)[:self.similarity_search_k]
+        return [(doc, score / best_possible_score) for doc, score in ranking]
+
+    def lexical_search(self, document_title, query_text, k=None):
+        """
+        Search the chunks of a document with BM25 only. This needs no embedding and is cheap enough to be used as a
+        filter before any retrieval.
+
+        :return: A list of (Document, score) tuples with the scores divided by the best score.
+        """
+        lexical_index = self.vector_data_manager.get_lexical_index(document_title)
+        if lexical_index is None:
+            return []
+        return lexical_index.search(query_text, k or self.similarity_search_k)
+
+    def contains_terms(self, document_title, terms):
+        """
+        Check whether all the given terms, e.g. "NIFTP" or "Hurthle cell", occur in a document.
+        """
+        lexical_index = self.vector_data_manager.get_lexical_index(document_title)
+        return lexical_index is not None and lexical_index.contains_terms(terms)
+
+    def vector_search(self, document_title, query_text):
         db = self.vector_data_manager.get_vectorstore(document_title)
-        self.logger.debug(f"Conducting similarity search for {document_title} with following query: \n{query_text}.")
-        # catching warnings from the similarity search and trying again with a different relevance score function
-        with warnings.catch_warnings(record=True) as caught_warnings:
-            results = db.similarity_search_with_relevance_scores(query_text, k=self.similarity_search_k)
-            for _ in caught_warnings:
-                # This relevance score function is a sigmoid function
-                db = self.vector_data_manager.get_vectorstore_with_sigmoid_relevance_score_fn(document_title)
-                with warnings.catch_warnings(record=True) as more_caught_warnings:
-                    results = db.similarity_search_with_relevance_scores(query_text, k=self.similarity_search_k)
-                    for _ in more_caught_warnings:
-                        # Here we don't generate a score, but add a default in the end
-                        results = db.similarity_search(query_text, k=self.similarity_search_k)
-                        results = [(document, self.relevance_threshold) for document in results]
-                        self.logger.warning(
-                            f"Could not find a relevance score function that works for {document_title}."
-                            f"Applied default relevance threshold of {self.relevance_threshold}.")
-        self.logger.debug(f"Found {len(results)} results.")
+        # the relevance scores are normalized by the calibration that was saved with the store
+        return db.similarity_search_with_relevance_scores(query_text, k=self.similarity_search_k)
+
+    def similarity_search(self, document_title, query_text):
+        return self.similarity_search_batch(document_title, [query_text])[0]
+
+    def similarity_search_batch(self, document_title, query_texts):
+        """
+        Search a document for several queries, e.g. all checkpoints. The results of all queries are reranked together
+        in one batch.
+
+        :return: A list with the list of (Document, score) tuples of every query.
+        """
+        batch_results = []
+        for query_text in query_texts:
+            self.logger.debug(f"Conducting {self.retrieval_mode} search for {document_title} with following query: "
+                              f"\n{query_text}.")
+            if self.retrieval_mode == 'lexical':
+                results = self.lexical_search(document_title, query_text)
+            else:
+                results = self.vector_search(document_title, query_text)
+            if self.retrieval_mode == 'hybrid':
+                # the threshold only applies to the vector scores, exact term matches are always kept
+                if self.apply_relevance_threshold:
+                    results = self.__apply_relevance_threshold_method(results)
+                results = self.__fuse_rankings(results, self.lexical_search(document_title, query_text))
+            self.logger.debug(f"Found {len(results)} results.")
+            batch_results.append(results)
         if self.apply_reranking:
-            results = self.__apply_reranking_method(results, query_text)
-            self.logger.info(f"Applied Reranking. {len(results)} results remain.")
+            batch_results = self.reranker.rerank_batch(list(zip(query_texts, batch_results)))
+            self.logger.info(f"Applied Reranking. {sum(map(len, batch_results))} results remain.")
         else:
             self.logger.info("Not applying Reranking.")
-        if self.apply_relevance_threshold:
-            results = self.__apply_relevance_threshold_method(results)
-            self.logger.info(f"Applied relevance threshold. {len(results)} results remain.")
+        if self.apply_relevance_threshold and self.retrieval_mode == 'vector':
+            batch_results = [self.__apply_relevance_threshold_method(results) for results in batch_results]
+            self.logger.info(f"Applied relevance threshold. {sum(map(len, batch_results))} results remain.")
         else:
             self.logger.debug("Not applying relevance threshold.")
 
-        return results
+        return batch_results
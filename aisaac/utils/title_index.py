@@ -0,0 +1,201 @@
+import csv
+import difflib
+import os
+import re
+import unicodedata
+
+document_extensions = frozenset({'.pdf', '.md', '.txt', '.doc', '.docx', '.html', '.xml'})
+whitespace_pattern = re.compile(r"\s+")
+# numbers and roman numerals tell apart titles that are otherwise the same, such as the parts or years of a study
+distinguishing_token_pattern = re.compile(r"^(?:\w*\d\w*|m{0,4}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3}))$")
+
+
+def normalize_title(title):
+    """
+    Normalize a title the way the result files and the gold standard are compared exactly: surrounding whitespace and
+    quotation marks are removed and the unicode characters are composed (NFC).
+    """
+    return unicodedata.normalize('NFC', str(title).strip().strip('"').strip())
+
+
+def canonicalize_title(title):
+    """
+    Get the canonical form of a title, which ignores the file extension, case, punctuation and whitespace.
+    """
+    title = normalize_title(title)
+    stem, extension = os.path.splitext(title)
+    if extension.casefold() in document_extensions:
+        title = stem
+    # every punctuation mark and symbol becomes a space, so that "A-B" and "A B" match but "AB" does not
+    title = ''.join(' ' if unicodedata.category(character)[0] in 'PS' else character
+                    for character in unicodedata.normalize('NFKC', title).casefold())
+    return whitespace_pattern.sub(' ', title).strip()
+
+
+def get_distinguishing_tokens(canonical_title):
+    """
+    Get the numbers and roman numerals of a canonical title, in their order.
+    """
+    return [token for token in canonical_title.split() if distinguishing_token_pattern.match(token)]
+
+
+def parse_decision(value):
+    """
+    Parse a relevance decision of a CSV file.
+
+    :return: True, False or None if the value is no decision.
+    """
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().casefold()
+    return True if value == 'true' else False if value == 'false' else None
+
+
+class TitleIndex:
+    EXACT = 'exact'
+    NORMALIZED = 'normalized'
+    FUZZY = 'fuzzy'
+
+    def __init__(self, titles, values=None, fuzzy_cutoff=None):
+        """
+        Initialize an index of titles, such as the titles of the gold standard. A title is looked up exactly first,
+        then by its canonical form (see canonicalize_title), and, if fuzzy_cutoff is set, then by the most similar
+        canonical form with a similarity of at least fuzzy_cutoff and the same numbers and roman numerals. Every title
+        is matched once, later lookups of it take constant time.
+
+        :param titles: The titles to index.
+        :param values: The value of every title, such as its gold decision.
+        :param fuzzy_cutoff: The minimum similarity between 0 and 1 of a fuzzy match, or None to match no titles
+        fuzzily.
+        """
+        self.titles = list(titles)
+        self.values = dict(zip(self.titles, values)) if values is not None else dict.fromkeys(self.titles)
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.exact_titles = {}
+        self.canonical_titles = {}
+        self.ambiguous_titles = []
+        for title in self.titles:
+            self.exact_titles.setdefault(normalize_title(title), title)
+            canonical_title = canonicalize_title(title)
+            if canonical_title in self.canonical_titles and self.canonical_titles[canonical_title] != title:
+                self.ambiguous_titles.append(title)
+                continue
+            self.canonical_titles[canonical_title] = title
+        self.canonical_title_list = list(self.canonical_titles)
+        self.matches = {}
+
+    @classmethod
+    def from_csv(cls, path, fuzzy_cutoff=None):
+        """
+        Create the index of a gold standard file with the title in the first and the decision in the second column.
+        Rows without a decision are left out.
+        """
+        with open(path, 'r', newline='') as csv_file:
+            rows = list(csv.reader(csv_file))[1:]
+        return cls.from_decisions({row[0]: row[1] for row in rows if len(row) > 1}, fuzzy_cutoff)
+
+    @classmethod
+    def from_decisions(cls, decisions, fuzzy_cutoff=None):
+        """
+        Create the index of a dictionary of titles and decisions, such as ResultSaver.read_csv_to_dict_relevant_only
+        returns. Titles without a decision are left out.
+        """
+        decisions = {title: parse_decision(value) for title, value in decisions.items()}
+        decisions = {title: value for title, value in decisions.items() if value is not None}
+        return cls(decisions.keys(), decisions.values(), fuzzy_cutoff)
+
+    def match(self, title):
+        """
+        Find the indexed title that matches a title.
+
+        :return: The indexed title, or None if no title matches.
+        """
+        return self.match_with_method(title)[0]
+
+    def match_with_method(self, title):
+        """
+        Find the indexed title that matches a title, and how it was found.
+
+        :return: A tuple of the indexed title and EXACT, NORMALIZED or FUZZY, or (None, None) if no title matches.
+        """
+        match = self.matches.get(title)
+        if match is None:
+            match = self.__find_match(title)
+            self.matches[title] = match
+        return match
+
+    def get(self, title, default=None):
+        indexed_title = self.match(title)
+        return self.values[indexed_title] if indexed_title is not None else default
+
+    def __contains__(self, title):
+        return self.match(title) is not None
+
+    def match_positions(self, titles):
+        """
+        Match a list of titles, such as the titles of a result file, so that every indexed title is claimed by at
+        most one position. Exact and normalized matches are resolved first and a fuzzy match never claims an indexed
+        title another title already matched. A title that appears again, such as a document screened again, replaces
+        its earlier position.
+
+        :param titles: The titles to match. Titles that are not strings are skipped.
+        :return: A tuple of a dictionary with the position of every matched indexed title, and the conflicts, a list
+        of (title, indexed title, title that claimed it) tuples of the titles that lost their match.
+        """
+        matches = [(position, title, *self.match_with_method(title))
+                   for position, title in enumerate(titles) if isinstance(title, str)]
+        positions = {}
+        claiming_titles = {}
+        conflicts = []
+        for methods in ((self.EXACT,), (self.NORMALIZED,), (self.FUZZY,)):
+            for position, title, indexed_title, method in matches:
+                if method not in methods:
+                    continue
+                claiming_title = claiming_titles.get(indexed_title)
+                if claiming_title is not None and claiming_title != title:
+                    conflicts.append((title, indexed_title, claiming_title))
+                    continue
+                positions[indexed_title] = position
+                claiming_titles[indexed_title] = title
+        return positions, conflicts
+
+    def get_match_report(self, titles):
+        """
+        Report how a list of titles, such as the titles of a result file, matches the index.
+
+        :return: A dictionary with the number of titles matched exactly, normalized and fuzzily, the fuzzy matches,
+        the titles without a match, the indexed titles no title matched and the conflicts of match_positions.
+        """
+        titles = list(titles)
+        positions, conflicts = self.match_positions(titles)
+        report = {self.EXACT: 0, self.NORMALIZED: 0, self.FUZZY: 0, 'fuzzy_matches': {}, 'unmatched_titles': [],
+                  'conflicts': conflicts}
+        conflicting_titles = {title for title, _indexed_title, _claiming_title in conflicts}
+        for title in titles:
+            indexed_title, method = self.match_with_method(title)
+            if indexed_title is None or title in conflicting_titles:
+                report['unmatched_titles'].append(title)
+                continue
+            report[method] += 1
+            if method == self.FUZZY:
+                report['fuzzy_matches'][title] = indexed_title
+        report['unmatched_index_titles'] = [title for title in self.titles if title not in positions]
+        return report
+
+    def __find_match(self, title):
+        indexed_title = self.exact_titles.get(normalize_title(title))
+        if indexed_title is not None:
+            return indexed_title, self.EXACT
+        canonical_title = canonicalize_title(title)
+        indexed_title = self.canonical_titles.get(canonical_title)
+        if indexed_title is not None:
+            return indexed_title, self.NORMALIZED
+        if self.fuzzy_cutoff is None or not canonical_title:
+            return None, None
+        distinguishing_tokens = get_distinguishing_tokens(canonical_title)
+        close_matches = difflib.get_close_matches(canonical_title, self.canonical_title_list, n=3,
+                                                  cutoff=self.fuzzy_cutoff)
+        for close_match in close_matches:
+            if get_distinguishing_tokens(close_match) == distinguishing_tokens:
+                return self.canonical_titles[close_match], self.FUZZY
+        return None, None
@@ -0,0 +1,88 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
+from aisaac.aisaac.core.batch_evaluator import BatchEvaluator
+
+
+class TestBatchEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_directory.cleanup)
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'CHECKPOINT_DICTIONARY': {'c1': 'Checkpoint 1'},
+            'RESULT_PATH': 'results',
+            'RESULT_FILE': 'results.csv',
+            'ORIGINAL_RESULT_PATH': 'gold',
+            'ORIGINAL_RESULT_FILE': 'gold.csv',
+            'FIGURE_PATH': 'figures',
+            'FIGURE_FORMAT': 'png',
+            'SHOW_FIGURES': 'False',
+            'FEATURE_IMPORTANCE_METHOD': 'random_forest',
+            'TITLE_MATCH_CUTOFF': 0.9,
+            'EVALUATION_WORKERS': 2,
+            'RUN_COMPARISON_FILE': 'run_comparison',
+        }[key]
+        self.mock_context_manager.get_system_manager.return_value.get_full_path.side_effect = \
+            lambda relative_path: os.path.join(self.temporary_directory.name, relative_path)
+        self.mock_context_manager.get_result_saver.return_value.get_run_configuration_path.side_effect = \
+            lambda result_path: f"{result_path}.config.json"
+        os.makedirs(os.path.join(self.temporary_directory.name, 'results'))
+        os.makedirs(os.path.join(self.temporary_directory.name, 'gold'))
+        with open(os.path.join(self.temporary_directory.name, 'gold/gold.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['title', 'relevant'])
+            writer.writerows([('Paper A', True), ('Paper B', True), ('Paper C', False), ('Paper D', False)])
+
+        self.write_results('results_initial_mistral', [True, False, True, False])
+        self.write_results('results_initial_gemma', [True, True, False, False])
+        with open(self.get_path('results_initial_gemma.config.json'), 'w') as configuration_file:
+            json.dump({'config': {'RAG_MODEL': 'gemma:7b'}, 'fingerprint': 'abc', 'screening_seconds': 12.5},
+                      configuration_file)
+        self.evaluator = BatchEvaluator(self.mock_context_manager)
+
+    def get_path(self, file_name):
+        return os.path.join(self.temporary_directory.name, 'results', file_name)
+
+    def write_results(self, file_name, decisions):
+        with open(self.get_path(file_name), 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=['title', 'converted', 'embedded', 'relevant',
+                                                         'checkpoints', 'reasoning'])
+            writer.writeheader()
+            for title, relevant in zip(['Paper A', 'Paper B', 'Paper C', 'Paper D'], decisions):
+                writer.writerow({'title': title, 'converted': True, 'embedded': True, 'relevant': relevant,
+                                 'checkpoints': {'c1': relevant}, 'reasoning': {}})
+
+    def test_evaluate_runs(self):
+        with patch('aisaac.aisaac.core.evaluator.pd.read_csv', wraps=pd.read_csv) as mock_read_csv:
+            comparison = self.evaluator.evaluate_runs('results_*')
+        # the gold standard is read once for both runs
+        self.assertEqual(mock_read_csv.call_count, 3)
+
+        self.assertEqual([run['result_file'] for run in comparison],
+                         ['results_initial_gemma', 'results_initial_mistral'])
+        gemma, mistral = comparison
+        self.assertEqual((gemma['TP'], gemma['TN'], gemma['FP'], gemma['FN']), (2, 2, 0, 0))
+        self.assertEqual((gemma['fingerprint'], gemma['rag_model'], gemma['screening_seconds']),
+                         ('abc', 'gemma:7b', 12.5))
+        self.assertEqual(mistral['sensitivity'], 0.5)
+        self.assertIsNone(mistral['fingerprint'])
+
+        with open(self.get_path('run_comparison.json')) as json_file:
+            self.assertEqual(len(json.load(json_file)), 2)
+        saved_comparison = pd.read_csv(self.get_path('run_comparison.csv'))
+        self.assertEqual(saved_comparison['mcc'].tolist(), [run['mcc'] for run in comparison])
+
+        # the comparison tables are not evaluated as runs
+        self.assertEqual(len(self.evaluator.evaluate_runs('*', save=False)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+
+from aisaac.aisaac.utils.context_assembler import ContextAssembler, approximate_token_count
+from aisaac.aisaac.utils.pooled_models import PooledOllama
+
+
+class TestContextAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'MAX_NEW_TOKENS': 100,
+            'TOKEN_COUNTER': 'approximate',
+            'BATCH_PROMPT_SIZE': 1,
+        }[key]
+        self.mock_context_manager.get_model_manager.return_value.get_context_window.return_value = 200
+        self.context_assembler = ContextAssembler(self.mock_context_manager)
+
+    @staticmethod
+    def chunk(words, score):
+        # every word of four letters is one token
+        return Document(page_content=" ".join(["word"] * words)), score
+
+    def test_approximate_token_count(self):
+        self.assertEqual(approximate_token_count("word word, word."), 5)
+        self.assertEqual(approximate_token_count("thyroidectomy"), 4)
+
+    def test_everything_fits(self):
+        context = self.context_assembler.assemble([[self.chunk(10, 0.9)], [self.chunk(10, 0.8)]])
+        self.assertEqual(context.count("word"), 20)
+
+    def test_lowest_scoring_chunks_are_dropped(self):
+        # 100 tokens are left for the context. The second checkpoint needs 43 of them including the separator
+        results = [[self.chunk(20, 0.5), self.chunk(30, 0.9), self.chunk(10, 0.1)], [self.chunk(40, 0.7)]]
+        context = self.context_assembler.assemble(results)
+        kept = [len(part.split()) for part in context.split(ContextAssembler.separator)]
+        self.assertEqual(kept, [30, 20, 40])
+
+    def test_unused_share_goes_to_other_checkpoints(self):
+        results = [[self.chunk(5, 0.9)], [self.chunk(45, 0.9), self.chunk(40, 0.8)]]
+        context = self.context_assembler.assemble(results, reserved_tokens=0)
+        self.assertEqual(context.count("word"), 90)
+
+    def test_reserved_tokens_shrink_the_budget(self):
+        context = self.context_assembler.assemble([[self.chunk(30, 0.9)]], reserved_tokens=80)
+        self.assertEqual(context, "")
+
+    def test_no_context_without_budget(self):
+        self.assertIsNone(self.context_assembler.assemble([[self.chunk(10, 0.9)]], reserved_tokens=100))
+
+    def test_configure_model_sets_window_and_new_tokens(self):
+        model = PooledOllama(base_url='http://test', model='test')
+        self.context_assembler.configure_model(model)
+        self.assertEqual(model.num_ctx, 200)
+        self.assertEqual(model.num_predict, 100)
+
+    def test_generation_limit_leaves_the_model_unchanged(self):
+        model = PooledOllama(base_url='http://test', model='test')
+        self.assertEqual(ContextAssembler.get_generation_limit(model, 16), {'num_predict': 16})
+        self.assertIsNone(model.num_predict)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+from unittest.mock import patch
 
 from aisaac.aisaac.utils.context_manager import ContextManager
 
@@ -20,6 +21,44 @@ class TestContextManager(unittest.TestCase):
         # Test getting a nonexistent configuration variable
         self.assertIsNone(self.context_manager.get_config('NONEXISTENT_KEY'))
 
+    @patch('aisaac.aisaac.utils.context_manager.ModelManager')
+    def test_services_are_shared(self, MockModelManager):
+        # Test that services are built once and shared
+        self.assertIs(self.context_manager.get_model_manager(), self.context_manager.get_model_manager())
+        self.assertIs(self.context_manager.get_system_manager(), self.context_manager.get_system_manager())
+        MockModelManager.assert_called_once_with(self.context_manager)
+
+    @patch('aisaac.aisaac.utils.context_manager.ModelManager')
+    def test_set_config_invalidates_services(self, MockModelManager):
+        # Test that only the services reading a changed key are rebuilt
+        MockModelManager.side_effect = lambda context_manager: object()
+        model_manager = self.context_manager.get_model_manager()
+        system_manager = self.context_manager.get_system_manager()
+        self.context_manager.set_config('RESULT_FILE', 'other_results.csv')
+        self.assertIs(self.context_manager.get_model_manager(), model_manager)
+        self.context_manager.set_config('RAG_MODEL', 'other-model:latest')
+        self.assertIsNot(self.context_manager.get_model_manager(), model_manager)
+        self.assertIs(self.context_manager.get_system_manager(), system_manager)
+
+    @patch('aisaac.aisaac.utils.context_manager.SimilaritySearcher')
+    @patch('aisaac.aisaac.utils.context_manager.ModelManager')
+    def test_set_config_invalidates_dependent_services(self, MockModelManager, MockSimilaritySearcher):
+        # Test that services built from an invalidated service are rebuilt as well
+        MockSimilaritySearcher.side_effect = lambda context_manager: object()
+        similarity_searcher = self.context_manager.get_similarity_searcher()
+        self.context_manager.set_config('EMBEDDING_MODEL', 'other-embedding:latest')
+        self.assertIsNot(self.context_manager.get_similarity_searcher(), similarity_searcher)
+
+    def test_run_configuration_fingerprint(self):
+        # Test that only the keys deciding the results change the fingerprint, and that secrets are not saved
+        self.context_manager.set_config('COHERE_API_KEY', 'secret')
+        run_configuration = self.context_manager.get_run_configuration()
+        self.assertNotIn('COHERE_API_KEY', run_configuration['config'])
+        self.context_manager.set_config('RESULT_FILE', 'other_results.csv')
+        self.assertEqual(self.context_manager.get_run_configuration()['fingerprint'], run_configuration['fingerprint'])
+        self.assertNotEqual(self.context_manager.get_run_configuration(RAG_MODEL='other-model:latest')['fingerprint'],
+                            run_configuration['fingerprint'])
+
 
 if __name__ == '__main__':
     unittest.main()
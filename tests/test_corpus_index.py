@@ -0,0 +1,107 @@
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from aisaac.aisaac.utils.corpus_index import CorpusIndex
+from aisaac.aisaac.utils.system_manager import SystemManager
+
+
+def make_vectorstore(embeddings):
+    vectorstore = MagicMock()
+    vectorstore._collection.count.return_value = len(embeddings)
+    vectorstore._collection.get.return_value = {
+        'ids': [str(i) for i in range(len(embeddings))],
+        'embeddings': embeddings,
+        'documents': [f"chunk {i}" for i in range(len(embeddings))],
+        'metadatas': [{'source': 'test.pdf'} for _ in embeddings],
+    }
+    return vectorstore
+
+
+class TestCorpusIndex(unittest.TestCase):
+
+    dtype = 'float32'
+    # the tolerance of the scores of the stored embeddings; rescored scores always use the exact embeddings
+    raw_places = 5
+    raw_rtol = 1e-6
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'BASE_DIR': self.temp_dir.name,
+            'CORPUS_INDEX_PATH': 'corpus_index',
+            'SIMILARITY_SEARCH_K': '2',
+            'CORPUS_INDEX_DTYPE': self.dtype,
+            'CORPUS_INDEX_RESCORE': 'True',
+            'CORPUS_INDEX_RESCORE_FACTOR': '4',
+        }[key]
+        self.mock_context_manager.get_system_manager.return_value = SystemManager(self.mock_context_manager)
+        embedding = self.mock_context_manager.get_model_manager.return_value.get_embedding.return_value
+        embedding.embed_query.side_effect = lambda text: {'x': [1.0, 0.0], 'y': [0.0, 1.0]}.get(text, [0.6, 0.8])
+
+        self.corpus_index = CorpusIndex(self.mock_context_manager)
+        self.corpus_index.build({
+            'title1.pdf': make_vectorstore([[1.0, 0.0], [0.0, 2.0]]),
+            'title2.pdf': make_vectorstore([[3.0, 3.0]]),
+            'empty.pdf': make_vectorstore([]),
+        })
+
+    def test_build_creates_title_rows(self):
+        self.assertEqual(self.corpus_index.titles, ['title1', 'title2'])
+        self.assertEqual(self.corpus_index.title_rows['title2'], (2, 3))
+        np.testing.assert_allclose(np.linalg.norm(self.corpus_index.exact_embeddings, axis=1), 1.0, rtol=1e-6)
+
+    def test_search_across_titles(self):
+        results = self.corpus_index.search('x')
+        self.assertEqual([document.page_content for document, _score in results], ['chunk 0', 'chunk 0'])
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+
+    def test_search_restricted_to_titles(self):
+        results = self.corpus_index.search('x', k=1, titles=['title2.pdf'])
+        self.assertEqual(len(results), 1)
+        self.assertAlmostEqual(results[0][1], 2 ** -0.5, places=5)
+
+    def test_title_max_score_matrix(self):
+        matrix = self.corpus_index.get_title_max_score_matrix(['x', 'y'])
+        np.testing.assert_allclose(matrix, [[1.0, 1.0], [2 ** -0.5, 2 ** -0.5]], rtol=self.raw_rtol)
+        self.assertEqual(self.corpus_index.get_title_of_row(2), 'title2')
+
+    def test_load_from_disk(self):
+        loaded_index = CorpusIndex(self.mock_context_manager)
+        self.assertTrue(loaded_index.load())
+        self.assertEqual(loaded_index.storage_dtype, self.dtype)
+        self.assertAlmostEqual(loaded_index.get_title_max_scores('y')['title1'], 1.0, places=self.raw_places)
+
+    def test_quantization_report(self):
+        report = self.corpus_index.get_quantization_report(['x', 'y', 'z'], k=1)
+        self.assertEqual(report['recall_at_k_rescored'], 1.0)
+        self.assertGreaterEqual(report['scan_compression_ratio'], 1.0)
+        # the exact copy kept for rescoring is counted on disk
+        exact_copy_bytes = 0 if self.dtype == 'float32' else report['float32_bytes']
+        self.assertGreater(report['disk_bytes'], report['scan_bytes'] + exact_copy_bytes)
+
+
+class TestFloat16CorpusIndex(TestCorpusIndex):
+    dtype = 'float16'
+    raw_places = 2
+    raw_rtol = 1e-2
+
+
+class TestInt8CorpusIndex(TestCorpusIndex):
+    dtype = 'int8'
+    raw_places = 2
+    raw_rtol = 1e-2
+
+    def test_quantize_int8(self):
+        matrix = np.array([[0.5, -1.0], [0.0, 0.0]], dtype=np.float32)
+        quantized, scales = CorpusIndex.quantize_int8(matrix)
+        self.assertEqual(quantized.dtype, np.int8)
+        np.testing.assert_allclose(quantized * scales[:, None], matrix, atol=1e-2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -199,8 +199,30 @@ class TestVectorDataManager(unittest.TestCase):
         mock_get_vectorstore.assert_any_call('title1')
         mock_get_vectorstore.assert_any_call('title2')
 
-
-# Additional tests for get_unified_vectorstore, get_vectorstore_with_sigmoid_relevance_score_fn can be added similarly
+    def test_relevance_calibration_of_unit_vectors(self):
+        db = MagicMock()
+        db._collection.metadata = None
+        db._collection.get.return_value = {'embeddings': [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]]}
+        calibration = self.vector_data_manager._VectorDataManager__calibrate_relevance_scores(db)
+        self.assertEqual(calibration['method'], 'cosine')
+        relevance_score_fn = VectorDataManager.get_relevance_score_fn(calibration)
+        self.assertAlmostEqual(relevance_score_fn(0.0), 1.0)
+        self.assertAlmostEqual(relevance_score_fn(3.0), 0.0)
+
+    def test_relevance_calibration_of_unnormalized_vectors(self):
+        db = MagicMock()
+        db._collection.metadata = {'hnsw:space': 'l2'}
+        db._collection.get.return_value = {'embeddings': [[i * 3.0, 10.0 - i] for i in range(10)]}
+        calibration = self.vector_data_manager._VectorDataManager__calibrate_relevance_scores(db)
+        self.assertEqual(calibration['method'], 'logistic')
+        relevance_score_fn = VectorDataManager.get_relevance_score_fn(calibration)
+        self.assertAlmostEqual(relevance_score_fn(calibration['center']), 0.5)
+        self.assertGreater(relevance_score_fn(0.0), relevance_score_fn(calibration['center'] * 2))
+        for distance in [0.0, 1e3, 1e9]:
+            self.assertTrue(0.0 <= relevance_score_fn(distance) <= 1.0)
+
+
+# Additional tests for get_unified_vectorstore, get_relevance_calibration can be added similarly
 import unittest
 
 
@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import MagicMock
+
+from aisaac.aisaac.utils.early_stopping import EarlyStopping
+
+
+class TestEarlyStopping(unittest.TestCase):
+
+    @staticmethod
+    def create_early_stopping(rule, **config):
+        mock_context_manager = MagicMock()
+        config = {'EARLY_STOPPING': rule, 'TARGET_RECALL': 0.95, 'EARLY_STOPPING_MIN_SCREENED': 10,
+                  'EARLY_STOPPING_WINDOW': 20, 'EARLY_STOPPING_PATIENCE': 5, 'EARLY_STOPPING_PSEUDO_COUNT': 1,
+                  **config}
+        mock_context_manager.get_config.side_effect = config.get
+        return EarlyStopping(mock_context_manager)
+
+    def test_no_rule_never_stops(self):
+        early_stopping = self.create_early_stopping('none')
+        early_stopping.reset(total=1000)
+        for i in range(500):
+            early_stopping.update(f"Title{i}", False)
+        self.assertFalse(early_stopping.is_enabled())
+        self.assertFalse(early_stopping.should_stop())
+
+    def screen_until_stopped(self, early_stopping, decisions):
+        for screened, relevant in enumerate(decisions, start=1):
+            early_stopping.update(f"Title{screened}", relevant)
+            if early_stopping.should_stop():
+                return screened
+        return len(decisions)
+
+    def test_recall_rule_stops_once_relevant_documents_run_dry(self):
+        early_stopping = self.create_early_stopping('recall')
+        early_stopping.reset(total=300)
+        screened = self.screen_until_stopped(early_stopping, [True] * 50 + [False] * 250)
+        # the window of 20 documents has to be free of relevant documents
+        self.assertEqual(screened, 70)
+        self.assertGreaterEqual(early_stopping.get_estimated_recall(), 0.95)
+
+    def test_recall_rule_saves_most_of_a_large_corpus(self):
+        early_stopping = self.create_early_stopping('recall', EARLY_STOPPING_MIN_SCREENED=100,
+                                                    EARLY_STOPPING_WINDOW=50)
+        for total, includes in ((10000, 50), (2000, 40)):
+            early_stopping.reset(total=total)
+            screened = self.screen_until_stopped(early_stopping, [True] * includes + [False] * (total - includes))
+            # the run stops once the minimum is screened and the last window holds no relevant document
+            self.assertEqual(screened, max(100, includes + 50))
+            self.assertLess(screened / total, 0.1)
+
+    def test_recall_rule_continues_while_relevant_documents_are_found(self):
+        early_stopping = self.create_early_stopping('recall')
+        early_stopping.reset(total=10000)
+        # one relevant document in every 20 suggests hundreds are left
+        decisions = ([True] * 50 + [False] * 19 + [True]) * 10
+        self.assertEqual(self.screen_until_stopped(early_stopping, decisions), len(decisions))
+        self.assertFalse(early_stopping.should_stop())
+
+    def test_recall_rule_needs_enough_relevant_documents(self):
+        early_stopping = self.create_early_stopping('recall')
+        early_stopping.reset(total=10000)
+        # with the pseudo-count of one, five relevant documents give an estimated recall of 5 / 6
+        self.assertEqual(self.screen_until_stopped(early_stopping, [True] * 5 + [False] * 500), 505)
+
+    def test_no_rule_stops_before_the_minimum(self):
+        early_stopping = self.create_early_stopping('consecutive_irrelevant')
+        early_stopping.reset(total=100)
+        for i in range(9):
+            early_stopping.update(f"Title{i}", None)
+        self.assertFalse(early_stopping.should_stop())
+        early_stopping.update('Title9', False)
+        self.assertTrue(early_stopping.should_stop())
+
+    def test_consecutive_irrelevant_rule_restarts_after_a_relevant_document(self):
+        early_stopping = self.create_early_stopping('consecutive_irrelevant', EARLY_STOPPING_MIN_SCREENED=0)
+        early_stopping.reset(total=100)
+        for relevant in [False] * 4 + [True] + [False] * 4:
+            early_stopping.update('Title', relevant)
+        self.assertFalse(early_stopping.should_stop())
+        early_stopping.update('Title', False)
+        self.assertTrue(early_stopping.should_stop())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import threading
+import unittest
+
+from langchain_core.embeddings import Embeddings
+
+from aisaac.aisaac.utils.embedding_batcher import EmbeddingBatcher
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(('documents', list(texts)))
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(('query', [text]))
+        return [float(len(text)), 1.0]
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.embeddings = CountingEmbeddings()
+        self.batcher = EmbeddingBatcher(self.embeddings, max_batch_size=64, max_wait_ms=200)
+        self.addCleanup(self.batcher.close)
+
+    def test_concurrent_calls_are_combined(self):
+        results = {}
+        barrier = threading.Barrier(8)
+
+        def embed(index):
+            barrier.wait()
+            results[index] = self.batcher.embed_documents(['x' * index, 'y' * (index + 10)])
+
+        threads = [threading.Thread(target=embed, args=(index,)) for index in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index in range(1, 9):
+            self.assertEqual(results[index], [[float(index), 0.0], [float(index + 10), 0.0]])
+        self.assertLess(len(self.embeddings.calls), 8)
+        self.assertEqual(self.batcher.get_statistics()['calls'], 8)
+
+    def test_queries_keep_their_embedding_kind(self):
+        self.assertEqual(self.batcher.embed_query('abc'), [3.0, 1.0])
+        self.assertEqual(self.batcher.embed_documents(['abc']), [[3.0, 0.0]])
+        self.assertEqual([kind for kind, _texts in self.embeddings.calls], ['query', 'documents'])
+
+    def test_batches_are_split_at_the_maximum_size(self):
+        batcher = EmbeddingBatcher(self.embeddings, max_batch_size=2, max_wait_ms=1)
+        self.addCleanup(batcher.close)
+        self.assertEqual(len(batcher.embed_documents(['a', 'bb', 'ccc'])), 3)
+        self.assertEqual([len(texts) for _kind, texts in self.embeddings.calls], [2, 1])
+
+    def test_errors_reach_every_caller(self):
+        def fail(texts):
+            raise ValueError("server down")
+
+        self.embeddings.embed_documents = fail
+        with self.assertRaises(ValueError):
+            self.batcher.embed_documents(['a'])
+
+    def test_missing_embeddings_reach_the_callers_and_keep_the_worker(self):
+        self.embeddings.embed_documents = lambda texts: [[1.0, 0.0]]
+        with self.assertRaises(ValueError):
+            self.batcher.embed_documents(['a', 'bb'])
+
+        self.embeddings.embed_documents = CountingEmbeddings().embed_documents
+        self.assertEqual(self.batcher.embed_documents(['abc']), [[3.0, 0.0]])
+        self.assertTrue(self.batcher.worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import cohen_kappa_score
+
+from aisaac.aisaac.core import resampling
+from aisaac.aisaac.core.evaluator import Evaluator
+
+
+class TestEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_directory.cleanup)
+        self.checkpoints = {'c1': 'Checkpoint 1', 'c2': 'Checkpoint 2'}
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'CHECKPOINT_DICTIONARY': self.checkpoints,
+            'RESULT_PATH': 'results',
+            'RESULT_FILE': 'results.csv',
+            'ORIGINAL_RESULT_PATH': 'gold',
+            'ORIGINAL_RESULT_FILE': 'gold.csv',
+            'FIGURE_PATH': 'figures',
+            'FIGURE_FORMAT': 'png',
+            'SHOW_FIGURES': 'False',
+            'FEATURE_IMPORTANCE_METHOD': 'random_forest',
+            'TITLE_MATCH_CUTOFF': 0.9,
+        }[key]
+        self.mock_context_manager.get_system_manager.return_value.get_full_path.side_effect = \
+            lambda relative_path: os.path.join(self.temporary_directory.name, relative_path)
+        os.makedirs(os.path.join(self.temporary_directory.name, 'results'))
+        os.makedirs(os.path.join(self.temporary_directory.name, 'gold'))
+
+        self.write_results([
+            ('Paper A', True, {'c1': True, 'c2': True}),
+            ('Paper B', False, {'c1': True, 'c2': False}),
+            ('Paper C', True, {'c1': True, 'c2': True}),
+            ('Paper D', False, {'c1': False, 'c2': False}),
+            ('Paper E', None, {}),
+        ])
+        self.write_gold_standard([('Paper A', True), ('Paper B', True), ('Paper C', False), ('Paper D', False),
+                                  ('Paper E', True)])
+        self.evaluator = Evaluator(self.mock_context_manager)
+
+    def write_results(self, rows, file_name='results/results.csv'):
+        with open(os.path.join(self.temporary_directory.name, file_name), 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=['title', 'converted', 'embedded', 'relevant',
+                                                         'checkpoints', 'reasoning'])
+            writer.writeheader()
+            for title, relevant, checkpoints in rows:
+                writer.writerow({'title': title, 'converted': True, 'embedded': True, 'relevant': relevant,
+                                 'checkpoints': checkpoints, 'reasoning': {}})
+
+    def write_gold_standard(self, rows):
+        with open(os.path.join(self.temporary_directory.name, 'gold/gold.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['title', 'relevant'])
+            writer.writerows(rows)
+
+    def test_confusion_counts(self):
+        self.assertEqual(self.evaluator.get_tp_tn_fp_fn(), (1, 1, 1, 1))
+        self.assertEqual(self.evaluator.get_completion_rate(), 0.8)
+
+    def test_results_dataframe_has_a_column_per_checkpoint(self):
+        results = self.evaluator.get_results_dataframe()
+        self.assertEqual(list(results.columns), ['title', 'relevant', 'c1', 'c2'])
+        self.assertEqual(results.loc[1, 'c2'], False)
+
+    def test_json_and_legacy_checkpoints_are_parsed(self):
+        column = pd.Series(['{"c1": true, "c2": "False"}', "{'c1': False, 'c2': True}", None,
+                            '{"c1": true, "c2": "False"}'])
+        checkpoints = self.evaluator.parse_checkpoint_column(column)
+        self.assertEqual(checkpoints['c1'].tolist(), [True, False, None, True])
+        self.assertEqual(checkpoints['c2'].tolist(), [False, True, None, False])
+
+    def test_files_are_parsed_once_per_version(self):
+        with patch.object(self.evaluator, 'read_results_dataframe',
+                          wraps=self.evaluator.read_results_dataframe) as mock_read:
+            evaluation = self.evaluator.get_evaluation_dict()
+            self.evaluator.get_benchmarking_scores()
+            self.assertEqual(mock_read.call_count, 1)
+            self.assertEqual(evaluation['TP'], 1)
+
+            # a changed result file is parsed again
+            self.write_results([('Paper A', True, {'c1': True, 'c2': True}),
+                                ('Paper B', True, {'c1': True, 'c2': True})])
+            self.assertEqual(self.evaluator.get_tp_tn_fp_fn(), (2, 0, 0, 0))
+            self.assertEqual(mock_read.call_count, 2)
+
+    def test_bootstrap_intervals_contain_the_estimate(self):
+        intervals = self.evaluator.get_bootstrap_intervals(n_resamples=500, seed=1)
+        self.assertEqual(set(intervals), {'mcc', 'kappa', 'f1', 'pabak', 'sensitivity', 'specificity'})
+        self.assertAlmostEqual(intervals['mcc']['estimate'], self.evaluator.calculate_mcc(1, 1, 1, 1))
+        self.assertAlmostEqual(intervals['pabak']['estimate'], self.evaluator.calculate_pabak())
+        for interval in intervals.values():
+            self.assertLessEqual(interval['lower'], interval['estimate'])
+            self.assertGreaterEqual(interval['upper'], interval['estimate'])
+        self.assertEqual(intervals, self.evaluator.get_bootstrap_intervals(n_resamples=500, seed=1))
+
+    def test_bootstrap_metrics_match_the_evaluator(self):
+        metrics = resampling.calculate_metrics(np.array([30]), np.array([50]), np.array([10]), np.array([5]))
+        y_true = np.array([True] * 35 + [False] * 60)
+        y_pred = np.array([True] * 30 + [False] * 5 + [True] * 10 + [False] * 50)
+        self.assertAlmostEqual(metrics['mcc'][0], self.evaluator.calculate_mcc(30, 50, 10, 5))
+        self.assertAlmostEqual(metrics['kappa'][0], cohen_kappa_score(y_true, y_pred))
+        self.assertAlmostEqual(metrics['f1'][0], self.evaluator.calculate_f_score(30, 10, 5))
+
+    def test_compare_result_files(self):
+        self.write_results([('Paper A', True, {}), ('Paper B', True, {}), ('Paper C', False, {}),
+                            ('Paper D', False, {})], file_name='results/other.csv')
+        other_result_path = os.path.join(self.temporary_directory.name, 'results/other.csv')
+
+        comparison = self.evaluator.compare_result_files(other_result_path, n_resamples=500, seed=1)
+        self.assertAlmostEqual(comparison['sensitivity']['difference'], -0.5)
+        self.assertAlmostEqual(comparison['specificity']['difference'], -0.5)
+        self.assertLessEqual(comparison['pabak']['lower'], comparison['pabak']['difference'])
+        self.assertTrue(0 < comparison['mcc']['p_value'] <= 1)
+
+        comparison = self.evaluator.compare_result_files(self.evaluator.full_result_path, n_resamples=200, seed=1)
+        self.assertEqual(comparison['mcc']['difference'], 0)
+        self.assertEqual(comparison['mcc']['p_value'], 1)
+
+    def test_figures_are_saved_without_showing_them(self):
+        with patch('matplotlib.pyplot.show') as mock_show:
+            figure_path = self.evaluator.draw_confusion_matrix(self.evaluator.generate_confusion_matrix(1, 1, 1, 1))
+            mock_show.assert_not_called()
+        self.assertEqual(figure_path, os.path.join(self.temporary_directory.name, 'figures',
+                                                   'results_confusion_matrix.png'))
+        self.assertTrue(os.path.exists(figure_path))
+
+    def test_mutual_information_matches_sklearn(self):
+        from sklearn.metrics import mutual_info_score
+        importances = self.evaluator.get_feature_importance(method='mutual_information')
+        X, y = self.evaluator.get_feature_matrix()
+        expected = np.array([mutual_info_score(X[:, column].astype(bool), y.astype(bool))
+                             for column in range(X.shape[1])])
+        np.testing.assert_allclose(importances, expected / expected.sum())
+
+    def test_feature_importance_is_cached_until_the_results_change(self):
+        Evaluator.clear_feature_importance_cache()
+        self.addCleanup(Evaluator.clear_feature_importance_cache)
+        with patch.object(Evaluator, 'get_trained_classifier', wraps=self.evaluator.get_trained_classifier) \
+                as mock_train:
+            importances = self.evaluator.get_feature_importance()
+            # another evaluator of the same file reuses the importances
+            np.testing.assert_array_equal(Evaluator(self.mock_context_manager).get_feature_importance(), importances)
+            self.assertEqual(mock_train.call_count, 1)
+            self.assertAlmostEqual(self.evaluator.get_feature_importance(method='logistic').sum(), 1)
+
+            self.write_results([('Paper A', True, {'c1': True, 'c2': False}),
+                                ('Paper B', False, {'c1': False, 'c2': False})])
+            self.evaluator.get_feature_importance()
+            self.assertEqual(mock_train.call_count, 2)
+
+    def test_sweep_decision_rules(self):
+        confidences = {'Paper A': {'c1': 0.9, 'c2': 0.8}, 'Paper B': {'c1': 0.7, 'c2': 0.4},
+                       'Paper C': {'c1': 0.6, 'c2': 0.55}}
+        results = pd.read_csv(self.evaluator.full_result_path)
+        results['confidence'] = [json.dumps(confidences.get(title, {})) for title in results['title']]
+        results.to_csv(self.evaluator.full_result_path, index=False)
+
+        sweep = self.evaluator.sweep_decision_rules(thresholds=[0.5, 0.6])
+        self.assertEqual(len(sweep), 2 + 2 + 2 + 2)
+        self.assertEqual(sweep['mcc'].tolist(), sorted(sweep['mcc'], reverse=True))
+
+        def counts(rule, parameter):
+            row = sweep[(sweep['rule'] == rule) & (sweep['parameter'] == parameter)].iloc[0]
+            return row['TP'], row['TN'], row['FP'], row['FN']
+
+        # the rule used while screening gives the counts of the evaluation
+        self.assertEqual(counts('k_of_n', 2), self.evaluator.get_tp_tn_fp_fn())
+        self.assertEqual(counts('k_of_n', 1), (2, 1, 1, 0))
+        self.assertEqual(counts('drop_one', 'c2'), (2, 1, 1, 0))
+        self.assertEqual(counts('min_probability', 0.5), (1, 1, 1, 1))
+        self.assertEqual(counts('mean_probability', 0.6), (1, 2, 0, 1))
+
+    def test_titles_are_matched_through_the_title_index(self):
+        self.write_results([('paper a.pdf', True, {'c1': True, 'c2': True}),
+                            ('Paper  B', False, {'c1': True, 'c2': False}),
+                            ('Paper X', True, {'c1': True, 'c2': True})])
+        self.assertEqual(self.evaluator.get_tp_tn_fp_fn(), (1, 0, 0, 1))
+
+        report = self.evaluator.get_title_match_report()
+        self.assertEqual(report['normalized'], 2)
+        self.assertEqual(report['unmatched_titles'], ['Paper X'])
+        self.assertEqual(report['unmatched_index_titles'], ['Paper C', 'Paper D', 'Paper E'])
+
+
+if __name__ == '__main__':
+    unittest.main()
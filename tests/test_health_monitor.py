@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from aisaac.aisaac.utils.health_monitor import HealthMonitor
+
+
+class TestHealthMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'CIRCUIT_FAILURE_THRESHOLD': 2,
+            'HEALTH_BACKOFF_INITIAL': 0.01,
+            'HEALTH_BACKOFF_MAX': 0.04,
+        }[key]
+        self.http_transport = MagicMock()
+        self.health_monitor = HealthMonitor(self.mock_context_manager, self.http_transport, 'http://test/api/tags')
+        self.addCleanup(self.health_monitor.stop)
+
+    def test_backoff_grows_up_to_the_maximum(self):
+        for attempt, delay in enumerate([0.01, 0.02, 0.04, 0.04]):
+            backoff = self.health_monitor.get_backoff(attempt)
+            self.assertGreaterEqual(backoff, delay / 2)
+            self.assertLessEqual(backoff, delay)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.http_transport.get.side_effect = requests.exceptions.ConnectionError()
+        self.health_monitor.record_failure()
+        self.assertTrue(self.health_monitor.is_available())
+        self.health_monitor.record_failure()
+        self.assertFalse(self.health_monitor.is_available())
+        self.assertFalse(self.health_monitor.wait_until_available(0.05))
+
+    def test_probe_closes_circuit_when_server_is_back(self):
+        self.http_transport.get.side_effect = [requests.exceptions.ConnectionError(), MagicMock(status_code=200)]
+        self.health_monitor.record_failure()
+        self.health_monitor.record_failure()
+        self.assertTrue(self.health_monitor.wait_until_available(5))
+        self.assertEqual(self.health_monitor.state, HealthMonitor.CLOSED)
+        self.assertEqual(self.http_transport.get.call_count, 2)
+
+    def test_stop_ends_the_probes_until_the_next_wait(self):
+        self.http_transport.get.side_effect = requests.exceptions.ConnectionError()
+        self.health_monitor.record_failure()
+        self.health_monitor.record_failure()
+        self.health_monitor.stop()
+        self.assertFalse(self.health_monitor.probe_thread.is_alive())
+
+        self.http_transport.get.side_effect = None
+        self.http_transport.get.return_value = MagicMock(status_code=200)
+        self.assertTrue(self.health_monitor.wait_until_available(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+
+from aisaac.aisaac.utils.http_transport import HttpTransport
+from aisaac.aisaac.utils.pooled_models import PooledOllama, PooledOllamaEmbeddings, PooledXinferenceEmbeddings
+
+
+class FakeModelServer(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        status = 200
+        if self.path == '/api/embed':
+            # an Ollama server before 0.3
+            status, body = 404, json.dumps({'error': 'not found'})
+        elif self.path == '/api/embeddings':
+            body = json.dumps({'embedding': [float(len(request['prompt'])), 1.0]})
+        elif request.get('model') == 'missing':
+            # a model that was not pulled
+            status, body = 404, json.dumps({'error': 'model not found'})
+        elif self.path == '/v1/embeddings':
+            body = json.dumps({'data': [{'index': i, 'embedding': [float(len(text))]}
+                                        for i, text in enumerate(request['input'])]})
+        else:
+            body = "\n".join([json.dumps({'response': 'Hello', 'done': False}),
+                              json.dumps({'response': ' world', 'done': True, 'load_duration': 5,
+                                          'eval_duration': 7})])
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeModelServer)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'HTTP_POOL_SIZE': '2',
+            'HTTP_CONNECT_TIMEOUT': '5',
+            'HTTP_READ_TIMEOUT': '5',
+            'HTTP_KEEP_ALIVE': 'True',
+            'HTTP_MAX_RETRIES': '0',
+        }[key]
+        self.http_transport = HttpTransport(self.mock_context_manager)
+        self.addCleanup(self.http_transport.close)
+
+    def test_connections_are_reused(self):
+        embeddings = PooledOllamaEmbeddings(base_url=self.url, model='test', embed_instruction='',
+                                            http_transport=self.http_transport)
+        vectors = embeddings.embed_documents(['a', 'bb', 'ccc', 'dddd'])
+        self.assertEqual([vector[0] for vector in vectors], [1.0, 2.0, 3.0, 4.0])
+        statistics = self.http_transport.get_statistics()
+        self.assertEqual(statistics['requests'], 4)
+        self.assertEqual(statistics['connections_opened'], 1)
+        self.assertEqual(statistics['reused_connections'], 3)
+
+    def test_batch_endpoint_falls_back_to_single_texts(self):
+        embeddings = PooledOllamaEmbeddings(base_url=self.url, model='test', embed_instruction='',
+                                            http_transport=self.http_transport, batch_endpoint=True)
+        vectors = embeddings.embed_documents(['a', 'bb'])
+        self.assertEqual([vector[0] for vector in vectors], [1.0, 2.0])
+        self.assertFalse(embeddings.batch_endpoint)
+
+    def test_pooled_ollama_streams_through_pool(self):
+        model = PooledOllama(base_url=self.url, model='test', http_transport=self.http_transport)
+        self.assertEqual(model.invoke('Say hello'), 'Hello world')
+        self.assertEqual(self.http_transport.get_statistics()['requests'], 1)
+
+    def test_pooled_ollama_reports_final_line(self):
+        final_lines = []
+        model = PooledOllama(base_url=self.url, model='test', http_transport=self.http_transport,
+                             response_callback=final_lines.append)
+        self.assertEqual(model.invoke('Say hello'), 'Hello world')
+        self.assertEqual(len(final_lines), 1)
+        self.assertEqual(final_lines[0]['load_duration'], 5)
+        self.assertEqual(final_lines[0]['client_tokens'], 2)
+        self.assertFalse(final_lines[0]['stopped_early'])
+
+    def test_pooled_ollama_reports_streams_stopped_early(self):
+        final_lines = []
+        model = PooledOllama(base_url=self.url, model='test', http_transport=self.http_transport,
+                             response_callback=final_lines.append)
+        stream = model.stream('Say hello')
+        self.assertEqual(next(stream), 'Hello')
+        stream.close()
+        self.assertEqual(len(final_lines), 1)
+        self.assertTrue(final_lines[0]['stopped_early'])
+        self.assertEqual(final_lines[0]['client_tokens'], 1)
+        self.assertGreaterEqual(final_lines[0]['client_seconds'], final_lines[0]['client_first_token_seconds'])
+
+    def test_pooled_ollama_releases_connections_of_failed_calls(self):
+        missing_model = PooledOllama(base_url=self.url, model='missing', http_transport=self.http_transport)
+        model = PooledOllama(base_url=self.url, model='test', http_transport=self.http_transport)
+        results = []
+
+        def call_models():
+            # more failed calls than the pool has connections
+            for _ in range(3):
+                with self.assertRaises(OllamaEndpointNotFoundError):
+                    missing_model.invoke('Say hello')
+            results.append(model.invoke('Say hello'))
+
+        thread = threading.Thread(target=call_models, daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertEqual(results, ['Hello world'])
+
+    def test_pooled_xinference_embeddings_are_batched(self):
+        embeddings = PooledXinferenceEmbeddings(self.url, 'uid', self.http_transport)
+        self.assertEqual(embeddings.embed_documents(['a', 'bb']), [[1.0], [2.0]])
+        self.assertEqual(self.http_transport.get_statistics()['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
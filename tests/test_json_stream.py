@@ -0,0 +1,26 @@
+import unittest
+
+from aisaac.aisaac.utils.json_stream import JsonCompletionDetector
+
+
+class TestJsonCompletionDetector(unittest.TestCase):
+
+    def test_complete_after_closing_brace(self):
+        detector = JsonCompletionDetector()
+        self.assertFalse(detector.feed('```json\n{"checkpoints": {"a": '))
+        self.assertFalse(detector.feed('true}'))
+        self.assertTrue(detector.feed(', "reasoning": {}}\n```'))
+
+    def test_braces_in_strings_are_ignored(self):
+        detector = JsonCompletionDetector()
+        self.assertFalse(detector.feed('{"reasoning": "a set {x} and a \\"quoted } brace\\""'))
+        self.assertTrue(detector.feed('}'))
+
+    def test_text_before_the_object_is_ignored(self):
+        detector = JsonCompletionDetector()
+        self.assertFalse(detector.feed('Here is "my" answer } '))
+        self.assertTrue(detector.feed('{}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
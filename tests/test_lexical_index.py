@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from aisaac.aisaac.utils.lexical_index import LexicalIndex
+
+
+class TestLexicalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.lexical_index = LexicalIndex().build([
+            "Papillary thyroid carcinoma in adult patients.",
+            "Non-invasive follicular thyroid neoplasm with papillary-like nuclear features (NIFTP).",
+            "Experiments were performed on cell lines and mice.",
+        ], [{'start_index': 0}, {'start_index': 50}, {'start_index': 140}])
+
+    def test_search_finds_exact_term(self):
+        results = self.lexical_index.search("NIFTP", k=4)
+        self.assertEqual(len(results), 1)
+        self.assertIn("NIFTP", results[0][0].page_content)
+        self.assertEqual(results[0][0].metadata, {'start_index': 50})
+        self.assertEqual(results[0][1], 1.0)
+
+    def test_search_ranks_by_bm25(self):
+        results = self.lexical_index.search("papillary thyroid carcinoma", k=4)
+        self.assertEqual(len(results), 2)
+        self.assertIn("carcinoma", results[0][0].page_content)
+        self.assertLess(results[1][1], 1.0)
+
+    def test_search_without_matches(self):
+        self.assertEqual(self.lexical_index.search("the study", k=4), [])
+
+    def test_contains_terms(self):
+        self.assertTrue(self.lexical_index.contains_terms(["cell lines", "niftp"]))
+        self.assertFalse(self.lexical_index.contains_terms(["Hurthle cell"]))
+
+    def test_contains_terms_needs_adjacent_words(self):
+        self.assertTrue(self.lexical_index.contains_terms(["Papillary thyroid"]))
+        self.assertFalse(self.lexical_index.contains_terms(["lines cell"]))
+        self.assertFalse(self.lexical_index.contains_terms(["thyroid papillary"]))
+
+    def test_contains_terms_without_tokens_is_not_found(self):
+        self.assertFalse(self.lexical_index.contains_terms(["the"]))
+        self.assertFalse(self.lexical_index.contains_terms(["niftp", "of the"]))
+        self.assertFalse(self.lexical_index.contains_terms(["study"]))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "lexical_index.pkl")
+            self.lexical_index.save(path)
+            loaded_index = LexicalIndex.load(path)
+        self.assertEqual(loaded_index.search("mice", k=1)[0][0].page_content, self.lexical_index.documents[2])
+
+    def test_load_rebuilds_chunk_tokens_of_older_indexes(self):
+        del self.lexical_index.chunk_tokens
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "lexical_index.pkl")
+            self.lexical_index.save(path)
+            loaded_index = LexicalIndex.load(path)
+        self.assertTrue(loaded_index.contains_terms(["cell lines"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
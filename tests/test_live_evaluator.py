@@ -0,0 +1,81 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from aisaac.aisaac.core.live_evaluator import LiveEvaluator
+
+
+class TestLiveEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_directory.cleanup)
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: {
+            'CHECKPOINT_DICTIONARY': {'c1': 'Checkpoint 1'},
+            'RESULT_PATH': 'results',
+            'RESULT_FILE': 'results.csv',
+            'ORIGINAL_RESULT_PATH': 'gold',
+            'ORIGINAL_RESULT_FILE': 'gold.csv',
+            'FIGURE_PATH': 'figures',
+            'FIGURE_FORMAT': 'png',
+            'SHOW_FIGURES': 'False',
+            'FEATURE_IMPORTANCE_METHOD': 'random_forest',
+            'TITLE_MATCH_CUTOFF': 0.9,
+            'LIVE_METRICS_INTERVAL': 2,
+            'LIVE_METRICS_FILE': 'live_metrics.jsonl',
+        }[key]
+        self.mock_context_manager.get_system_manager.return_value.get_full_path.side_effect = \
+            lambda relative_path: os.path.join(self.temporary_directory.name, relative_path)
+        os.makedirs(os.path.join(self.temporary_directory.name, 'results'))
+        os.makedirs(os.path.join(self.temporary_directory.name, 'gold'))
+        with open(os.path.join(self.temporary_directory.name, 'gold/gold.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['title', 'relevant'])
+            writer.writerows([('Paper A', True), ('Paper B', True), ('Paper C', False), ('Paper D', False)])
+        self.evaluator = LiveEvaluator(self.mock_context_manager)
+        self.result_saver = self.mock_context_manager.get_result_saver.return_value
+
+    def test_counts_follow_the_responses(self):
+        self.evaluator.start(total=4)
+        self.result_saver.add_listener.assert_called_once_with(self.evaluator.update)
+        self.evaluator.update('Paper A', True)
+        self.evaluator.update('Paper B', False)
+        self.evaluator.update('Paper C', True)
+        self.evaluator.update('Paper D', None)
+
+        metrics = self.evaluator.get_live_metrics()
+        self.assertEqual((metrics['TP'], metrics['TN'], metrics['FP'], metrics['FN']), (1, 0, 1, 1))
+        self.assertEqual(metrics['screened'], 4)
+        self.assertEqual(metrics['evaluated'], 3)
+        self.assertEqual(metrics['completion_rate'], 1.0)
+        self.assertEqual(metrics['sensitivity'], 0.5)
+        self.assertEqual(metrics['specificity'], 0.0)
+
+    def test_screening_a_title_again_replaces_its_result(self):
+        self.evaluator.start()
+        self.evaluator.update('Paper B', False)
+        self.evaluator.update('Paper B', True)
+
+        metrics = self.evaluator.get_live_metrics()
+        self.assertEqual((metrics['TP'], metrics['FN']), (1, 0))
+        self.assertEqual(metrics['screened'], 1)
+
+    def test_snapshots_are_written_every_interval(self):
+        self.evaluator.start(total=4)
+        for title in ('Paper A', 'Paper B', 'Paper C'):
+            self.evaluator.update(title, True)
+        self.evaluator.stop()
+
+        self.result_saver.remove_listener.assert_called_once_with(self.evaluator.update)
+        with open(os.path.join(self.temporary_directory.name, 'results/live_metrics.jsonl')) as metrics_file:
+            snapshots = [json.loads(line) for line in metrics_file]
+        self.assertEqual([snapshot['screened'] for snapshot in snapshots], [2, 3])
+        self.assertEqual(snapshots[-1]['FP'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
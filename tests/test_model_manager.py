@@ -1,11 +1,17 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
-from aisaac.aisaac.utils import ModelManager
+from aisaac.aisaac.utils import EmbeddingBatcher, ModelManager
 
 
 class MyTestCase(unittest.TestCase):
 
+    def setUp(self):
+        ModelManager.clear_discovery_cache()
+        self.addCleanup(ModelManager.clear_discovery_cache)
+
     @patch('ollama.list', autospec=True)  # Direct reference to ollama.list as imported
     @patch('xinference.client.Client.list_models', autospec=True)  # Patching list_models of Client directly
     @patch('aisaac.aisaac.utils.context_manager.ContextManager', autospec=True)
@@ -16,7 +22,17 @@ class MyTestCase(unittest.TestCase):
             'LOCAL_MODELS': True,
             'MODEL_CLIENT_URL': 'http://localtest',
             'EMBEDDING_MODEL': 'local-embedding-model',
-            'RAG_MODEL': 'local-rag-model'
+            'RAG_MODEL': 'local-rag-model',
+            'HTTP_POOL_SIZE': 10,
+            'HTTP_CONNECT_TIMEOUT': 5,
+            'HTTP_READ_TIMEOUT': 600,
+            'HTTP_KEEP_ALIVE': 'True',
+            'HTTP_MAX_RETRIES': 2,
+            'CIRCUIT_FAILURE_THRESHOLD': 3,
+            'HEALTH_BACKOFF_INITIAL': 5,
+            'HEALTH_BACKOFF_MAX': 300,
+            'MODEL_DISCOVERY_TTL': 300,
+            'MODEL_CONTEXT_WINDOW': 8192
         }.get(key, None)
 
         model_manager = ModelManager(mock_context_manager)
@@ -36,7 +52,17 @@ class MyTestCase(unittest.TestCase):
             'LOCAL_MODELS': False,
             'MODEL_CLIENT_URL': 'http://externaltest',
             'EMBEDDING_MODEL': 'external-embedding-model',
-            'RAG_MODEL': 'external-rag-model'
+            'RAG_MODEL': 'external-rag-model',
+            'HTTP_POOL_SIZE': 10,
+            'HTTP_CONNECT_TIMEOUT': 5,
+            'HTTP_READ_TIMEOUT': 600,
+            'HTTP_KEEP_ALIVE': 'True',
+            'HTTP_MAX_RETRIES': 2,
+            'CIRCUIT_FAILURE_THRESHOLD': 3,
+            'HEALTH_BACKOFF_INITIAL': 5,
+            'HEALTH_BACKOFF_MAX': 300,
+            'MODEL_DISCOVERY_TTL': 300,
+            'MODEL_CONTEXT_WINDOW': 8192
         }.get(key, None)
 
         mock_client_instance = MockClient.return_value
@@ -50,6 +76,150 @@ class MyTestCase(unittest.TestCase):
         mock_client_instance.list_models.assert_called_once()
         mock_ollama_list.assert_not_called()
 
+    @patch('ollama.list', autospec=True)
+    @patch('aisaac.aisaac.utils.context_manager.ContextManager', autospec=True)
+    def test_warm_up_pins_and_unpins_local_models(self, MockContextManager, mock_ollama_list):
+        mock_ollama_list.return_value = {'models': [{'name': 'local-rag-model', 'digest': '1'},
+                                                    {'name': 'local-embedding-model', 'digest': '2'}]}
+        mock_context_manager = MockContextManager.return_value
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'LOCAL_MODELS': True,
+            'MODEL_CLIENT_URL': 'http://localtest',
+            'EMBEDDING_MODEL': 'local-embedding-model',
+            'RAG_MODEL': 'local-rag-model',
+            'HTTP_POOL_SIZE': 10,
+            'HTTP_CONNECT_TIMEOUT': 5,
+            'HTTP_READ_TIMEOUT': 600,
+            'HTTP_KEEP_ALIVE': 'True',
+            'HTTP_MAX_RETRIES': 2,
+            'CIRCUIT_FAILURE_THRESHOLD': 3,
+            'HEALTH_BACKOFF_INITIAL': 5,
+            'HEALTH_BACKOFF_MAX': 300,
+            'MODEL_DISCOVERY_TTL': 300,
+            'MODEL_CONTEXT_WINDOW': 8192,
+            'MODEL_KEEP_ALIVE': '5m',
+            'MODEL_PIN_KEEP_ALIVE': '30m'
+        }.get(key, None)
+
+        model_manager = ModelManager(mock_context_manager)
+        model_manager.http_transport = MagicMock()
+        model_manager.http_transport.post.return_value.status_code = 200
+
+        latencies = model_manager.warm_up(pin=True)
+
+        self.assertEqual(set(latencies.keys()), {'local-rag-model', 'local-embedding-model'})
+        loaded_models = [call.kwargs['json']['model'] for call in model_manager.http_transport.post.call_args_list]
+        self.assertEqual(set(loaded_models), {'local-rag-model', 'local-embedding-model'})
+        # the models are pinned with a finite keep-alive, so that they are unloaded even if the run is killed
+        self.assertEqual(model_manager.get_rag_model().keep_alive, '30m')
+        self.assertEqual(model_manager.get_embedding().keep_alive, '30m')
+        keep_alives = {call.kwargs['json']['keep_alive'] for call in model_manager.http_transport.post.call_args_list}
+        self.assertEqual(keep_alives, {'30m'})
+
+        model_manager.unpin_models()
+
+        self.assertEqual(model_manager.get_rag_model().keep_alive, '5m')
+        self.assertEqual(model_manager.http_transport.post.call_args.kwargs['json']['keep_alive'], '5m')
+
+        # the final line of a generation is reported separately as load and inference latency
+        model_manager.get_rag_model().response_callback({'done': True, 'load_duration': 3e9,
+                                                         'prompt_eval_duration': 1e9, 'eval_duration': 2e9,
+                                                         'total_duration': 6e9})
+        report = model_manager.get_latency_report()
+        self.assertEqual(report['generations'], 1)
+        self.assertEqual(report['cold_generations'], 1)
+        self.assertAlmostEqual(report['mean_load_seconds'], 3.0)
+        self.assertAlmostEqual(report['mean_decode_seconds'], 2.0)
+
+        # a generation stopped early only has the durations measured by the client
+        model_manager.get_rag_model().response_callback({'client_seconds': 1.5, 'client_first_token_seconds': 0.5,
+                                                         'client_tokens': 40, 'stopped_early': True})
+        report = model_manager.get_latency_report()
+        self.assertEqual(report['generations'], 2)
+        self.assertEqual(report['stopped_early_generations'], 1)
+        self.assertAlmostEqual(report['mean_decode_seconds'], 2.0)
+        self.assertAlmostEqual(report['mean_wall_seconds'], 1.5)
+        self.assertAlmostEqual(report['mean_generated_tokens'], 20)
+
+
+    @patch('ollama.list', autospec=True)
+    @patch('aisaac.aisaac.utils.context_manager.ContextManager', autospec=True)
+    def test_micro_batching_keeps_the_embedding_endpoint(self, MockContextManager, mock_ollama_list):
+        mock_ollama_list.return_value = {'models': [{'name': 'local-rag-model', 'digest': '1'},
+                                                    {'name': 'local-embedding-model', 'digest': '2'}]}
+        config = {
+            'LOCAL_MODELS': True,
+            'MODEL_CLIENT_URL': 'http://localtest',
+            'EMBEDDING_MODEL': 'local-embedding-model',
+            'RAG_MODEL': 'local-rag-model',
+            'HTTP_POOL_SIZE': 10,
+            'HTTP_CONNECT_TIMEOUT': 5,
+            'HTTP_READ_TIMEOUT': 600,
+            'HTTP_KEEP_ALIVE': 'True',
+            'HTTP_MAX_RETRIES': 2,
+            'CIRCUIT_FAILURE_THRESHOLD': 3,
+            'HEALTH_BACKOFF_INITIAL': 5,
+            'HEALTH_BACKOFF_MAX': 300,
+            'MODEL_DISCOVERY_TTL': 300,
+            'MODEL_CONTEXT_WINDOW': 8192,
+            'EMBEDDING_MICRO_BATCHING': 'True',
+            'EMBEDDING_BATCH_SIZE': 64,
+            'EMBEDDING_BATCH_WAIT_MS': 5,
+        }
+        mock_context_manager = MockContextManager.return_value
+        mock_context_manager.get_config.side_effect = lambda key: config.get(key, None)
+
+        # the batch endpoint returns normalized embeddings, so batching alone must not switch to it
+        embedding = ModelManager(mock_context_manager).get_embedding()
+        self.assertIsInstance(embedding, EmbeddingBatcher)
+        self.assertFalse(embedding.embedding.batch_endpoint)
+
+        config['EMBEDDING_BATCH_ENDPOINT'] = 'True'
+        ModelManager.clear_discovery_cache()
+        self.assertTrue(ModelManager(mock_context_manager).get_embedding().embedding.batch_endpoint)
+
+    @patch('ollama.list', autospec=True)
+    @patch('aisaac.aisaac.utils.context_manager.ContextManager', autospec=True)
+    def test_model_discovery_is_cached(self, MockContextManager, mock_ollama_list):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        mock_ollama_list.return_value = {'models': [{'name': 'local-rag-model', 'digest': '1'},
+                                                    {'name': 'local-embedding-model', 'digest': '2'}]}
+        mock_context_manager = MockContextManager.return_value
+        mock_context_manager.get_system_manager.return_value.make_directory.return_value = temporary_directory.name
+        config = {
+            'LOCAL_MODELS': True,
+            'MODEL_CLIENT_URL': 'http://localtest',
+            'EMBEDDING_MODEL': 'local-embedding-model',
+            'RAG_MODEL': 'local-rag-model',
+            'HTTP_POOL_SIZE': 10,
+            'HTTP_CONNECT_TIMEOUT': 5,
+            'HTTP_READ_TIMEOUT': 600,
+            'HTTP_KEEP_ALIVE': 'True',
+            'HTTP_MAX_RETRIES': 2,
+            'CIRCUIT_FAILURE_THRESHOLD': 3,
+            'HEALTH_BACKOFF_INITIAL': 5,
+            'HEALTH_BACKOFF_MAX': 300,
+            'MODEL_DISCOVERY_TTL': 300,
+            'MODEL_CONTEXT_WINDOW': 8192,
+            'MODEL_DISCOVERY_CACHE': 'True',
+            'BIN_HIGH_LEVEL_FOLDER': 'bin'
+        }
+        mock_context_manager.get_config.side_effect = lambda key: config.get(key, None)
+
+        ModelManager(mock_context_manager)
+        ModelManager(mock_context_manager)
+        mock_ollama_list.assert_called_once()
+        self.assertTrue(os.path.exists(os.path.join(temporary_directory.name, 'model_discovery.json')))
+
+        # after a restart, the cached list on disk is used even when it is stale and the server is down
+        ModelManager.clear_discovery_cache()
+        config['MODEL_DISCOVERY_TTL'] = 0
+        mock_ollama_list.side_effect = ConnectionError("server down")
+        model_manager = ModelManager(mock_context_manager)
+        self.assertEqual(model_manager.model_uids, {'local-rag-model': '1', 'local-embedding-model': '2'})
+        self.assertIsNotNone(model_manager.my_chat_model)
+
 
 if __name__ == '__main__':
     unittest.main()
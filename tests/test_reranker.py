@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from langchain_core.documents import Document
+
+from aisaac.aisaac.utils.reranker import CohereReranker, LocalReranker, Reranker
+
+
+class TestLocalReranker(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {'RERANK_TOP_N': '2', 'RERANK_EMBEDDING_WEIGHT': '0', 'RERANK_CACHE_SIZE': '100'}
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: self.config[key]
+        self.results = [(Document(page_content="mice and rats"), 0.9),
+                        (Document(page_content="human patients with thyroid cancer"), 0.8),
+                        (Document(page_content="thyroid cancer cell lines"), 0.7)]
+
+    def test_rerank_by_term_coverage(self):
+        reranker = LocalReranker(self.mock_context_manager)
+        results = reranker.rerank("thyroid cancer in human patients", self.results)
+        self.assertEqual([doc.page_content for doc, _score in results],
+                         ["human patients with thyroid cancer", "thyroid cancer cell lines"])
+        self.assertEqual(results[0][1], 1.0)
+        self.mock_context_manager.get_model_manager.assert_not_called()
+
+    def test_rerank_batch_scores_each_pair_once(self):
+        reranker = LocalReranker(self.mock_context_manager)
+        reranker.score_pairs = MagicMock(side_effect=lambda pairs: [0.5] * len(pairs))
+        reranker.rerank_batch([("query 1", self.results), ("query 2", self.results)])
+        reranker.rerank_batch([("query 1", self.results)])
+        reranker.score_pairs.assert_called_once()
+        self.assertEqual(len(reranker.score_pairs.call_args[0][0]), 6)
+
+    def test_rerank_cache_drops_least_recently_used_scores(self):
+        self.config['RERANK_CACHE_SIZE'] = '4'
+        reranker = LocalReranker(self.mock_context_manager)
+        reranker.score_pairs = MagicMock(side_effect=lambda pairs: [0.5] * len(pairs))
+        reranker.rerank_batch([("query 1", self.results)])
+        results = reranker.rerank_batch([("query 2", self.results)])[0]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len(reranker.cache), 4)
+        # the oldest scores of query 1 were dropped, its last chunk is still cached
+        reranker.rerank_batch([("query 1", self.results[2:])])
+        self.assertEqual(reranker.score_pairs.call_count, 2)
+        reranker.rerank_batch([("query 1", self.results[:1])])
+        self.assertEqual(reranker.score_pairs.call_count, 3)
+
+    def test_reranker_without_scoring_cannot_be_created(self):
+        with self.assertRaises(TypeError):
+            Reranker(self.mock_context_manager)
+
+    def test_rerank_with_embeddings(self):
+        self.config['RERANK_EMBEDDING_WEIGHT'] = '1'
+        embedding = self.mock_context_manager.get_model_manager.return_value.get_embedding.return_value
+        embedding.embed_query.return_value = [1.0, 0.0]
+        embedding.embed_documents.side_effect = lambda texts: [[0.0, 1.0] if "mice" in text else [1.0, 1.0]
+                                                               for text in texts]
+        reranker = LocalReranker(self.mock_context_manager)
+        results = reranker.rerank("query", self.results)
+        embedding.embed_documents.assert_called_once()
+        self.assertNotIn("mice and rats", [doc.page_content for doc, _score in results])
+
+
+class TestCohereReranker(unittest.TestCase):
+
+    def test_needs_api_key(self):
+        mock_context_manager = MagicMock()
+        config = {'RERANK_TOP_N': '3', 'RERANK_CACHE_SIZE': '100'}
+        mock_context_manager.get_config.side_effect = lambda key: config.get(key)
+        with patch.dict('os.environ', {}, clear=True):
+            with self.assertRaises(ValueError):
+                CohereReranker(mock_context_manager)
+
+
+if __name__ == '__main__':
+    unittest.main()
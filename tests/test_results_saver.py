@@ -62,6 +62,12 @@ class TestResultSaver(unittest.TestCase):
 
     # Additional tests for create_new_result_entry, get_result_list, and set_up_new_results_file can be added similarly
 
+    def test_convert_confidence(self):
+        confidence = {'cp1': 0.8, 'cp2': '75%', 'cp3': 'high', 'cp4': 150, 'cp5': 90}
+        converted = ResultSaver.convert_confidence(confidence, ['cp1', 'cp2', 'cp3', 'cp4', 'cp5', 'cp6'])
+        self.assertEqual(converted, {'cp1': 0.8, 'cp2': 0.75, 'cp3': None, 'cp4': 1.0, 'cp5': 0.9, 'cp6': None})
+        self.assertEqual(ResultSaver.convert_confidence(None, ['cp1']), {'cp1': None})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,11 @@
 import unittest
 from unittest.mock import patch, MagicMock
 
+import numpy as np
+from requests.exceptions import ConnectionError, ReadTimeout
+
 from aisaac.aisaac.core.screener import Screener
+from aisaac.aisaac.utils.pooled_models import ModelServerError
 
 
 class TestScreener(unittest.TestCase):
@@ -27,6 +31,121 @@ class TestScreener(unittest.TestCase):
             mock_craft.assert_any_call('Title1', {'checkpoint1': 'Check1'})
             mock_craft.assert_any_call('Title2', {'checkpoint1': 'Check1'})
 
+    @patch('aisaac.aisaac.utils.Logger')
+    def test_do_screening_requeues_titles_after_connection_errors(self, mock_logger):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'MAX_SCREENING_RETRIES': 1,
+            'HEALTH_WAIT_TIMEOUT': 1,
+            'WARM_UP_MODELS': 'False',
+        }.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        screener.dm.get_runnable_titles.return_value = ['Title1', 'Title2']
+        response = {'checkpoints': {'checkpoint1': True}}
+
+        with patch.object(screener, 'craft_screening_response_for',
+                          side_effect=[ConnectionError(), ConnectionError(), response, ConnectionError()]) as mock_craft:
+            screener.do_screening({'checkpoint1': 'Check1'})
+
+            # Title1 succeeds on its second attempt, Title2 is given up after two attempts
+            self.assertEqual(mock_craft.call_count, 4)
+            self.assertEqual([call.args[0] for call in mock_craft.call_args_list],
+                             ['Title1', 'Title2', 'Title1', 'Title2'])
+            screener.result_saver.save_response.assert_called_once_with(response, 'Title1')
+            self.assertEqual(screener.failed_titles, ['Title2'])
+            self.assertEqual(screener.health_monitor.record_failure.call_count, 3)
+
+    @patch('aisaac.aisaac.utils.Logger')
+    def test_do_screening_retries_timeouts_and_records_other_failures(self, mock_logger):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'MAX_SCREENING_RETRIES': 1,
+            'HEALTH_WAIT_TIMEOUT': 1,
+            'WARM_UP_MODELS': 'False',
+        }.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        screener.dm.get_runnable_titles.return_value = ['Title1', 'Title2']
+        response = {'checkpoints': {'checkpoint1': True}}
+
+        with patch.object(screener, 'craft_screening_response_for',
+                          side_effect=[ReadTimeout(), KeyError('checkpoint1'), response]) as mock_craft:
+            screener.do_screening({'checkpoint1': 'Check1'})
+
+            self.assertEqual([call.args[0] for call in mock_craft.call_args_list], ['Title1', 'Title2', 'Title1'])
+            screener.result_saver.save_response.assert_called_once_with(response, 'Title1')
+            self.assertEqual(screener.failed_titles, ['Title2'])
+            screener.health_monitor.stop.assert_called()
+
+    @patch('aisaac.aisaac.utils.Logger')
+    def test_do_screening_retries_server_errors_but_not_client_errors(self, mock_logger):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'MAX_SCREENING_RETRIES': 1,
+            'HEALTH_WAIT_TIMEOUT': 1,
+            'WARM_UP_MODELS': 'False',
+        }.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        screener.dm.get_runnable_titles.return_value = ['Title1', 'Title2']
+        response = {'checkpoints': {'checkpoint1': True}}
+
+        with patch.object(screener, 'craft_screening_response_for',
+                          side_effect=[ModelServerError("status code 503"), ValueError("status code 400"),
+                                       response]) as mock_craft:
+            screener.do_screening({'checkpoint1': 'Check1'})
+
+            # the bad request of Title2 is not sent again and does not count as an outage
+            self.assertEqual([call.args[0] for call in mock_craft.call_args_list], ['Title1', 'Title2', 'Title1'])
+            self.assertEqual(screener.failed_titles, ['Title2'])
+            self.assertEqual(screener.health_monitor.record_failure.call_count, 1)
+
+    @patch('aisaac.aisaac.utils.Logger')
+    def test_do_screening_gives_up_when_the_server_stays_unavailable(self, mock_logger):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'HEALTH_WAIT_TIMEOUT': 0,
+            'WARM_UP_MODELS': 'False',
+        }.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        screener.dm.get_runnable_titles.return_value = ['Title1', 'Title2']
+        screener.health_monitor.wait_until_available.return_value = False
+
+        with patch.object(screener, 'craft_screening_response_for') as mock_craft:
+            screener.do_screening({'checkpoint1': 'Check1'})
+
+            mock_craft.assert_not_called()
+            self.assertEqual(screener.failed_titles, ['Title1', 'Title2'])
+            self.assertEqual(screener.health_monitor.stop.call_count, 2)
+
+    @patch('aisaac.aisaac.utils.Logger')
+    def test_do_screening_stops_early_in_priority_order(self, mock_logger):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'WARM_UP_MODELS': 'False',
+            'EARLY_STOPPING': 'consecutive_irrelevant',
+            'EARLY_STOPPING_MIN_SCREENED': 0,
+            'EARLY_STOPPING_PATIENCE': 2,
+        }.get(key, MagicMock())
+        corpus_index = mock_context_manager.get_corpus_index.return_value
+        corpus_index.exists.return_value = True
+        corpus_index.titles = ['Title1', 'Title2', 'Title3', 'Title4']
+        # the weakest checkpoint scores the documents: Title3, Title1, Title4, Title2
+        corpus_index.get_title_max_score_matrix.return_value = np.array(
+            [[0.9, 0.5], [0.1, 0.8], [0.7, 0.6], [0.3, 0.4]])
+        screener = Screener(mock_context_manager)
+        screener.dm.get_runnable_titles.return_value = ['Title1.pdf', 'Title2.pdf', 'Title3.pdf', 'Title4.pdf']
+        # the mocked ResultSaver calls the stopping rule the way its listeners are called
+        screener.result_saver.add_listener.side_effect = lambda listener: setattr(
+            screener.result_saver.save_response, 'side_effect',
+            lambda response, title: listener(title, response['relevant'], response['checkpoints']))
+
+        with patch.object(screener, 'craft_screening_response_for',
+                          return_value={'relevant': False, 'checkpoints': {}}) as mock_craft:
+            screener.do_screening({'checkpoint1': 'Check1', 'checkpoint2': 'Check2'})
+
+            self.assertEqual([call.args[0] for call in mock_craft.call_args_list], ['Title3.pdf', 'Title1.pdf'])
+            self.assertEqual(screener.skipped_titles, ['Title4.pdf', 'Title2.pdf'])
+            screener.result_saver.remove_listener.assert_called_once()
+
     @patch('aisaac.aisaac.core.screener.StructuredOutputParser.parse')
     @patch('aisaac.aisaac.utils.Logger')
     def test_craft_screening_response_for(self, mock_logger, mock_parse):
@@ -52,5 +171,140 @@ class TestScreener(unittest.TestCase):
         self.assertEqual(response, {'expected': 'parsed_output'})
 
 
+    def test_prefix_cache_layout_puts_context_last(self):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {'PROMPT_LAYOUT': 'prefix_cache'}.get(key,
+                                                                                                        MagicMock())
+        screener = Screener(mock_context_manager)
+        checkpoints = {'checkpoint1': 'Check1'}
+        format_instructions = screener.get_output_parser().get_format_instructions()
+
+        first_prompt = screener.create_prompt('First context', checkpoints, format_instructions)
+        second_prompt = screener.create_prompt('Second document', checkpoints, format_instructions)
+
+        prefix = first_prompt[:first_prompt.index('First context')]
+        self.assertTrue(second_prompt.startswith(prefix))
+        self.assertIn(format_instructions, prefix)
+
+    def test_compare_prompt_layouts(self):
+        mock_context_manager = MagicMock()
+        screener = Screener(mock_context_manager)
+        screener.create_context_text = MagicMock(return_value='Some context')
+        screener.mm.generation_statistics = []
+
+        predicted_prompts = []
+
+        def predict(prompt, **kwargs):
+            # the model is loaded by the first call, and a cached prefix makes the prefill faster
+            prefill_seconds = 1.0 if prompt.index('Some context') < prompt.index('Check1') else 0.25
+            if not predicted_prompts:
+                prefill_seconds = 10.0
+            predicted_prompts.append(prompt)
+            screener.mm.generation_statistics.append({'prefill_seconds': prefill_seconds, 'prompt_tokens': 10})
+            return '{}'
+
+        screener.mm.get_rag_model.return_value.predict.side_effect = predict
+        screener.context_assembler.get_generation_limit.return_value = {'num_predict': 16}
+        prompt_template = screener.prompt_template
+
+        report = screener.compare_prompt_layouts(['Title1', 'Title2'], {'checkpoint1': 'Check1'})
+
+        # every layout is warmed up with one untimed call, and the answers are capped
+        self.assertEqual(len(predicted_prompts), 6)
+        for call in screener.mm.get_rag_model.return_value.predict.call_args_list:
+            self.assertEqual(call.kwargs, {'num_predict': 16})
+        self.assertEqual(report['default']['generations'], 2)
+        self.assertEqual(report['default']['mean_prefill_seconds'], 1.0)
+        self.assertEqual(report['prefix_cache']['mean_prefill_seconds'], 0.25)
+        self.assertEqual(screener.prompt_template, prompt_template)
+
+
+    def test_batch_prompt_falls_back_for_incomplete_verdicts(self):
+        mock_context_manager = MagicMock()
+        screener = Screener(mock_context_manager)
+        screener.create_context_text = MagicMock(side_effect=lambda title, checkpoints: f"Context of {title}")
+        batch_answer = ('```json\n{"Title1": {"title": "Title1", "checkpoints": {"checkpoint1": true}, '
+                        '"reasoning": {"checkpoint1": "yes"}}, '
+                        '"title2": {"title": "Title2", "checkpoints": {"checkpoint1": "False"}, "reasoning": {}}, '
+                        '"Title3": {"title": "Title3", "checkpoints": {}}}\n```')
+        single_answer = ('```json\n{"title": "Title3", "checkpoints": {"checkpoint1": false}, '
+                         '"reasoning": {"checkpoint1": "no"}}\n```')
+        screener.mm.get_rag_model.return_value.predict.side_effect = [batch_answer, single_answer]
+
+        responses = screener.craft_screening_responses_for(['Title1.pdf', 'Title2.pdf', 'Title3.pdf'],
+                                                           {'checkpoint1': 'Check1'})
+
+        self.assertEqual(list(responses.keys()), ['Title1.pdf', 'Title2.pdf', 'Title3.pdf'])
+        self.assertEqual(responses['Title1.pdf']['checkpoints'], {'checkpoint1': True})
+        self.assertEqual(responses['Title2.pdf']['title'], 'Title2')
+        self.assertEqual(responses['Title3.pdf']['checkpoints'], {'checkpoint1': False})
+        self.assertEqual(screener.mm.get_rag_model.return_value.predict.call_count, 2)
+        self.assertEqual(screener.batch_statistics, {'batch_prompts': 1, 'batched_documents': 2,
+                                                     'fallback_documents': 1})
+
+
+    @patch('aisaac.aisaac.utils.Logger')
+    def test_batch_keeps_verdicts_when_a_fallback_fails(self, mock_logger):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {
+            'MAX_SCREENING_RETRIES': 1,
+            'HEALTH_WAIT_TIMEOUT': 1,
+            'WARM_UP_MODELS': 'False',
+            'BATCH_PROMPT_SIZE': 2,
+        }.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        screener.dm.get_runnable_titles.return_value = ['Title1.pdf', 'Title2.pdf']
+        screener.create_context_text = MagicMock(side_effect=lambda title, checkpoints: f"Context of {title}")
+        batch_answer = ('```json\n{"Title1": {"title": "Title1", "checkpoints": {"checkpoint1": true}, '
+                        '"reasoning": {}}}\n```')
+        single_answer = ('```json\n{"title": "Title2", "checkpoints": {"checkpoint1": false}, '
+                         '"reasoning": {"checkpoint1": "no"}}\n```')
+        screener.mm.get_rag_model.return_value.predict.side_effect = [batch_answer, ConnectionError(),
+                                                                      single_answer]
+
+        screener.do_screening({'checkpoint1': 'Check1'})
+
+        # Title1 is saved from the batch, only Title2 is screened again
+        saved_titles = [call.args[1] for call in screener.result_saver.save_response.call_args_list]
+        self.assertEqual(saved_titles, ['Title1', 'Title2'])
+        self.assertEqual(screener.mm.get_rag_model.return_value.predict.call_count, 3)
+        self.assertEqual(screener.failed_titles, [])
+
+
+    def test_streaming_generation_stops_when_answer_is_complete(self):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {'STREAMING_GENERATION': 'True'}.get(key,
+                                                                                                      MagicMock())
+        screener = Screener(mock_context_manager)
+        read_pieces = []
+
+        def stream(prompt):
+            for piece in ['```json\n{"title": "T", ', '"checkpoints": {"a": true}}', '\n```', ' and more text']:
+                read_pieces.append(piece)
+                yield piece
+
+        model = MagicMock()
+        model.stream.side_effect = stream
+
+        response_text = screener.generate(model, 'Some prompt')
+
+        self.assertEqual(response_text, '```json\n{"title": "T", "checkpoints": {"a": true}}')
+        self.assertEqual(len(read_pieces), 2)
+        model.predict.assert_not_called()
+
+    def test_verdict_only_schema_has_no_reasoning(self):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = lambda key: {'REASONING_MODE': 'none'}.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        self.assertNotIn('reasoning', screener.get_output_parser().get_format_instructions())
+
+    def test_confidence_schema(self):
+        mock_context_manager = MagicMock()
+        mock_context_manager.get_config.side_effect = \
+            lambda key: {'CHECKPOINT_CONFIDENCE': 'True'}.get(key, MagicMock())
+        screener = Screener(mock_context_manager)
+        self.assertIn('"confidence"', screener.get_output_parser().get_format_instructions())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1 +1,69 @@
-# TODO implement tests for similarity_searcher.py
+import unittest
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+
+from aisaac.aisaac.utils.lexical_index import LexicalIndex
+from aisaac.aisaac.utils.similarity_searcher import SimilaritySearcher
+
+
+class TestSimilaritySearcher(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {
+            'SIMILARITY_SEARCH_K': '2',
+            'RELEVANCE_THRESHOLD_CUTOFF': '0.7',
+            'APPLY_RERANKING': 'False',
+            'APPLY_RELEVANCE_THRESHOLD': 'True',
+            'RETRIEVAL_MODE': 'hybrid',
+            'RRF_K': '60',
+        }
+        self.mock_context_manager = MagicMock()
+        self.mock_context_manager.get_config.side_effect = lambda key: self.config[key]
+        vector_data_manager = self.mock_context_manager.get_vector_data_manager.return_value
+        vector_data_manager.get_vectorstore.return_value.similarity_search_with_relevance_scores.return_value = [
+            (Document(page_content="dense hit"), 0.9), (Document(page_content="weak hit"), 0.2)]
+        vector_data_manager.get_lexical_index.return_value = LexicalIndex().build(
+            ["dense hit", "a chunk about NIFTP", "weak hit"])
+
+    def test_hybrid_search_fuses_rankings(self):
+        searcher = SimilaritySearcher(self.mock_context_manager)
+        results = searcher.similarity_search("title", "NIFTP")
+        self.assertEqual([doc.page_content for doc, _score in results], ["dense hit", "a chunk about NIFTP"])
+        self.assertAlmostEqual(results[0][1], 0.5)
+
+    def test_lexical_search_needs_no_vectorstore(self):
+        self.config['RETRIEVAL_MODE'] = 'lexical'
+        searcher = SimilaritySearcher(self.mock_context_manager)
+        results = searcher.similarity_search("title", "NIFTP")
+        self.assertEqual([doc.page_content for doc, _score in results], ["a chunk about NIFTP"])
+        searcher.vector_data_manager.get_vectorstore.assert_not_called()
+
+    def test_vector_search_applies_threshold(self):
+        self.config['RETRIEVAL_MODE'] = 'vector'
+        searcher = SimilaritySearcher(self.mock_context_manager)
+        results = searcher.similarity_search("title", "NIFTP")
+        self.assertEqual([doc.page_content for doc, _score in results], ["dense hit"])
+
+    def test_vector_search_reads_the_default_threshold_flag(self):
+        self.config['RETRIEVAL_MODE'] = 'vector'
+        self.config['APPLY_RELEVANCE_THRESHOLD'] = True
+        searcher = SimilaritySearcher(self.mock_context_manager)
+        self.assertEqual(len(searcher.similarity_search("title", "NIFTP")), 1)
+        self.config['APPLY_RELEVANCE_THRESHOLD'] = 'False'
+        searcher = SimilaritySearcher(self.mock_context_manager)
+        self.assertEqual(len(searcher.similarity_search("title", "NIFTP")), 2)
+
+    def test_contains_terms(self):
+        searcher = SimilaritySearcher(self.mock_context_manager)
+        self.assertTrue(searcher.contains_terms("title", ["NIFTP"]))
+        self.assertFalse(searcher.contains_terms("title", ["Hurthle cell"]))
+
+    def test_unknown_retrieval_mode(self):
+        self.config['RETRIEVAL_MODE'] = 'graph'
+        with self.assertRaises(ValueError):
+            SimilaritySearcher(self.mock_context_manager)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unicodedata
+import unittest
+
+from aisaac.aisaac.utils.title_index import TitleIndex, canonicalize_title
+
+
+class TestTitleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.title_index = TitleIndex.from_decisions({
+            '"Thyroid cancer: a review"': 'True',
+            'Génétique du cancer': 'False',
+            'BRAF V600E mutations in papillary thyroid carcinoma': 'true',
+            'Undecided paper': '',
+        }, fuzzy_cutoff=0.9)
+
+    def test_canonicalize_title(self):
+        self.assertEqual(canonicalize_title(' "Thyroid  Cancer - A Review.pdf" '), 'thyroid cancer a review')
+        self.assertEqual(canonicalize_title('v1.2 results'), 'v1 2 results')
+
+    def test_exact_normalized_and_fuzzy_matches(self):
+        self.assertEqual(self.title_index.match_with_method('Thyroid cancer: a review'),
+                         ('"Thyroid cancer: a review"', TitleIndex.EXACT))
+        # the decomposed accents of some file systems match the composed ones of the gold standard
+        self.assertEqual(self.title_index.match_with_method(unicodedata.normalize('NFD', 'Génétique du cancer')),
+                         ('Génétique du cancer', TitleIndex.EXACT))
+        self.assertEqual(self.title_index.match_with_method('thyroid cancer - a review.pdf'),
+                         ('"Thyroid cancer: a review"', TitleIndex.NORMALIZED))
+        self.assertEqual(self.title_index.match_with_method('BRAF V600E mutation in papillary thyroid carcinoma'),
+                         ('BRAF V600E mutations in papillary thyroid carcinoma', TitleIndex.FUZZY))
+        self.assertIsNone(self.title_index.match('A different paper'))
+        self.assertIsNone(self.title_index.match('Undecided paper'))
+
+        self.assertIs(self.title_index.get('thyroid cancer a review'), True)
+        self.assertIs(self.title_index.get('Génétique du cancer.pdf'), False)
+
+    def test_fuzzy_matching_is_opt_in(self):
+        title_index = TitleIndex(['BRAF V600E mutations in papillary thyroid carcinoma'])
+        self.assertIsNone(title_index.match('BRAF V600E mutation in papillary thyroid carcinoma'))
+
+    def test_fuzzy_matching_keeps_numbered_titles_apart(self):
+        title_index = TitleIndex(['Thyroid cancer outcomes: Part I', 'Thyroid cancer outcomes in the 2019 cohort'],
+                                 fuzzy_cutoff=0.9)
+        self.assertIsNone(title_index.match('Thyroid cancer outcomes: Part II'))
+        self.assertIsNone(title_index.match('Thyroid cancer outcomes in the 2018 cohort'))
+        self.assertEqual(title_index.match('Thyroid cancer outcome in the 2019 cohort'),
+                         'Thyroid cancer outcomes in the 2019 cohort')
+
+    def test_fuzzy_matches_never_take_a_matched_title(self):
+        title_index = TitleIndex(['Thyroid cancer outcomes in the 2019 cohort'], fuzzy_cutoff=0.9)
+        titles = ['Thyroid cancer outcomes in the 2019 cohort', 'Thyroid cancer outcome in the 2019 cohort',
+                  'thyroid cancer outcomes in the 2019 cohort.pdf']
+        positions, conflicts = title_index.match_positions(titles)
+        self.assertEqual(positions, {'Thyroid cancer outcomes in the 2019 cohort': 0})
+        self.assertEqual([title for title, _indexed_title, _claiming_title in conflicts], titles[2:] + titles[1:2])
+        # the order of the titles does not matter
+        positions, _conflicts = title_index.match_positions(titles[::-1])
+        self.assertEqual(positions, {'Thyroid cancer outcomes in the 2019 cohort': 2})
+
+    def test_match_report(self):
+        report = self.title_index.get_match_report(['Thyroid cancer: a review', 'A different paper',
+                                                    'BRAF V600E mutation in papillary thyroid carcinoma'])
+        self.assertEqual((report['exact'], report['normalized'], report['fuzzy']), (1, 0, 1))
+        self.assertEqual(report['unmatched_titles'], ['A different paper'])
+        self.assertEqual(report['unmatched_index_titles'], ['Génétique du cancer'])
+
+    def test_from_csv(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            path = os.path.join(temporary_directory, 'gold.csv')
+            with open(path, 'w') as csv_file:
+                csv_file.write('title,relevant\n"Paper, A",True\nPaper B,False\n')
+            title_index = TitleIndex.from_csv(path)
+        self.assertEqual(title_index.values, {'Paper, A': True, 'Paper B': False})
+
+
+if __name__ == '__main__':
+    unittest.main()